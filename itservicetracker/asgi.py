@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'itservicetracker.settings')
 
 application = get_asgi_application()
+
+# Warn in the worker log if it was started with performance-hostile settings
+from requests_app.checks import warn_on_startup  # noqa: E402
+from requests_app.suggestions import preload as preload_suggestions  # noqa: E402
+
+warn_on_startup()
+preload_suggestions()
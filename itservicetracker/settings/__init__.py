@@ -0,0 +1,25 @@
+"""
+Settings package for itservicetracker project.
+
+The DJANGO_ENV environment variable selects the profile loaded by
+DJANGO_SETTINGS_MODULE=itservicetracker.settings:
+
+    dev   (default) local development, DEBUG on
+    prod  hardened production profile, see prod.py
+
+A profile can also be selected directly, e.g.
+DJANGO_SETTINGS_MODULE=itservicetracker.settings.prod.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+_profile = os.getenv('DJANGO_ENV', 'dev')
+
+if _profile == 'dev':
+    from .dev import *  # noqa: F401,F403
+elif _profile == 'prod':
+    from .prod import *  # noqa: F401,F403
+else:
+    raise ImproperlyConfigured(f"Unknown DJANGO_ENV {_profile!r}; expected 'dev' or 'prod'")
@@ -0,0 +1,298 @@
+"""
+Base Django settings for itservicetracker project, shared by every profile.
+
+Generated by 'django-admin startproject' using Django 5.2.7. The dev and prod
+profiles in this package import everything from here and override what
+differs; see __init__.py for how one is selected.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.2/ref/settings/
+"""
+
+from pathlib import Path
+
+import os
+SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
+IT_TEAM_EMAIL = os.getenv('IT_TEAM_EMAIL', 'it-team@example.com')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@example.com')
+
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = os.getenv('DJANGO_SECRET_KEY', 'django-insecure-307fv$he1*b2j1p+%mz3dj4demel^x@gsao$z)01fb&_@z(#8w')
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = False
+
+ALLOWED_HOSTS = []
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'requests_app',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'requests_app.metrics.RequestMetricsMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'requests_app.middleware.LegacySessionBackendMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'requests_app.middleware.UserContextMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'itservicetracker.urls'
+
+TEMPLATES = [
+    {
+        # DjangoTemplates that also times renders for the request metrics
+        'BACKEND': 'requests_app.metrics.InstrumentedDjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+                'requests_app.context_processors.user_context',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'itservicetracker.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# cache (e.g. django.core.cache.backends.redis.RedisCache) in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/#configuring-the-session-engine
+# SESSION_BACKEND is one of 'cached_db' (default), 'signed_cookies', 'cache'
+# or 'db'. cached_db serves session reads from the cache and only falls back
+# to the database on a miss; signed_cookies avoids server-side storage.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.getenv('SESSION_BACKEND', 'cached_db')
+
+
+# Admission control (requests_app.throttling)
+# RATE_LIMITS are token buckets per scope, as (requests, seconds): 'user'
+# per signed-in user (or client IP), 'global' shared by everybody. With
+# LocMemCache each worker process keeps its own buckets.
+# CONCURRENCY_LIMITS cap simultaneous requests per worker process to
+# expensive views; extra requests wait CONCURRENCY_QUEUE_TIMEOUT seconds
+# for a slot and then get a 503.
+
+RATE_LIMITS = {
+    'submit_request': {'user': (10, 600), 'global': (120, 60)},
+    'suggest_category': {'user': (60, 60)},
+}
+CONCURRENCY_LIMITS = {
+    'dashboard': int(os.getenv('DASHBOARD_CONCURRENCY', '4')),
+    'request_list': int(os.getenv('REQUEST_LIST_CONCURRENCY', '4')),
+    'export': int(os.getenv('EXPORT_CONCURRENCY', '2')),
+}
+CONCURRENCY_QUEUE_TIMEOUT = 0.5
+CONCURRENCY_RETRY_AFTER = 5
+
+# Dashboard widgets load their data from JSON endpoints; each result is
+# cached (and refreshed by the page) every so many seconds.
+DASHBOARD_WIDGET_TIMEOUTS = {
+    'status': 30,
+    'categories': 300,
+    'trend': 900,
+    'recent': 30,
+}
+
+
+# Authentication
+# Load the user profile together with the user on every authenticated request.
+# Sessions created before ProfileModelBackend store ModelBackend's path;
+# LegacySessionBackendMiddleware rewrites them to this backend.
+
+AUTHENTICATION_BACKENDS = [
+    'requests_app.backends.ProfileModelBackend',
+]
+
+
+# Admin
+# Performance mode skips full-table counts and DISTINCT scans on the admin
+# changelists so they stay usable on very large ticket tables.
+
+ADMIN_PERFORMANCE_MODE = os.getenv('ADMIN_PERFORMANCE_MODE', 'True') == 'True'
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_FILTER_CACHE_TIMEOUT = 600
+
+
+# Request metrics
+# Per-view histograms exposed on /metrics to staff, or to scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>". Requests slower than
+# METRICS_SLOW_REQUEST_SECONDS are logged with their SQL at the sample rate.
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_SLOW_REQUEST_SECONDS = float(os.getenv('METRICS_SLOW_REQUEST_SECONDS', '1.0'))
+METRICS_SLOW_SAMPLE_RATE = float(os.getenv('METRICS_SLOW_SAMPLE_RATE', '0.1'))
+
+
+# Service level agreements
+# Hours a request may stay Pending, per category, before the SLA scheduler
+# (`manage.py sla_scheduler`) escalates it
+
+SLA_TARGET_HOURS = {
+    'Password Reset': 4,
+    'Network Problem': 8,
+    'Printer Issue': 24,
+    'Software Installation': 48,
+    'Other': 72,
+}
+SLA_DEFAULT_TARGET_HOURS = 72
+SLA_ESCALATION_EMAIL = os.getenv('SLA_ESCALATION_EMAIL', IT_TEAM_EMAIL)
+
+# Near-duplicate detection: estimated Jaccard similarity of two descriptions
+# (over 5-character shingles) above which submitters get a warning
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.getenv('DUPLICATE_SIMILARITY_THRESHOLD', '0.5'))
+
+# Category suggestions and similar past resolutions (needs numpy and scipy;
+# train with `manage.py train_suggestions`)
+SUGGESTIONS_MODEL_DIR = Path(os.getenv('SUGGESTIONS_MODEL_DIR', BASE_DIR / 'var' / 'suggestions'))
+SUGGESTIONS_MIN_CATEGORY_SCORE = 0.1
+SUGGESTIONS_MIN_SIMILARITY = 0.2
+SUGGESTIONS_CACHE_TIMEOUT = 3600
+
+# Archival: `manage.py archive_requests` moves requests resolved more than
+# ARCHIVE_AFTER_DAYS ago to the archive tables. Archived requests still open
+# by URL and show up in searches (at most ARCHIVE_SEARCH_LIMIT at a time).
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_SEARCH_LIMIT = 50
+
+# Prebuilt management reports, written by `manage.py build_reports`
+REPORTS_DIR = Path(os.getenv('REPORTS_DIR', BASE_DIR / 'var' / 'reports'))
+# Builds kept per report; older version directories are deleted
+REPORTS_KEEP_VERSIONS = int(os.getenv('REPORTS_KEEP_VERSIONS', '5'))
+
+# Attachments: uploads are streamed to disk and hashed as they arrive, then
+# stored once per SHA-256 under ATTACHMENTS_ROOT (requests_app.attachments).
+# Thumbnails need Pillow.
+ATTACHMENTS_ROOT = Path(os.getenv('ATTACHMENTS_ROOT', BASE_DIR / 'var' / 'attachments'))
+ATTACHMENT_MAX_SIZE = 10 * 1024 * 1024
+ATTACHMENT_MAX_FILES = 5
+ATTACHMENT_ALLOWED_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'txt', 'log', 'pdf', 'zip')
+FILE_UPLOAD_HANDLERS = ['requests_app.attachments.HashingFileUploadHandler']
+THUMBNAIL_WORKERS = 2
+
+# Email import: `manage.py ingest_mail` turns mailed requests into tickets.
+# Replies from senders without an account are recorded as steps by this user.
+MAIL_INGEST_USERNAME = os.getenv('MAIL_INGEST_USERNAME', 'admin')
+
+# Online backups taken by `manage.py db_maintenance --backup`
+DB_BACKUP_DIR = Path(os.getenv('DB_BACKUP_DIR', BASE_DIR / 'var' / 'backups'))
+DB_BACKUP_KEEP = 7
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# CSRF settings
+CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
+CSRF_COOKIE_HTTPONLY = False
+CSRF_USE_SESSIONS = False
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.2/howto/static-files/
+
+STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed names plus precompressed .gz/.br
+# copies; see requests_app/storage.py
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'requests_app.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Serve STATIC_ROOT from Django itself (with far-future cache headers) when
+# there is no front-end web server to do it
+SERVE_STATIC = os.getenv('SERVE_STATIC', 'False') == 'True'
+
+# Standalone Tailwind CLI used by `manage.py build_assets`
+TAILWIND_CLI = os.getenv('TAILWIND_CLI', 'tailwindcss')
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
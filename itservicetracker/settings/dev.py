@@ -0,0 +1,12 @@
+"""
+Development settings: DEBUG on, permissive hosts, verbose errors.
+
+Never run long-lived production workers with this profile; with DEBUG on,
+Django records every SQL statement in connection.queries.
+"""
+
+from .base import *  # noqa: F401,F403
+
+DEBUG = True
+
+ALLOWED_HOSTS = ['localhost', '127.0.0.1', '[::1]']
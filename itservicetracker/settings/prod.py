@@ -0,0 +1,101 @@
+"""
+Production settings.
+
+Selected with DJANGO_ENV=prod. Requires DJANGO_SECRET_KEY and
+DJANGO_ALLOWED_HOSTS (comma separated) to be set in the environment.
+"""
+
+import copy
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+from .base import DATABASES, MIDDLEWARE, TEMPLATES
+
+DEBUG = False
+
+if 'DJANGO_SECRET_KEY' not in os.environ:
+    raise ImproperlyConfigured("DJANGO_SECRET_KEY must be set for the prod settings profile")
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+ALLOWED_HOSTS = [host.strip() for host in os.getenv('DJANGO_ALLOWED_HOSTS', '').split(',') if host.strip()]
+
+
+# Templates
+# Parse each template once per process instead of on every render
+
+TEMPLATES = copy.deepcopy(TEMPLATES)
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+
+
+# Middleware
+# Compress responses and answer conditional requests with 304s. GZip goes
+# right after SecurityMiddleware so it sees the final response body.
+
+MIDDLEWARE = MIDDLEWARE.copy()
+_after_security = MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1
+MIDDLEWARE[_after_security:_after_security] = [
+    'django.middleware.gzip.GZipMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
+]
+
+
+# Database
+# Keep connections open between requests instead of reconnecting each time
+
+DATABASES = copy.deepcopy(DATABASES)
+for _database in DATABASES.values():
+    _database['CONN_MAX_AGE'] = int(os.getenv('DJANGO_CONN_MAX_AGE', '600'))
+    _database['CONN_HEALTH_CHECKS'] = True
+
+
+# Security
+
+SESSION_COOKIE_SECURE = os.getenv('DJANGO_SECURE_COOKIES', 'True') == 'True'
+CSRF_COOKIE_SECURE = SESSION_COOKIE_SECURE
+
+
+# Logging
+# Warnings and errors to the console; SQL logging stays off so that no
+# per-query log records are built, whatever the root level.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'standard': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(process)d %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'standard',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv('DJANGO_LOG_LEVEL', 'WARNING'),
+    },
+    'loggers': {
+        'django.db.backends': {
+            'level': 'WARNING',
+            'propagate': True,
+        },
+        'django.request': {
+            'level': 'ERROR',
+            'propagate': True,
+        },
+        'requests_app': {
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
+            'propagate': True,
+        },
+    },
+}
@@ -1,37 +1,231 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth import get_user_model
-from .models import ServiceRequest, UserProfile, ResolutionStep
+from django.conf import settings
+from django.contrib import messages
+from django.db import DatabaseError, connection, transaction
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from .models import ServiceRequest, UserProfile, ResolutionStep, StatusTransition, ArchivedServiceRequest, ArchivedResolutionStep
 
 User = get_user_model()
 
+
+def _table_row_estimate(model):
+    """Row count of ``model``'s table from SQLite's planner statistics, or None."""
+    if connection.vendor != 'sqlite':
+        return None
+    try:
+        with connection.cursor() as cursor:
+            # sqlite_stat1 is written by ANALYZE (manage.py db_maintenance);
+            # the first number of each row is the table's row count
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [model._meta.db_table])
+            rows = cursor.fetchall()
+    except DatabaseError:
+        return None
+    return max((int(stat.split()[0]) for stat, in rows), default=None)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts the whole table.
+
+    Counts stop at ADMIN_COUNT_LIMIT rows, so a broad filter over a huge
+    table still returns quickly. Past that limit, unfiltered changelists
+    take the table's row count from the planner statistics, which are only
+    as stale as the last ANALYZE.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = getattr(settings, 'ADMIN_COUNT_LIMIT', 10000)
+        count = queryset.order_by()[:limit].count()
+        if count == limit and not queryset.query.has_filters():
+            count = max(count, _table_row_estimate(queryset.model) or 0)
+        return count
+
+
+class CachedValuesListFilter(admin.SimpleListFilter):
+    """
+    List filter whose choices are the distinct values of ``field_name``.
+
+    The choices are cached for ADMIN_FILTER_CACHE_TIMEOUT seconds instead of
+    being rebuilt with a DISTINCT scan on every changelist load. Set
+    ``label_field`` to show a related field (e.g. a username) as the label.
+    """
+    field_name = None
+    label_field = None
+
+    def lookups(self, request, model_admin):
+        key = f'admin-filter:{model_admin.model._meta.label_lower}:{self.field_name}'
+        choices = cache.get(key)
+        if choices is None:
+            label_field = self.label_field or self.field_name
+            choices = sorted(
+                model_admin.model._default_manager.order_by()
+                .values_list(self.field_name, label_field).distinct(),
+                key=lambda choice: str(choice[1]),
+            )
+            cache.set(key, choices, getattr(settings, 'ADMIN_FILTER_CACHE_TIMEOUT', 600))
+        return [(value, label) for value, label in choices if value not in (None, '')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.field_name: self.value()})
+        return queryset
+
+
+class DepartmentListFilter(CachedValuesListFilter):
+    title = 'department'
+    parameter_name = field_name = 'department'
+
+
+class CreatedByListFilter(CachedValuesListFilter):
+    title = 'created by'
+    parameter_name = field_name = 'created_by'
+    label_field = 'created_by__username'
+
+
+class PerformanceModeAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin that, while ADMIN_PERFORMANCE_MODE is on, skips the full
+    result count, estimates pagination counts and swaps in the cached
+    ``performance_list_filter`` for ``list_filter``.
+    """
+    performance_list_filter = None
+
+    @property
+    def performance_mode(self):
+        return getattr(settings, 'ADMIN_PERFORMANCE_MODE', False)
+
+    @property
+    def show_full_result_count(self):
+        return not self.performance_mode
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.performance_mode:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_list_filter(self, request):
+        if self.performance_mode and self.performance_list_filter is not None:
+            return self.performance_list_filter
+        return super().get_list_filter(request)
+
+
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(PerformanceModeAdmin):
     list_display = ('user', 'department')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'user__email', 'department')
     list_filter = ('department',)
+    performance_list_filter = (DepartmentListFilter,)
+    autocomplete_fields = ('user',)
 
 class ResolutionStepInline(admin.TabularInline):
     model = ResolutionStep
     extra = 1
     fields = ['step_number', 'description', 'created_by', 'created_at']
     readonly_fields = ['created_by', 'created_at']
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('created_by')
+
     def save_model(self, request, obj, form, change):
         if not obj.pk:
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
 
 @admin.register(ServiceRequest)
-class ServiceRequestAdmin(admin.ModelAdmin):
-    list_display = ['id', 'requester_name', 'department', 'category', 'status', 'created_at', 'resolved_at']
+class ServiceRequestAdmin(PerformanceModeAdmin):
+    list_display = ['id', 'requester_name', 'department', 'category', 'status', 'assigned_to', 'created_at', 'due_at', 'escalated_at', 'resolved_at']
+    list_select_related = ['assigned_to']
     list_filter = ['status', 'category', 'department', 'created_at']
+    performance_list_filter = ['status', 'category', DepartmentListFilter, 'created_at']
     search_fields = ['requester_name', 'department', 'description']
     inlines = [ResolutionStepInline]
-    readonly_fields = ['created_at', 'updated_at', 'resolved_at']
+    readonly_fields = ['created_at', 'updated_at', 'resolved_at', 'due_at', 'escalated_at']
+    autocomplete_fields = ['resolved_by', 'assigned_to']
+    actions = ['mark_in_progress', 'mark_resolved', 'merge_duplicates']
+    raw_id_fields = ['duplicate_of']
+
+    def save_model(self, request, obj, form, change):
+        obj._status_changed_by = request.user
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description='Mark selected requests as in progress')
+    def mark_in_progress(self, request, queryset):
+        changed = ServiceRequest.bulk_transition(queryset, 'In Progress', user=request.user)
+        self.message_user(request, f'{changed} request(s) marked as in progress.')
+
+    @admin.action(description='Mark selected requests as resolved')
+    def mark_resolved(self, request, queryset):
+        changed = ServiceRequest.bulk_transition(queryset, 'Resolved', user=request.user)
+        self.message_user(request, f'{changed} request(s) marked as resolved.')
+
+    @admin.action(description='Merge selected requests into the oldest one')
+    def merge_duplicates(self, request, queryset):
+        requests = list(queryset.order_by('created_at', 'id'))
+        if len(requests) < 2:
+            self.message_user(request, 'Select at least two requests to merge.', level=messages.WARNING)
+            return
+        target, *duplicates = requests
+        with transaction.atomic():
+            for duplicate in duplicates:
+                duplicate.merge_into(target, user=request.user)
+        self.message_user(request, f'{len(duplicates)} request(s) merged into #{target.id}.')
 
 @admin.register(ResolutionStep)
-class ResolutionStepAdmin(admin.ModelAdmin):
+class ResolutionStepAdmin(PerformanceModeAdmin):
     list_display = ['service_request', 'step_number', 'description', 'created_by', 'created_at']
+    list_select_related = ['service_request', 'created_by']
     list_filter = ['created_at', 'created_by']
+    performance_list_filter = ['created_at', CreatedByListFilter]
     search_fields = ['description', 'service_request__requester_name']
+    raw_id_fields = ['service_request']
+    autocomplete_fields = ['created_by']
+
+@admin.register(StatusTransition)
+class StatusTransitionAdmin(PerformanceModeAdmin):
+    # The request id, not the request: the FK has no database constraint
+    # and archived requests are no longer in the table, so neither a join
+    # nor a query per row
+    list_display = ['request_id', 'from_status', 'to_status', 'category', 'changed_by', 'entered_at', 'left_at']
+    list_select_related = ['changed_by']
+    list_filter = ['to_status', 'category', 'entered_at']
+    raw_id_fields = ['service_request']
+
+    @admin.display(description='Request', ordering='service_request_id')
+    def request_id(self, obj):
+        return f"#{obj.service_request_id}"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+class ArchivedResolutionStepInline(admin.TabularInline):
+    model = ArchivedResolutionStep
+    extra = 0
+    fields = ['step_number', 'description', 'created_by', 'created_at']
+    readonly_fields = fields
+    can_delete = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('created_by')
+
+@admin.register(ArchivedServiceRequest)
+class ArchivedServiceRequestAdmin(PerformanceModeAdmin):
+    list_display = ['id', 'requester_name', 'department', 'category', 'created_at', 'resolved_at', 'archived_at']
+    list_filter = ['category', 'archived_at']
+    search_fields = ['requester_name', 'department', 'description']
+    inlines = [ArchivedResolutionStepInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
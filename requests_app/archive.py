@@ -0,0 +1,163 @@
+"""
+Hot/cold storage for resolved requests.
+
+``archive_requests`` moves requests resolved before a cutoff, with their
+resolution steps, into the ArchivedServiceRequest and
+ArchivedResolutionStep tables, in batches. Each batch is one transaction.
+The hot table only keeps open and recently resolved requests, so it and
+its indexes stay small. Archived requests keep their ids and their
+StatusTransition rows; attachments and imported emails of a moved step
+follow it through ``archived_step``.
+
+The helpers below let views look a request up in both tables.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+
+
+def find_request(pk):
+    """The hot or archived request with ``pk``, or None."""
+    from .models import ArchivedServiceRequest, ServiceRequest
+
+    return (
+        ServiceRequest.objects.select_related('resolved_by', 'assigned_to').filter(pk=pk).first()
+        or ArchivedServiceRequest.objects.select_related('resolved_by', 'assigned_to').filter(pk=pk).first()
+    )
+
+
+def requests_by_id(pks, prefetch=()):
+    """{pk: request} for ``pks``, looked up in the hot table and then the archive."""
+    from .models import ArchivedServiceRequest, ServiceRequest
+
+    found = {req.pk: req for req in ServiceRequest.objects.filter(pk__in=pks).prefetch_related(*prefetch)}
+    missing = [pk for pk in pks if pk not in found]
+    if missing:
+        archived = ArchivedServiceRequest.objects.filter(pk__in=missing).prefetch_related(*prefetch)
+        found.update((req.pk, req) for req in archived)
+    return found
+
+
+def search_condition(query):
+    """Q matching requests (hot or archived) by id, requester, department or description"""
+    condition = Q(requester_name__icontains=query) | Q(department__icontains=query) | Q(description__icontains=query)
+    if query.lstrip('#').isdigit():
+        condition |= Q(pk=int(query.lstrip('#')))
+    return condition
+
+
+def search_archive(query, limit=None):
+    """The most recent archived requests matching ``query``"""
+    from .models import ArchivedServiceRequest
+
+    limit = limit or getattr(settings, 'ARCHIVE_SEARCH_LIMIT', 50)
+    return list(ArchivedServiceRequest.objects.filter(search_condition(query)).order_by('-created_at')[:limit])
+
+
+def archivable(cutoff):
+    """
+    Requests resolved before ``cutoff`` that can be archived: not referenced
+    as ``duplicate_of`` by a request that has to stay in the hot table.
+    """
+    from .models import ServiceRequest
+
+    old = Q(status='Resolved', resolved_at__lt=cutoff)
+    staying_duplicates = ServiceRequest.objects.filter(duplicate_of=OuterRef('pk')).exclude(old)
+    return ServiceRequest.objects.filter(old).exclude(Exists(staying_duplicates))
+
+
+def _close_over_duplicates(ids, eligible):
+    """
+    Grow or shrink ``ids`` until no request outside it points into it via
+    ``duplicate_of``: eligible duplicates join the batch, and targets of
+    duplicates that must stay are dropped from it.
+    """
+    from .models import ServiceRequest
+
+    ids, blocked = set(ids), set()
+    while True:
+        referrers = list(
+            ServiceRequest.objects.filter(duplicate_of__in=ids).exclude(pk__in=ids).values_list('pk', 'duplicate_of_id')
+        )
+        if not referrers:
+            return ids
+        movable = set(eligible.filter(pk__in=[pk for pk, _ in referrers]).values_list('pk', flat=True))
+        for pk, target in referrers:
+            if pk in movable and pk not in blocked:
+                ids.add(pk)
+            else:
+                ids.discard(target)
+                blocked.add(target)
+
+
+def _move_step_links(model, moved_steps, chunk_size=200):
+    """Set ``archived_step`` on ``model`` rows from {step id: archived step id}."""
+    moved = list(moved_steps.items())
+    for i in range(0, len(moved), chunk_size):
+        chunk = moved[i:i + chunk_size]
+        model.objects.filter(resolution_step__in=[old for old, _ in chunk]).update(archived_step=Case(
+            *[When(resolution_step=old, then=Value(new)) for old, new in chunk],
+        ))
+
+
+def archive_batch(ids):
+    """Copy the requests ``ids`` and their steps to the archive and delete them. Returns the count."""
+    from .models import (
+        ArchivedResolutionStep, ArchivedServiceRequest, Attachment, DuplicateBucket, DuplicateSignature,
+        MailMessage, ResolutionStep, ServiceRequest,
+    )
+
+    with transaction.atomic():
+        requests = list(ServiceRequest.objects.filter(pk__in=ids).select_for_update())
+        if not requests:
+            return 0
+        ids = [req.pk for req in requests]
+        ArchivedServiceRequest.objects.bulk_create([
+            ArchivedServiceRequest(**{
+                field.attname: getattr(req, field.attname)
+                for field in ArchivedServiceRequest._meta.concrete_fields
+                if field.attname != 'archived_at'
+            })
+            for req in requests
+        ])
+        steps = list(ResolutionStep.objects.filter(service_request__in=ids))
+        archived_steps = ArchivedResolutionStep.objects.bulk_create([
+            ArchivedResolutionStep(
+                service_request_id=step.service_request_id,
+                step_number=step.step_number,
+                description=step.description,
+                created_by_id=step.created_by_id,
+                created_at=step.created_at,
+                updated_at=step.updated_at,
+            )
+            for step in steps
+        ])
+        # Point step attachments and reply emails at the archived copies
+        # before deleting the steps sets their resolution_step to NULL
+        moved_steps = {step.pk: archived.pk for step, archived in zip(steps, archived_steps)}
+        for model in (Attachment, MailMessage):
+            _move_step_links(model, moved_steps)
+
+        ResolutionStep.objects.filter(service_request__in=ids).delete()
+        DuplicateBucket.objects.filter(service_request__in=ids).delete()
+        DuplicateSignature.objects.filter(service_request__in=ids).delete()
+        # A plain DELETE: the ORM would cascade to StatusTransition, whose
+        # rows stay behind for the reports
+        table = connection.ops.quote_name(ServiceRequest._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+        return len(ids)
+
+
+def archive_resolved(cutoff, batch_size=500):
+    """Archive everything ``archivable`` before ``cutoff``; yields the size of each batch."""
+    eligible = archivable(cutoff)
+    last_pk = 0
+    while True:
+        batch = list(eligible.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1]
+        moved = archive_batch(_close_over_duplicates(batch, eligible))
+        if moved:
+            yield moved
@@ -0,0 +1,319 @@
+"""
+Content-addressed attachment storage.
+
+Uploads are streamed chunk by chunk into a temporary file under
+ATTACHMENTS_ROOT while their SHA-256 is computed
+(HashingFileUploadHandler), so no upload is ever held in memory. Storing
+an upload renames that file to ``blobs/ab/cd/<sha256>`` once its
+transaction commits; when the blob already exists the upload is simply
+discarded, so the same screenshot attached fifty times is kept once.
+Attachment rows point at Blob rows by digest. A blob's content type is
+detected on the server (``detect_content_type``), never copied from the
+upload.
+
+Thumbnails for images are rendered after the upload's transaction commits,
+by a small thread pool in the web process (Pillow releases the GIL while
+decoding and resizing). Pillow is optional; without it attachments simply
+have no thumbnail.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are skipped without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp')
+# Leading bytes of the image formats above (WebP is checked separately)
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def root():
+    return Path(getattr(settings, 'ATTACHMENTS_ROOT', settings.BASE_DIR / 'var' / 'attachments'))
+
+
+def blob_path(digest):
+    return root() / 'blobs' / digest[:2] / digest[2:4] / digest
+
+
+def thumbnail_path(digest):
+    return root() / 'thumbnails' / digest[:2] / digest[2:4] / f'{digest}.png'
+
+
+class HashedUploadedFile(UploadedFile):
+    """An upload already on disk under ATTACHMENTS_ROOT, with its SHA-256."""
+
+    def __init__(self, file, name, content_type, size, charset, sha256, truncated):
+        super().__init__(file, name, content_type, size, charset)
+        self.sha256 = sha256
+        # Set when the upload passed ATTACHMENT_MAX_SIZE and the rest was dropped
+        self.truncated = truncated
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        # Called by Django at the end of the request; removes the temporary
+        # file unless store() already moved it into the blob store
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """
+    Upload handler writing each chunk straight to a temporary file next to
+    the blob store while hashing it. Data past ATTACHMENT_MAX_SIZE is not
+    written; the file is flagged ``truncated`` for the form to reject.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        tmp_dir = root() / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=tmp_dir, prefix='upload-', delete=False)
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.max_size = getattr(settings, 'ATTACHMENT_MAX_SIZE', 10 * 1024 * 1024)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size <= self.max_size:
+            self.file.write(raw_data)
+            self.hash.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        return HashedUploadedFile(
+            self.file, self.file_name, self.content_type, self.size, self.charset,
+            self.hash.hexdigest(), truncated=self.size > self.max_size,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+            os.unlink(self.file.name)
+
+
+def lock_blob(digest):
+    """
+    Lock the Blob row ``digest`` until the transaction ends; returns whether
+    it exists. SQLite ignores SELECT ... FOR UPDATE, so this is an UPDATE
+    that changes nothing: any write takes SQLite's database write lock
+    (a row lock on other databases), which store() and the prune in
+    ``maintain_attachments`` then hold in turn rather than interleaving.
+    """
+    from .models import Blob
+
+    return bool(Blob.objects.filter(sha256=digest).update(size=F('size')))
+
+
+def detect_content_type(path, filename):
+    """
+    Content type of the upload at ``path``, never the one the client sent:
+    images are recognized by their signature, anything else by the file
+    name's extension, except that a name claiming an image the bytes do
+    not match is treated as opaque.
+    """
+    with open(path, 'rb') as fh:
+        head = fh.read(16)
+    for signature, sniffed in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return sniffed
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    guessed, _ = mimetypes.guess_type(filename)
+    if guessed is None or guessed.startswith('image/'):
+        return 'application/octet-stream'
+    return guessed
+
+
+def store(upload, user, service_request, resolution_step=None):
+    """
+    Save ``upload`` (a HashedUploadedFile) as an attachment, moving its
+    bytes into the blob store unless an identical blob is already there.
+
+    The Blob row is locked (``lock_blob``) for the rest of the transaction,
+    so ``maintain_attachments`` cannot prune it in between, and the bytes
+    only move into the store once the transaction commits: a rollback
+    leaves nothing behind but the temporary file, which the request's
+    cleanup removes.
+    """
+    from .models import Attachment, Blob
+
+    with transaction.atomic():
+        if lock_blob(upload.sha256):
+            blob, created = Blob.objects.get(sha256=upload.sha256), False
+        else:
+            blob, created = Blob.objects.get_or_create(
+                sha256=upload.sha256,
+                defaults={'size': upload.size,
+                          'content_type': detect_content_type(upload.temporary_file_path(), upload.name)},
+            )
+        attachment = Attachment.objects.create(
+            blob=blob,
+            service_request=service_request,
+            resolution_step=resolution_step,
+            filename=os.path.basename(upload.name)[:255],
+            uploaded_by=user,
+        )
+        transaction.on_commit(lambda: _move_into_store(upload, blob_path(blob.sha256)))
+        if created and blob.content_type in THUMBNAIL_TYPES:
+            transaction.on_commit(lambda: schedule_thumbnail(blob.sha256))
+    return attachment
+
+
+def _move_into_store(upload, path):
+    if path.exists():
+        upload.close()
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    upload.file.close()
+    os.replace(upload.temporary_file_path(), path)
+
+
+def make_thumbnail(digest):
+    """Render the PNG thumbnail for blob ``digest``; returns its path or None."""
+    if Image is None:
+        return None
+    target = thumbnail_path(digest)
+    if target.exists():
+        return target
+    try:
+        with Image.open(blob_path(digest)) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix('.tmp')
+            image.save(tmp, 'PNG', optimize=True)
+            os.replace(tmp, target)
+    except (OSError, Image.DecompressionBombError):
+        logger.warning("Could not create a thumbnail for blob %s", digest, exc_info=True)
+        return None
+    return target
+
+
+def schedule_thumbnail(digest):
+    """Queue ``make_thumbnail`` on the worker pool, off the request path."""
+    global _executor
+    if Image is None:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2), thread_name_prefix='thumbnails',
+            )
+    return _executor.submit(make_thumbnail, digest)
+
+
+class _RangeFile:
+    """Read-only view of ``length`` bytes of an open file, starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _parse_range(header, size):
+    """(start, end) for a single ``bytes=`` range, None to ignore it, or False if unsatisfiable."""
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            length = int(last)
+            if length == 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def file_response(request, path, content_type, etag, filename=None, as_attachment=False):
+    """
+    FileResponse for a content-addressed file. Whole files are handed to
+    the server's file wrapper (sendfile where available); a single
+    ``Range`` is served as 206 Partial Content. The digest is a strong
+    ETag, and the content never changes under it.
+    """
+    etag = f'"{etag}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable',
+    }
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    size = path.stat().st_size
+    byte_range = None
+    if 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+        byte_range = _parse_range(request.headers['Range'], size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range:
+        start, end = byte_range
+        response = FileResponse(_RangeFile(open(path, 'rb'), start, end - start + 1), status=206,
+                                content_type=content_type, as_attachment=as_attachment, filename=filename)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type,
+                                as_attachment=as_attachment, filename=filename)
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,70 @@
+import logging
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register, run_checks
+from django.template import engines
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE = 'performance'
+
+
+@register(PERFORMANCE, Tags.compatibility, deploy=True)
+def check_performance_settings(app_configs, **kwargs):
+    """
+    Warn about debug-only settings that make long-running workers slow or
+    grow their memory. Runs with ``manage.py check --deploy`` and when a
+    worker starts (see warn_on_startup).
+    """
+    warnings = []
+
+    if settings.DEBUG:
+        warnings.append(Warning(
+            "DEBUG is on.",
+            hint="With DEBUG on, Django stores every SQL statement in "
+                 "connection.queries. Use the prod profile (DJANGO_ENV=prod) for workers.",
+            id='requests_app.W001',
+        ))
+
+    for engine in engines.all():
+        # The effective loaders: Django wraps the defaults in the cached
+        # loader itself unless OPTIONS['loaders'] is set explicitly
+        loaders = getattr(getattr(engine, 'engine', None), 'loaders', None)
+        if loaders and not any('cached.Loader' in str(loader) for loader in loaders):
+            warnings.append(Warning(
+                f"Template engine '{engine.name}' does not use the cached loader.",
+                hint="Wrap the loaders in django.template.loaders.cached.Loader so "
+                     "templates are not re-parsed on every render.",
+                id='requests_app.W002',
+            ))
+
+    for alias, database in settings.DATABASES.items():
+        if not database.get('CONN_MAX_AGE'):
+            warnings.append(Warning(
+                f"Database '{alias}' opens a new connection for every request.",
+                hint="Set CONN_MAX_AGE (and CONN_HEALTH_CHECKS) to reuse connections.",
+                id='requests_app.W003',
+            ))
+
+    if settings.SESSION_ENGINE == 'django.contrib.sessions.backends.db':
+        warnings.append(Warning(
+            "Sessions are read from the database on every authenticated request.",
+            hint="Use SESSION_BACKEND=cached_db or signed_cookies.",
+            id='requests_app.W004',
+        ))
+
+    db_logger = settings.LOGGING.get('loggers', {}).get('django.db.backends', {})
+    if db_logger.get('level') == 'DEBUG':
+        warnings.append(Warning(
+            "The django.db.backends logger is at DEBUG level.",
+            hint="Every SQL statement is formatted and logged; raise it to WARNING.",
+            id='requests_app.W005',
+        ))
+
+    return warnings
+
+
+def warn_on_startup():
+    """Log performance warnings when a WSGI/ASGI worker starts."""
+    for message in run_checks(tags=[PERFORMANCE], include_deployment_checks=True):
+        logger.warning("%s", message)
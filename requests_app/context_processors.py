@@ -0,0 +1,9 @@
+from .middleware import UserContext
+
+
+def user_context(request):
+    """Expose the memoized per-request user context to templates."""
+    context = getattr(request, 'user_context', None)
+    if context is None:
+        context = request.user_context = UserContext(request)
+    return {'user_context': context}
@@ -0,0 +1,129 @@
+"""
+Dashboard widgets.
+
+The dashboard page is only a shell; each widget fetches its numbers from
+``dashboard/widgets/<name>/``, so the page renders without waiting for
+the aggregates and every widget can be cached and refreshed on its own.
+Staff see all requests, other users only their own, as before; requests
+moved to the archive are counted together with the hot table.
+
+Widget data is cached per scope (all requests, or one requester) for the
+widget's timeout in DASHBOARD_WIDGET_TIMEOUTS.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import ArchivedServiceRequest, ServiceRequest
+
+
+def scope(request):
+    """
+    (querysets, cache key part) of the requests the user's dashboard
+    covers: the hot table and the archive, so archiving changes nothing.
+    """
+    if request.user.is_staff:
+        condition, key = Q(), 'all'
+    else:
+        user_name = request.user_context.display_name
+        digest = hashlib.blake2b(user_name.encode(), digest_size=12).hexdigest()
+        condition, key = Q(requester_name=user_name), f'requester:{digest}'
+    return [model.objects.filter(condition).order_by() for model in (ServiceRequest, ArchivedServiceRequest)], key
+
+
+def _add_counts(rows, key):
+    """Sum ``count`` over rows from several tables that share ``key``."""
+    counts = {}
+    for row in rows:
+        counts[row[key]] = counts.get(row[key], 0) + row['count']
+    return counts
+
+
+def status_counts(requests):
+    """Status counters, in one query per table."""
+    counts = {}
+    for queryset in requests:
+        for name, value in queryset.aggregate(
+            total=Count('id'),
+            pending=Count('id', filter=Q(status='Pending')),
+            in_progress=Count('id', filter=Q(status='In Progress')),
+            resolved=Count('id', filter=Q(status='Resolved')),
+            recent=Count('id', filter=Q(created_at__gte=timezone.now() - timedelta(days=7))),
+        ).items():
+            counts[name] = counts.get(name, 0) + value
+    counts['high_priority'] = counts['pending'] + counts['in_progress']
+    total = counts['total']
+    counts['percent'] = {
+        status: round(counts[status] * 100 / total) if total else 0
+        for status in ('pending', 'in_progress', 'resolved')
+    }
+    return counts
+
+
+def category_stats(requests):
+    counts = _add_counts(
+        (row for queryset in requests for row in queryset.values('category').annotate(count=Count('id'))),
+        'category',
+    )
+    total = sum(counts.values())
+    rows = [
+        {'category': category, 'count': count, 'percent': round(count * 100 / total) if total else 0}
+        for category, count in sorted(counts.items(), key=lambda item: -item[1])
+    ]
+    return {'categories': rows}
+
+
+def monthly_trend(requests):
+    """Requests opened per month over the last six months."""
+    since = timezone.now() - timedelta(days=180)
+    counts = _add_counts(
+        (
+            row for queryset in requests
+            for row in queryset.filter(created_at__gte=since)
+            .annotate(month=TruncMonth('created_at')).values('month').annotate(count=Count('id'))
+        ),
+        'month',
+    )
+    return {'months': [{'month': f"{month:%Y-%m}", 'count': count} for month, count in sorted(counts.items())]}
+
+
+def recent_activity(requests, limit=8):
+    rows = sorted(
+        (
+            row for queryset in requests
+            for row in queryset.order_by('-created_at', '-id').values(
+                'id', 'requester_name', 'category', 'status', 'created_at',
+            )[:limit]
+        ),
+        key=lambda row: (row['created_at'], row['id']), reverse=True,
+    )[:limit]
+    return {'requests': [{**row, 'created_at': row['created_at'].isoformat()} for row in rows]}
+
+
+WIDGETS = {
+    'status': status_counts,
+    'categories': category_stats,
+    'trend': monthly_trend,
+    'recent': recent_activity,
+}
+
+
+def timeout(name):
+    return getattr(settings, 'DASHBOARD_WIDGET_TIMEOUTS', {}).get(name, 60)
+
+
+def widget_data(name, request):
+    """Cached data of widget ``name`` for the user's scope; KeyError for an unknown widget."""
+    compute = WIDGETS[name]
+    requests, scope_key = scope(request)
+    key = f'dashboard:{name}:{scope_key}'
+    data = cache.get(key)
+    if data is None:
+        data = {**compute(requests), 'generated_at': timezone.now().isoformat()}
+        cache.set(key, data, timeout(name))
+    return data
@@ -0,0 +1,187 @@
+"""
+Near-duplicate detection for service request descriptions.
+
+Each open request's description is reduced to a MinHash signature (an
+estimate of its set of 5-byte shingles), computed with numpy when it is
+installed, and split into LSH bands. A
+request is stored under one bucket key per band, so a lookup is a single
+indexed ``IN`` query over a handful of keys; only requests that share a
+band are compared, never the whole open backlog.
+
+With 16 bands of 4 rows, pairs with a Jaccard similarity around 0.5 have
+an even chance of sharing a bucket, and pairs above ~0.7 almost always do.
+"""
+import hashlib
+import random
+import re
+import struct
+from array import array
+
+from django.conf import settings
+from django.db.models import Subquery
+
+try:
+    import numpy as np
+except ImportError:  # signatures are computed in pure Python without numpy
+    np = None
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+# Long descriptions are mostly logs and signatures; the start is enough
+MAX_TEXT_LENGTH = 2000
+
+_MASK64 = (1 << 64) - 1
+# Golden-ratio multiplier folding a packed shingle to 32 bits
+_SHINGLE_MULTIPLIER = 0x9E3779B97F4A7C15
+_rng = random.Random(20240611)  # fixed, signatures must be stable across processes
+# Multiply-add-shift hashes ((a * h + b) mod 2**64) >> 32 with odd a: no
+# modulo, so numpy computes them with wrapping uint64 arithmetic
+_PERMUTATIONS = [(_rng.getrandbits(64) | 1, _rng.getrandbits(64)) for _ in range(NUM_PERMUTATIONS)]
+_WORD_RE = re.compile(r'\w+')
+
+if np is not None:
+    _A = np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64)
+    _B = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)
+
+
+def normalize(text):
+    """Lowercased words of the start of ``text``, as UTF-8"""
+    return ' '.join(_WORD_RE.findall(text[:MAX_TEXT_LENGTH].lower())).encode()
+
+
+def shingle_hashes(text):
+    """
+    32-bit hashes of the distinct SHINGLE_SIZE-byte shingles of the
+    normalized text, each shingle read as a little-endian integer.
+    """
+    data = normalize(text)
+    if len(data) <= SHINGLE_SIZE:
+        values = [int.from_bytes(data, 'little')] if data else []
+    elif np is None:
+        values = {int.from_bytes(data[i:i + SHINGLE_SIZE], 'little') for i in range(len(data) - SHINGLE_SIZE + 1)}
+    else:
+        data = np.frombuffer(data, dtype=np.uint8).astype(np.uint64)
+        count = len(data) - SHINGLE_SIZE + 1
+        packed = data[:count].copy()
+        for offset in range(1, SHINGLE_SIZE):
+            packed |= data[offset:offset + count] << np.uint64(8 * offset)
+        packed *= np.uint64(_SHINGLE_MULTIPLIER)
+        return np.unique(packed >> np.uint64(32))
+    return {((value * _SHINGLE_MULTIPLIER) & _MASK64) >> 32 for value in values}
+
+
+def signature(text):
+    """MinHash signature of ``text`` as a tuple of ints, or None for empty text"""
+    hashes = shingle_hashes(text)
+    if not len(hashes):
+        return None
+    if np is None:
+        return tuple(min(((a * h + b) & _MASK64) >> 32 for h in hashes) for a, b in _PERMUTATIONS)
+    # Every shingle under every permutation at once
+    if not isinstance(hashes, np.ndarray):
+        hashes = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    values = np.multiply(hashes[:, None], _A)
+    values += _B
+    # The shift is monotonic, so it is applied to the minimums only
+    return tuple((values.min(axis=0) >> np.uint64(32)).tolist())
+
+
+def band_keys(sig):
+    """One signed 64-bit bucket key per LSH band"""
+    keys = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f'>B{ROWS_PER_BAND}Q', band, *rows), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERMUTATIONS
+
+
+def pack(sig):
+    return array('Q', sig).tobytes()
+
+
+def unpack(data):
+    return tuple(array('Q', bytes(data)))
+
+
+def index_request(req):
+    """Add, refresh or remove ``req`` in the index depending on its status."""
+    from .models import DuplicateBucket, DuplicateSignature
+
+    sig = signature(req.description) if req.status != 'Resolved' else None
+    DuplicateBucket.objects.filter(service_request=req).delete()
+    if sig is None:
+        DuplicateSignature.objects.filter(service_request=req).delete()
+        return
+    DuplicateSignature.objects.update_or_create(service_request=req, defaults={'signature': pack(sig)})
+    DuplicateBucket.objects.bulk_create([DuplicateBucket(service_request=req, key=key) for key in band_keys(sig)])
+
+
+def index_requests(requests):
+    """``index_request`` for many open requests, with bulk inserts."""
+    from .models import DuplicateBucket, DuplicateSignature
+
+    remove_from_index(requests)
+    signatures, buckets = [], []
+    for req in requests:
+        sig = signature(req.description) if req.status != 'Resolved' else None
+        if sig is None:
+            continue
+        signatures.append(DuplicateSignature(service_request=req, signature=pack(sig)))
+        buckets.extend(DuplicateBucket(service_request=req, key=key) for key in band_keys(sig))
+    DuplicateSignature.objects.bulk_create(signatures)
+    DuplicateBucket.objects.bulk_create(buckets)
+
+
+def remove_from_index(requests):
+    from .models import DuplicateBucket, DuplicateSignature
+
+    DuplicateBucket.objects.filter(service_request__in=requests).delete()
+    DuplicateSignature.objects.filter(service_request__in=requests).delete()
+
+
+def find_duplicates(text, exclude_pk=None, limit=5, sig=None):
+    """
+    Open requests whose description looks like ``text`` (or whose
+    signature is ``sig``), as a list of (ServiceRequest, similarity)
+    pairs, most similar first.
+    """
+    from .models import DuplicateBucket, DuplicateSignature
+
+    if sig is None:
+        sig = signature(text)
+    if sig is None:
+        return []
+    candidates = DuplicateBucket.objects.filter(key__in=band_keys(sig)).values('service_request_id')
+    if exclude_pk is not None:
+        candidates = candidates.exclude(service_request_id=exclude_pk)
+
+    threshold = getattr(settings, 'DUPLICATE_SIMILARITY_THRESHOLD', 0.5)
+    matches = []
+    for stored in (
+        DuplicateSignature.objects.filter(service_request_id__in=Subquery(candidates))
+        .select_related('service_request')
+        .only('signature', 'service_request__id', 'service_request__category',
+              'service_request__status', 'service_request__created_at')
+    ):
+        score = similarity(sig, unpack(stored.signature))
+        if score >= threshold:
+            matches.append((stored.service_request, score))
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches[:limit]
+
+
+def find_duplicates_of(req, limit=5):
+    """``find_duplicates`` for a saved request, reusing its indexed signature."""
+    from .models import DuplicateSignature
+
+    stored = DuplicateSignature.objects.filter(service_request=req).values_list('signature', flat=True).first()
+    sig = unpack(stored) if stored is not None else None
+    return find_duplicates(req.description, exclude_pk=req.pk, limit=limit, sig=sig)
@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
 from .models import  ResolutionStep, ServiceRequest
@@ -22,11 +23,11 @@ class UserRegistrationForm(UserCreationForm):
         user.last_name = self.cleaned_data['last_name']
         if commit:
             user.save()
-            # Create or update UserProfile
+            # The profile is created by the post_save signal for new users;
+            # only write the department when it actually changed
             from .models import UserProfile
-            profile, created = UserProfile.objects.get_or_create(user=user)
-            profile.department = self.cleaned_data['department']
-            profile.save()
+            profile = UserProfile.for_user(user)
+            profile.update_fields_if_changed(department=self.cleaned_data['department'])
         return user
 
 class ServiceRequestForm(forms.ModelForm):
@@ -37,12 +38,17 @@ class ServiceRequestForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows':4})
         }
     
-    def __init__(self, *args, user=None, **kwargs):
+    def __init__(self, *args, department=None, **kwargs):
         super().__init__(*args, **kwargs)
-        # Make department optional, but pre-populate if user has a profile
+        # Make department optional, but pre-populate from the user's profile
         self.fields['department'].required = False
-        if user and hasattr(user, 'profile') and user.profile.department:
-            self.fields['department'].initial = user.profile.department
+        if department:
+            self.fields['department'].initial = department
+
+    def possible_duplicates(self, exclude_pk=None):
+        """Open requests whose description looks like this one, as (request, similarity) pairs"""
+        from .duplicates import find_duplicates
+        return find_duplicates(self.cleaned_data.get('description', ''), exclude_pk=exclude_pk)
 
 class ResolutionStepForm(forms.ModelForm):
     class Meta:
@@ -60,6 +66,35 @@ class ResolutionStepForm(forms.ModelForm):
             })
         }
 
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+class MultipleFileField(forms.FileField):
+    widget = MultipleFileInput
+
+    def clean(self, data, initial=None):
+        files = data if isinstance(data, (list, tuple)) else [data] if data else []
+        return [super(MultipleFileField, self).clean(f, initial) for f in files]
+
+class AttachmentForm(forms.Form):
+    """Screenshots and logs uploaded with a request or a resolution step"""
+    attachments = MultipleFileField(required=False)
+
+    def clean_attachments(self):
+        files = self.cleaned_data['attachments']
+        max_files = getattr(settings, 'ATTACHMENT_MAX_FILES', 5)
+        max_size = getattr(settings, 'ATTACHMENT_MAX_SIZE', 10 * 1024 * 1024)
+        allowed = getattr(settings, 'ATTACHMENT_ALLOWED_EXTENSIONS', ())
+        if len(files) > max_files:
+            raise forms.ValidationError(f'Attach at most {max_files} files.')
+        for f in files:
+            if getattr(f, 'truncated', False) or f.size > max_size:
+                raise forms.ValidationError(f'{f.name} is larger than {max_size // (1024 * 1024)} MB.')
+            extension = f.name.rsplit('.', 1)[-1].lower() if '.' in f.name else ''
+            if allowed and extension not in allowed:
+                raise forms.ValidationError(f'{f.name}: only {", ".join(allowed)} files can be attached.')
+        return files
+
 class ResolutionStepInlineFormSet(forms.BaseInlineFormSet):
     def clean(self):
         super().clean()
@@ -0,0 +1,411 @@
+"""
+Import of emailed requests from mbox files and Maildir directories.
+
+``ingest_mail`` reads a mailbox one message at a time and turns each
+message into a new ServiceRequest, or into a ResolutionStep when it
+replies to a ticket: its In-Reply-To/References point at a message
+imported before, or its subject mentions "Request #<id>". Every imported
+Message-ID is recorded in MailMessage, so a message is never imported
+twice.
+
+Messages are written in batches, one transaction per batch, together with
+a MailCheckpoint holding how far into the mailbox the batch got (a byte
+offset in an mbox, the last file name in a Maildir). An interrupted mbox
+run resumes from there. Maildir file names are not in delivery order, so
+a Maildir is listed in full every run and files whose Message-ID was
+already imported are skipped after reading only their headers. The bulk inserts bypass ``ServiceRequest.save()``,
+so the SLA deadline, the first StatusTransition and the duplicate index
+are written here explicitly. Historical mail is imported as it was: a
+ticket already past its deadline is marked escalated rather than queued
+for an escalation email, and reply steps keep the time they were sent.
+"""
+import email.utils
+import hashlib
+import html
+import logging
+import os
+import re
+from email.header import decode_header, make_header
+from email.parser import BytesParser
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from . import duplicates, suggestions
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_LENGTH = 20000
+# Read to find the Message-ID of a Maildir file without reading its body
+HEADER_READ_BYTES = 64 * 1024
+TICKET_SUBJECT_RE = re.compile(r'(?:request|ticket)\s*#\s*(\d+)|\[#(\d+)\]', re.IGNORECASE)
+MESSAGE_ID_RE = re.compile(r'<([^<>\s]+)>')
+QUOTE_HEADER_RE = re.compile(r'^(?:On .+ wrote:|-+\s*Original Message\s*-+|From: .+)$', re.MULTILINE)
+
+# The compat32 policy leaves headers as strings; the structured headers of
+# the modern policy cost several times more per message than the rest of
+# the import
+_parser = BytesParser()
+
+
+def iter_mbox(path, offset=0):
+    """
+    Yield (end offset, raw bytes) for each message of the mbox at ``path``,
+    starting at byte ``offset``. Only the current message is held in memory.
+    """
+    with open(path, 'rb') as fh:
+        if offset > os.fstat(fh.fileno()).st_size:
+            # The mailbox was rotated since the checkpoint
+            offset = 0
+        fh.seek(offset)
+        lines, position, previous_blank = [], offset, True
+        for line in fh:
+            if line.startswith(b'From ') and previous_blank:
+                if lines:
+                    yield position, b''.join(lines)
+                lines = []
+            elif line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                # mboxrd escaping of body lines starting with "From "
+                lines.append(line[1:])
+            else:
+                lines.append(line)
+            position += len(line)
+            previous_blank = line in (b'\n', b'\r\n')
+        if lines:
+            yield position, b''.join(lines)
+
+
+def iter_maildir(path, known=None, batch_size=500):
+    """
+    Yield (key, raw bytes) for each message in the Maildir at ``path``, in
+    key order. Only the file names are listed up front.
+
+    Keys are not a reliable delivery order (clock skew, several delivering
+    hosts), so nothing is skipped by key. Instead ``known(message_ids)``,
+    called for every ``batch_size`` files with the Message-IDs read from
+    their headers, returns those already imported; their bodies are never
+    read.
+    """
+    path = Path(path)
+    files = {}
+    for sub in ('cur', 'new'):
+        try:
+            entries = os.scandir(path / sub)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if not entry.name.startswith('.') and entry.is_file():
+                    files[entry.name.split(':', 1)[0]] = entry.path
+    keys = sorted(files)
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start:start + batch_size]
+        imported = set()
+        if known is not None:
+            message_ids = {key: _header_message_id(files[key]) for key in chunk}
+            imported = known({message_id for message_id in message_ids.values() if message_id})
+        for key in chunk:
+            if known is not None and message_ids[key] in imported:
+                continue
+            try:
+                yield key, Path(files[key]).read_bytes()
+            except FileNotFoundError:
+                # Moved or deleted by a mail client while we were reading
+                continue
+
+
+def _header_message_id(path):
+    """The Message-ID ``parse`` would record for the message file at ``path``, read from its headers only."""
+    try:
+        with open(path, 'rb') as fh:
+            head = fh.read(HEADER_READ_BYTES)
+    except FileNotFoundError:
+        return None
+    head = re.split(rb'\r?\n\r?\n', head, maxsplit=1)[0]
+    try:
+        message_id = _message_ids(_parser.parsebytes(head, headersonly=True).get('Message-ID', ''))
+    except Exception:  # left for parse() to report
+        return None
+    # Messages without one are keyed by a hash of the whole file; long ones
+    # are hashed by parse()
+    return message_id[0] if message_id and len(message_id[0]) <= 255 else None
+
+
+def parse(raw):
+    """Parsed fields of one raw message, or None if it cannot be parsed."""
+    try:
+        msg = _parser.parsebytes(raw)
+        message_id = _message_ids(msg.get('Message-ID', ''))
+        references = _message_ids(f"{msg.get('References', '')} {msg.get('In-Reply-To', '')}")
+        name, address = email.utils.parseaddr(str(msg.get('From', '')))
+        name = _decode(name)
+        subject = ' '.join(_decode(msg.get('Subject', '')).split())
+        sent_at = _date(msg.get('Date'))
+        text = _text(msg)
+    except Exception:  # malformed headers raise a variety of errors
+        logger.warning("Skipping a message that could not be parsed", exc_info=True)
+        return None
+    if message_id:
+        message_id = message_id[0]
+    else:
+        message_id = 'sha256:' + hashlib.sha256(raw).hexdigest()
+    if len(message_id) > 255:
+        message_id = 'sha256:' + hashlib.sha256(message_id.encode()).hexdigest()
+    return {
+        'message_id': message_id,
+        # Closest ancestor first: In-Reply-To, then References newest to oldest
+        'references': references[::-1],
+        'name': name.strip(),
+        'address': address.strip().lower()[:254],
+        'subject': subject,
+        'sent_at': sent_at,
+        'text': text.strip(),
+    }
+
+
+def _message_ids(header):
+    return MESSAGE_ID_RE.findall(str(header))
+
+
+def _decode(value):
+    """A header value with its RFC 2047 encoded words decoded."""
+    try:
+        return str(make_header(decode_header(str(value))))
+    except (LookupError, UnicodeError, ValueError):
+        return str(value)
+
+
+def _date(value):
+    try:
+        sent_at = email.utils.parsedate_to_datetime(str(value)) if value else None
+    except (TypeError, ValueError):
+        sent_at = None
+    if sent_at is None:
+        return timezone.now()
+    if timezone.is_naive(sent_at):
+        sent_at = timezone.make_aware(sent_at)
+    return min(sent_at, timezone.now())
+
+
+def _text(msg):
+    """The first plain-text body part (or HTML, tags stripped) of ``msg``."""
+    html_part = None
+    for part in msg.walk():
+        if part.get_content_maintype() != 'text' or part.get('Content-Disposition', '').startswith('attachment'):
+            continue
+        if part.get_content_subtype() == 'plain':
+            return _payload(part)
+        if part.get_content_subtype() == 'html' and html_part is None:
+            html_part = part
+    return html.unescape(strip_tags(_payload(html_part))) if html_part is not None else ''
+
+
+def _payload(part):
+    data = part.get_payload(decode=True) or b''
+    try:
+        return data.decode(part.get_content_charset() or 'utf-8', 'replace')
+    except LookupError:
+        return data.decode('utf-8', 'replace')
+
+
+def strip_quoted(text):
+    """The new part of a reply: quoted lines and everything below the quote header dropped."""
+    match = QUOTE_HEADER_RE.search(text)
+    if match:
+        text = text[:match.start()]
+    return '\n'.join(line for line in text.splitlines() if not line.startswith('>')).strip()
+
+
+class MailIngestor:
+    """Writes parsed messages in batches; see the module docstring."""
+
+    def __init__(self, source, fallback_user):
+        self.source = source
+        self.fallback_user = fallback_user
+        self.model = suggestions.get_model()
+        self.created = self.appended = self.skipped = 0
+
+    def checkpoint(self):
+        from .models import MailCheckpoint
+
+        row = MailCheckpoint.objects.filter(source=self.source).first()
+        return row.position if row else None
+
+    def known_message_ids(self, message_ids):
+        """The subset of ``message_ids`` already imported; counted as skipped."""
+        from .models import MailMessage
+
+        known = set(MailMessage.objects.filter(message_id__in=message_ids).values_list('message_id', flat=True))
+        self.skipped += len(known)
+        return known
+
+    def write_batch(self, batch, position):
+        """Import ``batch`` (parsed messages) and move the checkpoint to ``position``."""
+        from .models import MailCheckpoint, MailMessage
+
+        with transaction.atomic():
+            known = set(MailMessage.objects.filter(
+                message_id__in=[msg['message_id'] for msg in batch]
+            ).values_list('message_id', flat=True))
+            fresh = []
+            for msg in batch:
+                if msg['message_id'] in known:
+                    self.skipped += 1
+                    continue
+                known.add(msg['message_id'])
+                fresh.append(msg)
+            if fresh:
+                self._import(fresh)
+            updated = MailCheckpoint.objects.filter(source=self.source).update(
+                position=str(position), messages=F('messages') + len(fresh), updated_at=timezone.now(),
+            )
+            if not updated:
+                MailCheckpoint.objects.create(source=self.source, position=str(position), messages=len(fresh))
+
+    def _import(self, messages):
+        from .models import MailMessage, ResolutionStep, ServiceRequest, StatusTransition
+
+        users = self._users(msg['address'] for msg in messages)
+        threads = dict(MailMessage.objects.filter(
+            message_id__in={ref for msg in messages for ref in msg['references']}
+        ).values_list('message_id', 'service_request_id'))
+        subject_ids = {int(pk) for msg in messages for pk in self._subject_ticket(msg)}
+        open_ids = set(ServiceRequest.objects.filter(
+            pk__in=subject_ids | set(threads.values())
+        ).values_list('pk', flat=True))
+
+        # Decide per message, in mailbox order, so replies to a ticket
+        # created earlier in the same batch attach to it
+        new_requests, replies, rows = [], [], []
+        batch_threads = {}
+        for msg in messages:
+            target = self._target(msg, threads, batch_threads, open_ids)
+            if target is None:
+                req = self._new_request(msg, users.get(msg['address']))
+                new_requests.append((msg, req))
+                batch_threads[msg['message_id']] = req
+                rows.append(MailMessage(message_id=msg['message_id'], service_request=req, sender=msg['address']))
+            else:
+                replies.append((msg, target))
+                batch_threads[msg['message_id']] = target
+
+        if new_requests:
+            self._categorize([req for _, req in new_requests], [msg for msg, _ in new_requests])
+            requests = ServiceRequest.objects.bulk_create([req for _, req in new_requests])
+            StatusTransition.objects.bulk_create([
+                StatusTransition(service_request=req, from_status='', to_status=req.status,
+                                 category=req.category, entered_at=req.created_at)
+                for req in requests
+            ])
+            duplicates.index_requests(requests)
+            self.created += len(requests)
+
+        if replies:
+            target_ids = {target if isinstance(target, int) else target.pk for _, target in replies}
+            next_step = dict(
+                ResolutionStep.objects.filter(service_request__in=target_ids)
+                .values('service_request').annotate(last=Max('step_number'))
+                .values_list('service_request', 'last')
+            )
+            steps = []
+            for msg, target in replies:
+                target_id = target if isinstance(target, int) else target.pk
+                next_step[target_id] = next_step.get(target_id, 0) + 1
+                steps.append(ResolutionStep(
+                    service_request_id=target_id,
+                    step_number=next_step[target_id],
+                    description=self._step_text(msg, users.get(msg['address'])),
+                    created_by=users.get(msg['address']) or self.fallback_user,
+                ))
+            ResolutionStep.objects.bulk_create(steps)
+            # created_at is auto_now_add, so the send time is set afterwards
+            for (msg, _), step in zip(replies, steps):
+                step.created_at = step.updated_at = msg['sent_at']
+            ResolutionStep.objects.bulk_update(steps, ['created_at', 'updated_at'])
+            rows.extend(
+                MailMessage(message_id=msg['message_id'], service_request_id=step.service_request_id,
+                            resolution_step=step, sender=msg['address'])
+                for (msg, _), step in zip(replies, steps)
+            )
+            self.appended += len(steps)
+
+        MailMessage.objects.bulk_create(rows)
+
+    @staticmethod
+    def _users(addresses):
+        from django.contrib.auth.models import User
+
+        addresses = {address for address in addresses if address}
+        users = (
+            User.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in=addresses, is_active=True)
+            .select_related('profile')
+        )
+        return {user.email_lower: user for user in users}
+
+    @staticmethod
+    def _subject_ticket(msg):
+        return [a or b for a, b in TICKET_SUBJECT_RE.findall(msg['subject'])]
+
+    def _target(self, msg, threads, batch_threads, open_ids):
+        """The ticket ``msg`` replies to (a pk, or a request created in this batch), or None."""
+        for ref in msg['references']:
+            if ref in batch_threads:
+                return batch_threads[ref]
+            if threads.get(ref) in open_ids:
+                return threads[ref]
+        for pk in self._subject_ticket(msg):
+            if int(pk) in open_ids:
+                return int(pk)
+        # Replies to archived tickets, or to mail we never saw, open a new ticket
+        return None
+
+    def _new_request(self, msg, user):
+        from .middleware import display_name
+        from .models import ServiceRequest
+
+        profile = getattr(user, 'profile', None) if user else None
+        description = msg['text']
+        if msg['subject']:
+            description = f"{msg['subject']}\n\n{description}"
+        return ServiceRequest(
+            requester_name=(display_name(user) if user else msg['name'] or msg['address'] or 'Unknown sender')[:150],
+            department=((profile.department if profile else '') or '')[:100],
+            category='Other',
+            description=description.strip()[:MAX_TEXT_LENGTH],
+            status='Pending',
+            created_at=msg['sent_at'],
+        )
+
+    def _categorize(self, requests, messages):
+        """Set each request's category from the suggestion model (one batched prediction) and its SLA deadline."""
+        from .models import ServiceRequest
+
+        if self.model is not None:
+            threshold = getattr(settings, 'SUGGESTIONS_MIN_CATEGORY_SCORE', 0.1)
+            scores = self.model.predict([req.description for req in requests])
+            valid = {value for value, _ in ServiceRequest.CATEGORY_CHOICES}
+            for req, row in zip(requests, scores):
+                best = int(row.argmax())
+                if row[best] >= threshold and self.model.categories[best] in valid:
+                    req.category = self.model.categories[best]
+        now = timezone.now()
+        for req in requests:
+            # What save() would set; bulk_create does not call it
+            req.due_at = req.sla_due_at()
+            if req.due_at <= now:
+                # Old mail: its deadline passed long ago, don't escalate it now
+                req.escalated_at = now
+
+    @staticmethod
+    def _step_text(msg, user):
+        text = strip_quoted(msg['text']) or msg['subject']
+        if user is None:
+            sender = email.utils.formataddr((msg['name'], msg['address'])) if msg['address'] else 'unknown sender'
+            text = f"Email from {sender}:\n\n{text}"
+        return text[:MAX_TEXT_LENGTH]
@@ -0,0 +1,199 @@
+"""
+Routine maintenance of the SQLite database (``manage.py db_maintenance``).
+
+Every step is split into short transactions so it can run while the app
+is in use: ANALYZE runs one table at a time with a bounded
+``analysis_limit``, incremental vacuum frees a few hundred pages per
+step, and a snapshot is copied in steps through the SQLite online backup
+API, releasing the database lock in between. The database runs in
+rollback-journal mode, where any reader blocks every writer, so the
+checks that read the whole file (integrity_check, the per-index sizes
+from ``dbstat``) run on that snapshot, never on the live database. Only
+the one-off switch to ``auto_vacuum=INCREMENTAL`` rewrites the whole file
+(a full VACUUM) and needs a quiet moment.
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def _pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def database_path(connection):
+    return Path(connection.settings_dict['NAME'])
+
+
+def stats(connection):
+    """File size, free pages and settings; only reads the database header pragmas."""
+    path = database_path(connection)
+    wal = path.with_name(path.name + '-wal')
+    with connection.cursor() as cursor:
+        return {
+            'file_bytes': path.stat().st_size,
+            'wal_bytes': wal.stat().st_size if wal.exists() else 0,
+            'page_size': _pragma(cursor, 'page_size'),
+            'page_count': _pragma(cursor, 'page_count'),
+            'freelist_count': _pragma(cursor, 'freelist_count'),
+            'auto_vacuum': AUTO_VACUUM_MODES.get(_pragma(cursor, 'auto_vacuum')),
+            'journal_mode': _pragma(cursor, 'journal_mode'),
+        }
+
+
+def index_stats(path):
+    """
+    Size and planner statistics of every index in the database file at
+    ``path``, largest first. ``dbstat`` reads every page, so pass a
+    snapshot, not the live database.
+    """
+    db = sqlite3.connect(path)
+    try:
+        planner = {}
+        if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            planner = dict(db.execute("SELECT idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL"))
+        try:
+            # dbstat is a compile-time option; most builds include it
+            rows = db.execute(
+                "SELECT m.name, m.tbl_name, COUNT(*), SUM(s.pgsize) FROM sqlite_master m "
+                "JOIN dbstat s ON s.name = m.name WHERE m.type = 'index' "
+                "GROUP BY m.name ORDER BY SUM(s.pgsize) DESC"
+            ).fetchall()
+        except sqlite3.DatabaseError:
+            rows = []
+    finally:
+        db.close()
+    return [
+        {'name': name, 'table': table, 'pages': pages, 'bytes': size, 'stat': planner.get(name)}
+        for name, table, pages, size in rows
+    ]
+
+
+def set_busy_timeout(connection, seconds):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA busy_timeout = {int(seconds * 1000)}')
+
+
+def analyze(connection, analysis_limit=1000):
+    """Refresh planner statistics one table at a time; returns the tables analyzed."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        tables = [row[0] for row in cursor.fetchall()]
+        for table in tables:
+            cursor.execute(f'ANALYZE {_quote(table)}')
+        cursor.execute('PRAGMA optimize')
+    return tables
+
+
+def enable_incremental_vacuum(connection):
+    """Switch to auto_vacuum=INCREMENTAL. Rewrites the whole file with an exclusive lock."""
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+
+
+def incremental_vacuum(connection, pages=500, pause=0.05, max_seconds=60):
+    """Return free pages to the filesystem ``pages`` at a time; returns the number freed."""
+    freed = 0
+    deadline = time.monotonic() + max_seconds
+    with connection.cursor() as cursor:
+        if _pragma(cursor, 'auto_vacuum') != 2:
+            return None
+        while time.monotonic() < deadline:
+            free = _pragma(cursor, 'freelist_count')
+            if not free:
+                break
+            # executescript steps the pragma to completion; execute() would
+            # free a single page
+            connection.connection.executescript(f'PRAGMA incremental_vacuum({min(pages, free)})')
+            step = free - _pragma(cursor, 'freelist_count')
+            if not step:
+                break
+            freed += step
+            time.sleep(pause)
+    return freed
+
+
+def checkpoint(connection, mode='PASSIVE'):
+    """Checkpoint the WAL; (busy, log frames, checkpointed frames), or None outside WAL mode."""
+    with connection.cursor() as cursor:
+        if _pragma(cursor, 'journal_mode') != 'wal':
+            return None
+        cursor.execute(f'PRAGMA wal_checkpoint({mode})')
+        return cursor.fetchone()
+
+
+def integrity_check(path, quick=False, max_errors=100):
+    """
+    Problems found by integrity_check (or quick_check) in the database file
+    at ``path``; an empty list when it is fine. The check holds a read lock
+    for its whole run, so pass a snapshot, not the live database.
+    """
+    db = sqlite3.connect(path)
+    try:
+        problems = [row[0] for row in db.execute(
+            f"PRAGMA {'quick_check' if quick else 'integrity_check'}({int(max_errors)})"
+        )]
+    finally:
+        db.close()
+    return [] if problems == ['ok'] else problems
+
+
+def backup_dir():
+    return Path(getattr(settings, 'DB_BACKUP_DIR', settings.BASE_DIR / 'var' / 'backups'))
+
+
+def snapshot(connection, directory=None, pages=1000, pause=0.05):
+    """
+    Copy the database with the online backup API, ``pages`` pages per step,
+    to a hidden staging file in ``directory``; returns its path. Pass it to
+    ``keep_backup`` or delete it.
+    """
+    directory = Path(directory or backup_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / f".snapshot-{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}.sqlite3.tmp"
+    connection.ensure_connection()
+    dest = sqlite3.connect(target)
+    try:
+        connection.connection.backup(dest, pages=pages, sleep=pause)
+    except BaseException:
+        dest.close()
+        target.unlink()
+        raise
+    dest.close()
+    return target
+
+
+def keep_backup(staging, keep=7):
+    """
+    Move a checked snapshot into place as ``db-<timestamp>.sqlite3`` next to
+    it and delete all but the newest ``keep`` backups. Returns the path.
+    """
+    directory = staging.parent
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    target = directory / f'db-{stamp}.sqlite3'
+    counter = 1
+    while target.exists():
+        # Two runs in the same microsecond; the name must stay sortable
+        target = directory / f'db-{stamp}-{counter}.sqlite3'
+        counter += 1
+    os.replace(staging, target)
+
+    backups = sorted(directory.glob('db-*.sqlite3'))
+    for old in backups[:max(len(backups) - keep, 0)]:
+        old.unlink()
+    return target
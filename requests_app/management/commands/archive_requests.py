@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from requests_app import archive
+
+
+class Command(BaseCommand):
+    help = "Move requests resolved more than --older-than days ago, with their resolution steps, to the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=getattr(settings, 'ARCHIVE_AFTER_DAYS', 365),
+                            metavar='DAYS', help="Archive requests resolved at least this many days ago")
+        parser.add_argument('--batch-size', type=int, default=500, help="Requests moved per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many requests would be archived")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        if options['dry_run']:
+            count = archive.archivable(cutoff).count()
+            self.stdout.write(f"{count} requests resolved before {cutoff:%Y-%m-%d} would be archived")
+            return
+
+        total = 0
+        for moved in archive.archive_resolved(cutoff, options['batch_size']):
+            total += moved
+            self.stdout.write(f"Archived {total} requests...")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} requests resolved before {cutoff:%Y-%m-%d}"))
@@ -0,0 +1,68 @@
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+User = get_user_model()
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure login throughput and the database writes performed per login"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help="Number of logins to perform")
+
+    def handle(self, *args, **options):
+        logins = options['logins']
+        # Everything runs inside a transaction that is rolled back, so the
+        # benchmark user and its sessions never reach the real database.
+        try:
+            with transaction.atomic():
+                self._run(logins)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, logins):
+        user = User.objects.create_user(username='__benchmark_login__', password=None)
+        client = Client()
+
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(logins):
+                client.force_login(user)
+            elapsed = time.perf_counter() - start
+
+        writes = Counter()
+        reads = 0
+        for query in ctx.captured_queries:
+            sql = query['sql'].lstrip()
+            verb = sql.split(' ', 1)[0].upper()
+            if verb in WRITE_PREFIXES:
+                writes[self._table(sql)] += 1
+            elif verb == 'SELECT':
+                reads += 1
+
+        self.stdout.write(f"Logins:              {logins}")
+        self.stdout.write(f"Logins per second:   {logins / elapsed:.1f}")
+        self.stdout.write(f"Reads per login:     {reads / logins:.2f}")
+        self.stdout.write(f"Writes per login:    {sum(writes.values()) / logins:.2f}")
+        for table, count in writes.most_common():
+            self.stdout.write(f"  {table}: {count / logins:.2f}")
+
+    @staticmethod
+    def _table(sql):
+        for token in sql.replace('"', ' ').split():
+            if '_' in token and token.upper() not in ('INTO', 'FROM', 'SET'):
+                return token
+        return 'unknown'
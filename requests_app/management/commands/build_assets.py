@@ -0,0 +1,40 @@
+import gzip
+import shutil
+import subprocess
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Build the purged, minified site stylesheet from the templates with the Tailwind CLI"
+
+    def handle(self, *args, **options):
+        app_dir = Path(apps.get_app_config('requests_app').path)
+        source = app_dir / 'assets' / 'tailwind.css'
+        output = app_dir / 'static' / 'css' / 'app.css'
+
+        cli = shutil.which(settings.TAILWIND_CLI)
+        if cli is None:
+            raise CommandError(
+                f"Tailwind CLI '{settings.TAILWIND_CLI}' not found. Install the standalone "
+                "tailwindcss binary (v4) and put it on PATH or set TAILWIND_CLI."
+            )
+
+        # The CLI resolves @source paths relative to the input file, so the
+        # templates it scans are always the app's own.
+        result = subprocess.run(
+            [cli, '--input', str(source), '--output', str(output), '--minify'],
+            capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Tailwind build failed:\n{result.stderr}")
+
+        size = output.stat().st_size
+        compressed = len(gzip.compress(output.read_bytes()))
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {output.relative_to(settings.BASE_DIR)} ({size / 1024:.1f} KiB, {compressed / 1024:.1f} KiB gzipped)"
+        ))
+        self.stdout.write("Run collectstatic to publish the hashed and precompressed copies.")
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from requests_app import report_builder
+from requests_app.reports import merge_summaries, resolution_percentiles
+
+
+class Command(BaseCommand):
+    help = "Build weekly and monthly management reports (HTML, CSV and JSON) for the staff report pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=report_builder.PERIODS, action='append',
+                            help="Period to build (repeatable); default: week and month")
+        parser.add_argument('--count', type=int, default=1, help="Number of past complete periods to build")
+        parser.add_argument('--include-current', action='store_true', help="Also build the period in progress")
+        parser.add_argument('--force', action='store_true', help="Rebuild periods that already have a report")
+        parser.add_argument('--chunk-days', type=int, default=7, help="Days aggregated per worker task")
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help="Worker processes; 1 computes everything in this process")
+
+    def handle(self, *args, **options):
+        index = report_builder.load_index()
+        todo = []
+        for period in options['period'] or report_builder.PERIODS:
+            for start, end, label in report_builder.recent_periods(period, options['count'], options['include_current']):
+                # Complete periods do not change once built; the current one always does
+                complete = end <= timezone.now()
+                if f'{period}/{label}' in index and complete and not options['force']:
+                    self.stdout.write(f"Skipping {period} {label}: already built")
+                    continue
+                todo.append((period, start, end, label))
+        if not todo:
+            return
+
+        # One flat task list so small periods do not leave workers idle
+        tasks = [(i, bounds) for i, (_, start, end, _) in enumerate(todo)
+                 for bounds in report_builder.chunks(start, end, options['chunk_days'])]
+        started = time.perf_counter()
+        connections.close_all()
+        summaries = report_builder.summarize([bounds for _, bounds in tasks], workers=options['workers'])
+
+        for i, (period, start, end, label) in enumerate(todo):
+            merged = merge_summaries(summary for (task, _), summary in zip(tasks, summaries) if task == i)
+            merged['resolution_percentiles'] = resolution_percentiles(start, end)
+            report = report_builder.build_report(period, start, end, label, merged)
+            path = report_builder.write_report(report)
+            self.stdout.write(f"Built {period} {label}: {report['totals']['opened']} opened, "
+                              f"{report['totals']['resolved']} resolved -> {path}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {len(todo)} reports from {len(tasks)} chunks in {time.perf_counter() - started:.2f}s"
+        ))
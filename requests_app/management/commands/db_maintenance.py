@@ -0,0 +1,138 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from requests_app import maintenance
+
+
+def _size(num_bytes):
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    for unit in ('KB', 'MB', 'GB'):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}"
+
+
+class Command(BaseCommand):
+    help = ("Refresh planner statistics, reclaim free pages, checkpoint the WAL, check integrity and back up "
+            "the SQLite database, in short steps that are safe during business hours (run it from cron). "
+            "The integrity check runs on a snapshot, not on the live database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-analyze', action='store_true', help="Do not refresh planner statistics")
+        parser.add_argument('--skip-vacuum', action='store_true', help="Do not run the incremental vacuum")
+        parser.add_argument('--skip-integrity-check', action='store_true',
+                            help="Do not check the database (a backup is still quick_checked)")
+        parser.add_argument('--quick-check', action='store_true',
+                            help="Use quick_check, which skips index consistency checks, instead of integrity_check")
+        parser.add_argument('--analysis-limit', type=int, default=1000,
+                            help="Rows sampled per index by ANALYZE (0 for a full scan)")
+        parser.add_argument('--vacuum-pages', type=int, default=500, help="Pages freed per vacuum step")
+        parser.add_argument('--max-vacuum-seconds', type=float, default=60.0, help="Stop vacuuming after this long")
+        parser.add_argument('--checkpoint-mode', choices=('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'), default='PASSIVE',
+                            help="WAL checkpoint mode; PASSIVE never waits for readers or writers")
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help="Switch the database to auto_vacuum=INCREMENTAL. One-off: this runs a full "
+                                 "VACUUM that locks the database, so run it outside business hours")
+        parser.add_argument('--backup', action='store_true', help="Take an online backup")
+        parser.add_argument('--backup-dir', default=None,
+                            help="Where backups and the snapshot checked by integrity_check go (default DB_BACKUP_DIR)")
+        parser.add_argument('--keep', type=int, default=getattr(settings, 'DB_BACKUP_KEEP', 7),
+                            help="Backups to keep")
+        parser.add_argument('--step-pause', type=float, default=0.05,
+                            help="Seconds to pause between vacuum and backup steps, letting the app write")
+        parser.add_argument('--busy-timeout', type=float, default=5.0,
+                            help="Seconds to wait for a lock held by the app before giving up")
+        parser.add_argument('--indexes', type=int, default=10,
+                            help="Largest indexes to list, measured on the snapshot (0 to skip)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("db_maintenance only supports SQLite databases.")
+        if options['keep'] < 1:
+            raise CommandError("--keep must be at least 1.")
+        maintenance.set_busy_timeout(connection, options['busy_timeout'])
+        before = maintenance.stats(connection)
+        self.report("Before", before)
+
+        if options['enable_incremental_vacuum']:
+            if before['auto_vacuum'] == 'incremental':
+                self.stdout.write("auto_vacuum is already INCREMENTAL")
+            else:
+                started = time.perf_counter()
+                maintenance.enable_incremental_vacuum(connection)
+                self.stdout.write(f"Switched to auto_vacuum=INCREMENTAL with a full VACUUM in "
+                                  f"{time.perf_counter() - started:.2f}s")
+
+        if not options['skip_analyze']:
+            started = time.perf_counter()
+            tables = maintenance.analyze(connection, options['analysis_limit'])
+            self.stdout.write(f"Analyzed {len(tables)} tables in {time.perf_counter() - started:.2f}s")
+
+        if not options['skip_vacuum']:
+            started = time.perf_counter()
+            freed = maintenance.incremental_vacuum(
+                connection, options['vacuum_pages'], options['step_pause'], options['max_vacuum_seconds'],
+            )
+            if freed is None:
+                self.stdout.write(self.style.WARNING(
+                    f"Incremental vacuum unavailable (auto_vacuum={before['auto_vacuum']}); "
+                    f"run once with --enable-incremental-vacuum outside business hours"
+                ))
+            else:
+                self.stdout.write(f"Freed {freed} pages in {time.perf_counter() - started:.2f}s")
+
+        result = maintenance.checkpoint(connection, options['checkpoint_mode'])
+        if result is None:
+            self.stdout.write(f"WAL checkpoint skipped (journal_mode={before['journal_mode']})")
+        else:
+            busy, log, checkpointed = result
+            self.stdout.write(f"WAL checkpoint ({options['checkpoint_mode']}): {checkpointed}/{log} frames"
+                              f"{', blocked by a reader or writer' if busy else ''}")
+
+        self.report("After", maintenance.stats(connection))
+
+        if options['skip_integrity_check'] and not options['backup'] and not options['indexes']:
+            return
+        # The whole-file reads run on a snapshot copied in short steps
+        started = time.perf_counter()
+        staging = maintenance.snapshot(connection, options['backup_dir'], pause=options['step_pause'])
+        self.stdout.write(f"Snapshot taken in {time.perf_counter() - started:.2f}s")
+        try:
+            if not options['skip_integrity_check'] or options['backup']:
+                started = time.perf_counter()
+                # A backup is always at least quick_checked before it is kept
+                quick = options['quick_check'] or options['skip_integrity_check']
+                problems = maintenance.integrity_check(staging, quick=quick)
+                check = 'quick_check' if quick else 'integrity_check'
+                if problems:
+                    for problem in problems:
+                        self.stderr.write(problem)
+                    raise CommandError(f"The database failed its {check} ({len(problems)} problems)"
+                                       f"{'; no backup was taken' if options['backup'] else ''}.")
+                self.stdout.write(f"{check} ok in {time.perf_counter() - started:.2f}s")
+
+            for index in maintenance.index_stats(staging)[:options['indexes']]:
+                # sqlite_stat1: row count, then average rows per distinct key prefix
+                stat = index['stat'] or 'not analyzed'
+                self.stdout.write(f"  {index['name']} on {index['table']}: {_size(index['bytes'])} "
+                                  f"in {index['pages']} pages; stats {stat}")
+
+            if options['backup']:
+                path = maintenance.keep_backup(staging, keep=options['keep'])
+                staging = None
+                self.stdout.write(self.style.SUCCESS(f"Backed up to {path} ({_size(path.stat().st_size)})"))
+        finally:
+            if staging is not None:
+                staging.unlink()
+
+    def report(self, heading, stats):
+        free_bytes = stats['freelist_count'] * stats['page_size']
+        self.stdout.write(
+            f"{heading}: {_size(stats['file_bytes'])} file, {_size(stats['wal_bytes'])} WAL, "
+            f"{stats['page_count']} pages, {stats['freelist_count']} free ({_size(free_bytes)}), "
+            f"auto_vacuum={stats['auto_vacuum']}, journal_mode={stats['journal_mode']}"
+        )
@@ -0,0 +1,61 @@
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from requests_app import mail_ingest
+
+
+class Command(BaseCommand):
+    help = "Import emailed requests from an mbox file or Maildir directory, resuming where the last run stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('mailbox', help="Path of an mbox file or a Maildir directory")
+        parser.add_argument('--batch-size', type=int, default=500, help="Messages written per transaction")
+        parser.add_argument('--user', default=getattr(settings, 'MAIL_INGEST_USERNAME', ''),
+                            help="Account recorded as the author of replies from unknown senders")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore the checkpoint and read the whole mbox (imported messages are still skipped)")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['mailbox'])
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+        try:
+            fallback_user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']!r} not found; set MAIL_INGEST_USERNAME or pass --user.")
+
+        ingestor = mail_ingest.MailIngestor(path, fallback_user)
+        if os.path.isdir(path):
+            # Listed in full every run; imported messages are skipped by Message-ID
+            messages = mail_ingest.iter_maildir(path, known=ingestor.known_message_ids,
+                                                batch_size=options['batch_size'])
+        else:
+            checkpoint = None if options['restart'] else ingestor.checkpoint()
+            messages = mail_ingest.iter_mbox(path, offset=int(checkpoint or 0))
+            if checkpoint:
+                self.stdout.write(f"Resuming {path} after byte {checkpoint}")
+
+        started = time.perf_counter()
+        batch, unparsable, position = [], 0, None
+        for position, raw in messages:
+            parsed = mail_ingest.parse(raw)
+            if parsed is None:
+                unparsable += 1
+            else:
+                batch.append(parsed)
+            if len(batch) >= options['batch_size']:
+                ingestor.write_batch(batch, position)
+                batch = []
+                self.stdout.write(f"{ingestor.created} requests, {ingestor.appended} replies imported...")
+        if position is not None:
+            ingestor.write_batch(batch, position)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {ingestor.created} new requests and {ingestor.appended} replies in "
+            f"{time.perf_counter() - started:.2f}s; skipped {ingestor.skipped} already imported "
+            f"and {unparsable} unreadable messages"
+        ))
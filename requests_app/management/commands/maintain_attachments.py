@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from requests_app import attachments
+from requests_app.models import Attachment, Blob
+
+
+class Command(BaseCommand):
+    help = "Delete unreferenced attachment blobs and render missing thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thumbnails', action='store_true',
+                            help="Render thumbnails that are missing (e.g. queued when a worker restarted)")
+        parser.add_argument('--tmp-age', type=int, default=24 * 60 * 60,
+                            help="Remove abandoned upload temp files older than this many seconds")
+
+    def handle(self, *args, **options):
+        unreferenced = Blob.objects.exclude(Exists(Attachment.objects.filter(blob=OuterRef('pk'))))
+        pruned = 0
+        for digest in list(unreferenced.values_list('sha256', flat=True)):
+            with transaction.atomic():
+                # Re-checked under the lock store() takes, and the row is
+                # deleted before the files: an upload racing with the prune
+                # either keeps the blob or creates it again from its own file
+                if not attachments.lock_blob(digest):
+                    continue
+                candidate = unreferenced.filter(sha256=digest)
+                if not candidate.delete()[0]:
+                    continue
+                for path in (attachments.blob_path(digest), attachments.thumbnail_path(digest)):
+                    if path.exists():
+                        path.unlink()
+            pruned += 1
+
+        stale = 0
+        tmp_dir = attachments.root() / 'tmp'
+        if tmp_dir.exists():
+            cutoff = time.time() - options['tmp_age']
+            for entry in os.scandir(tmp_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    stale += 1
+
+        rendered = 0
+        if options['thumbnails']:
+            images = Blob.objects.filter(content_type__in=attachments.THUMBNAIL_TYPES)
+            for digest in images.values_list('sha256', flat=True).iterator():
+                if not attachments.thumbnail_path(digest).exists() and attachments.make_thumbnail(digest):
+                    rendered += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Pruned {pruned} unreferenced blobs and {stale} stale uploads; rendered {rendered} thumbnails"
+        ))
@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from requests_app.models import UserProfile
+
+User = get_user_model()
+
+FIELDS = ('username', 'email', 'first_name', 'last_name', 'department', 'password')
+
+
+def _init_worker(settings_module):
+    # Workers started with the "spawn" method need Django configured before
+    # they can hash passwords with the project's PASSWORD_HASHERS.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def _hash_password(raw_password):
+    # An empty password gets an unusable hash, like create_user(password=None)
+    return make_password(raw_password or None)
+
+
+def read_rows(path, fmt=None, on_invalid=None):
+    """
+    Yield user dicts from a CSV (with a header row) or JSONL file. Rows with
+    non-string values or no username are passed to
+    ``on_invalid(line_no, reason)`` and skipped.
+    """
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as fh:
+        if fmt == 'csv':
+            rows = csv.DictReader(fh)
+        else:
+            rows = (json.loads(line) for line in fh if line.strip())
+        for line_no, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                reason = "is not an object"
+            else:
+                reason = next((f"has a non-string {field}" for field in FIELDS
+                               if not isinstance(row.get(field) or '', str)), None)
+                if not reason and not (row.get('username') or '').strip():
+                    reason = "has no username"
+            if reason:
+                if on_invalid:
+                    on_invalid(line_no, reason)
+                continue
+            yield {field: (row.get(field) or '').strip() for field in FIELDS}
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "Create users and their profiles in bulk from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file with username, email, first_name, last_name, department and password")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Input format (guessed from the extension by default)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows inserted per batch")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes used for password hashing")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and hash, but do not write anything")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['workers'] < 1 or batch_size < 1:
+            raise CommandError("--workers and --batch-size must be at least 1")
+        created = skipped = invalid = 0
+        verb = "Would create" if options['dry_run'] else "Created"
+        # Usernames already taken or queued, across batches, so a repeat in a
+        # later batch is skipped (and reported as such by --dry-run)
+        seen = set()
+
+        def report_invalid(line_no, reason):
+            nonlocal invalid
+            invalid += 1
+            self.stderr.write(f"Skipping row {line_no} of {options['path']}: it {reason}")
+
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            initializer=_init_worker,
+            initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+        ) as pool:
+            for batch in chunked(read_rows(options['path'], options['format'], report_invalid), batch_size):
+                rows_read = len(batch)
+                batch = self._new_rows(batch, seen)
+                skipped += rows_read - len(batch)
+                if not batch:
+                    continue
+                # Hashing dominates the cost of creating a user, so spread it
+                # over all cores; map() keeps the results in input order.
+                chunksize = max(1, len(batch) // (options['workers'] * 4))
+                hashes = pool.map(_hash_password, [row['password'] for row in batch], chunksize=chunksize)
+                users = [
+                    User(
+                        username=row['username'],
+                        email=row['email'],
+                        first_name=row['first_name'],
+                        last_name=row['last_name'],
+                        password=password,
+                        date_joined=timezone.now(),
+                    )
+                    for row, password in zip(batch, hashes)
+                ]
+                if not options['dry_run']:
+                    self._insert(batch, users)
+                created += len(users)
+                self.stdout.write(f"{verb} {created} users...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {created} users, skipped {skipped} existing usernames and {invalid} invalid rows"
+        ))
+
+    def _new_rows(self, batch, seen):
+        """Drop rows whose username already exists or was seen in this or an earlier batch."""
+        usernames = [row['username'] for row in batch if row['username'] not in seen]
+        seen.update(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        rows = []
+        for row in batch:
+            if row['username'] not in seen:
+                seen.add(row['username'])
+                rows.append(row)
+        return rows
+
+    @transaction.atomic
+    def _insert(self, batch, users):
+        # bulk_create bypasses post_save, so the profiles are inserted here
+        # in a second bulk statement instead of one by one from the signal.
+        User.objects.bulk_create(users)
+        ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+        UserProfile.objects.bulk_create([
+            UserProfile(user_id=ids[row['username']], department=row['department'] or None)
+            for row in batch
+        ])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from requests_app import duplicates
+from requests_app.models import DuplicateBucket, DuplicateSignature, ServiceRequest
+
+
+class Command(BaseCommand):
+    help = "Rebuild the near-duplicate (MinHash/LSH) index for all open requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Requests indexed per transaction")
+
+    def handle(self, *args, **options):
+        # Migration 0010 builds the index once; rebuild it after changing
+        # the signature parameters in duplicates.py
+        DuplicateBucket.objects.all().delete()
+        DuplicateSignature.objects.all().delete()
+
+        indexed = 0
+        last_pk = 0
+        open_requests = ServiceRequest.objects.exclude(status='Resolved').only('id', 'status', 'description')
+        while True:
+            batch = list(open_requests.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                duplicates.index_requests(batch)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} open requests ({duplicates.BANDS} bands x {duplicates.ROWS_PER_BAND} rows)"
+        ))
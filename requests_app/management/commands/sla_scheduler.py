@@ -0,0 +1,101 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from requests_app.models import ServiceRequest, StatusTransition
+from requests_app.views import send_sla_escalation_email
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Escalate Pending requests that pass their SLA deadline, sleeping until the next one is due"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Requests escalated per batch")
+        parser.add_argument('--max-sleep', type=float, default=60.0,
+                            help="Longest sleep in seconds, so new or re-categorised requests are picked up")
+        parser.add_argument('--once', action='store_true', help="Escalate everything currently due and exit")
+        parser.add_argument('--recompute', action='store_true',
+                            help="Recompute due_at for queued requests (after changing SLA_TARGET_HOURS) and exit")
+
+    def handle(self, *args, **options):
+        if options['recompute']:
+            self.recompute(options['batch_size'])
+            return
+
+        try:
+            while True:
+                close_old_connections()
+                escalated = self.escalate_due(options['batch_size'])
+                if escalated:
+                    # A full batch may mean more are already due
+                    continue
+                if options['once']:
+                    return
+                time.sleep(self.seconds_until_next_deadline(options['max_sleep']))
+        except KeyboardInterrupt:
+            self.stdout.write("SLA scheduler stopped.")
+
+    def escalate_due(self, batch_size):
+        """Escalate up to ``batch_size`` overdue requests, earliest deadline first."""
+        now = timezone.now()
+        # An index range scan on sla_queue_idx: the cost is proportional to
+        # the number of requests due, not to the size of the open backlog
+        overdue = list(
+            ServiceRequest.sla_queue()
+            .filter(due_at__lte=now)
+            .order_by('due_at')
+            .only('id', 'requester_name', 'department', 'category', 'due_at')[:batch_size]
+        )
+        if not overdue:
+            return 0
+
+        with transaction.atomic():
+            # Conditional so a concurrent resolve or scheduler isn't overwritten;
+            # only the rows this UPDATE changed carry our timestamp, so only
+            # those are reported and emailed
+            ServiceRequest.sla_queue().filter(pk__in=[req.pk for req in overdue]).update(escalated_at=now)
+            escalated = set(
+                ServiceRequest.objects.filter(pk__in=[req.pk for req in overdue], escalated_at=now)
+                .values_list('pk', flat=True)
+            )
+        overdue = [req for req in overdue if req.pk in escalated]
+        if not overdue:
+            return 0
+        send_sla_escalation_email(overdue)
+        logger.info("Escalated %d overdue request(s): %s", len(overdue), ', '.join(f"#{req.pk}" for req in overdue))
+        self.stdout.write(f"Escalated {len(overdue)} overdue request(s)")
+        return len(overdue)
+
+    def seconds_until_next_deadline(self, max_sleep):
+        next_due = ServiceRequest.sla_queue().order_by('due_at').values_list('due_at', flat=True).first()
+        if next_due is None:
+            return max_sleep
+        return min(max_sleep, max((next_due - timezone.now()).total_seconds(), 0))
+
+    def recompute(self, batch_size):
+        updated = 0
+        last_pk = 0
+        pending_since = Subquery(
+            StatusTransition.objects.filter(service_request=OuterRef('pk'), to_status='Pending', from_status__gt='')
+            .order_by('-entered_at').values('entered_at')[:1]
+        )
+        while True:
+            batch = list(
+                ServiceRequest.sla_queue().filter(pk__gt=last_pk).order_by('pk')
+                .only('id', 'category', 'created_at').annotate(pending_since=pending_since)[:batch_size]
+            )
+            if not batch:
+                break
+            for req in batch:
+                # Reopened requests count from when they last entered Pending
+                req.due_at = req.sla_due_at(start=req.pending_since)
+            ServiceRequest.objects.bulk_update(batch, ['due_at'])
+            updated += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f"Recomputed due_at for {updated} request(s)"))
@@ -0,0 +1,213 @@
+"""
+In-process request metrics.
+
+RequestMetricsMiddleware records, per URL name, wall time, SQL query count
+and time, template render time and response size into fixed-bucket
+histograms. ``registry.render()`` exposes them in the Prometheus text
+format for the staff-only /metrics view. Each worker process keeps its own
+histograms.
+"""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Per-request statistics, filled in by the SQL wrapper and template backend
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds, as Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Histograms keyed by (metric name, view name), guarded by one lock."""
+
+    METRICS = {
+        'request_duration_seconds': ("Wall time spent handling the request.", DURATION_BUCKETS),
+        'db_queries': ("SQL queries executed per request.", QUERY_COUNT_BUCKETS),
+        'db_duration_seconds': ("Time spent in SQL queries per request.", DURATION_BUCKETS),
+        'template_render_seconds': ("Time spent rendering templates per request.", DURATION_BUCKETS),
+        'response_size_bytes': ("Size of the response body.", SIZE_BUCKETS),
+    }
+    PREFIX = 'itservicetracker_'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._responses = {}
+
+    def record(self, view, status, observations):
+        with self._lock:
+            for name, value in observations.items():
+                key = (name, view)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.METRICS[name][1])
+                histogram.observe(value)
+            self._responses[(view, status)] = self._responses.get((view, status), 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._responses.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(h.cumulative()), h.sum, h.count) for key, h in self._histograms.items()}
+            responses = dict(self._responses)
+
+        lines = []
+        name = f'{self.PREFIX}responses_total'
+        lines.append(f'# HELP {name} Responses by view and status code.')
+        lines.append(f'# TYPE {name} counter')
+        for (view, status), count in sorted(responses.items()):
+            lines.append(f'{name}{{view="{view}",status="{status}"}} {count}')
+
+        for metric, (help_text, _) in self.METRICS.items():
+            name = f'{self.PREFIX}{metric}'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (key_metric, view), (buckets, total, count) in sorted(histograms.items()):
+                if key_metric != metric:
+                    continue
+                for bound, cumulative in buckets:
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{name}_bucket{{view="{view}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{view}"}} {total}')
+                lines.append(f'{name}_count{{view="{view}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class _RequestStats:
+    __slots__ = ('query_count', 'query_time', 'template_time', 'queries')
+
+    # Only this many statements are kept for the slow-request log
+    MAX_KEPT_QUERIES = 100
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.query_time += elapsed
+            if len(self.queries) < self.MAX_KEPT_QUERIES:
+                self.queries.append((elapsed, sql))
+
+
+class RequestMetricsMiddleware:
+    """Record per-view timing, query and size metrics for every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        stats = _RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        observations = {
+            'request_duration_seconds': duration,
+            'db_queries': stats.query_count,
+            'db_duration_seconds': stats.query_time,
+            'template_render_seconds': stats.template_time,
+        }
+        if not response.streaming:
+            observations['response_size_bytes'] = len(response.content)
+        registry.record(view, response.status_code, observations)
+
+        if duration >= getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1.0) and \
+                random.random() < getattr(settings, 'METRICS_SLOW_SAMPLE_RATE', 0.1):
+            self._log_slow_request(request, view, duration, stats)
+        return response
+
+    @staticmethod
+    def _log_slow_request(request, view, duration, stats):
+        slowest = sorted(stats.queries, reverse=True)[:5]
+        logger.warning(
+            "Slow request %s %s (%s) took %.3fs: %d queries in %.3fs, templates %.3fs. Slowest SQL:\n%s",
+            request.method, request.path, view, duration, stats.query_count, stats.query_time,
+            stats.template_time, '\n'.join(f"  {elapsed:.4f}s {sql}" for elapsed, sql in slowest),
+        )
+
+
+class InstrumentedTemplate(Template):
+    """Template whose top-level renders are timed into the current request's stats."""
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend returning InstrumentedTemplate instances."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.utils.functional import cached_property
+
+# Backends that sessions created before ProfileModelBackend may name
+LEGACY_SESSION_BACKENDS = {'django.contrib.auth.backends.ModelBackend'}
+
+
+def display_name(user):
+    """Name used as ``ServiceRequest.requester_name`` for the given user."""
+    return user.get_full_name() or user.get_username()
+
+
+class UserContext:
+    """
+    Facts about the current user that views and templates need several
+    times per request. Each one is computed on first use and then memoized,
+    so the profile is looked up at most once per request.
+    """
+
+    def __init__(self, request):
+        self._request = request
+
+    @cached_property
+    def user(self):
+        return self._request.user
+
+    @cached_property
+    def is_authenticated(self):
+        return self.user.is_authenticated
+
+    @cached_property
+    def display_name(self):
+        return display_name(self.user) if self.is_authenticated else ''
+
+    @cached_property
+    def profile(self):
+        if not self.is_authenticated:
+            return None
+        # A missing profile raises RelatedObjectDoesNotExist, which getattr
+        # treats as an AttributeError
+        return getattr(self.user, 'profile', None)
+
+    @cached_property
+    def department(self):
+        return self.profile.department if self.profile else None
+
+    @cached_property
+    def role(self):
+        if not self.is_authenticated:
+            return 'anonymous'
+        return 'admin' if self.user.is_staff else 'user'
+
+
+class UserContextMiddleware:
+    """Attach a lazily evaluated ``UserContext`` to every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user_context = UserContext(request)
+        return self.get_response(request)
+
+
+class LegacySessionBackendMiddleware:
+    """
+    Point sessions that name a backend no longer in AUTHENTICATION_BACKENDS
+    (sessions store the path of the backend that logged the user in) at
+    the first configured one, so they stay logged in. Rewrites the session
+    once, whatever the session engine; must run before AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.session.get(BACKEND_SESSION_KEY) in LEGACY_SESSION_BACKENDS:
+            request.session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        return self.get_response(request)
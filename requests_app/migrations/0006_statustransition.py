@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0005_servicerequest_resolved_at_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, choices=[('Pending', 'Pending'), ('In Progress', 'In Progress'), ('Resolved', 'Resolved')], max_length=20)),
+                ('to_status', models.CharField(choices=[('Pending', 'Pending'), ('In Progress', 'In Progress'), ('Resolved', 'Resolved')], max_length=20)),
+                ('category', models.CharField(choices=[('Password Reset', 'Password Reset'), ('Printer Issue', 'Printer Issue'), ('Software Installation', 'Software Installation'), ('Network Problem', 'Network Problem'), ('Other', 'Other')], max_length=100)),
+                ('entered_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('left_at', models.DateTimeField(blank=True, null=True)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('service_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_transitions', to='requests_app.servicerequest')),
+            ],
+            options={
+                'ordering': ['entered_at', 'id'],
+                'indexes': [models.Index(fields=['service_request', 'entered_at'], name='transition_request_idx'), models.Index(fields=['category', 'to_status', 'entered_at'], name='transition_report_idx'), models.Index(fields=['entered_at', 'to_status'], name='transition_period_idx')],
+            },
+        ),
+    ]
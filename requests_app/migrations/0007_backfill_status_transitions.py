@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+def backfill_transitions(apps, schema_editor):
+    """
+    Give every existing request the history we can reconstruct: it entered
+    Pending when created, and its current status at resolved_at (for
+    resolved requests) or its last update.
+    """
+    ServiceRequest = apps.get_model('requests_app', 'ServiceRequest')
+    StatusTransition = apps.get_model('requests_app', 'StatusTransition')
+
+    batch = []
+    for req in ServiceRequest.objects.order_by('pk').iterator(chunk_size=2000):
+        if req.status == 'Pending':
+            batch.append(StatusTransition(
+                service_request_id=req.pk, from_status='', to_status='Pending',
+                category=req.category, entered_at=req.created_at,
+            ))
+        else:
+            changed_at = req.resolved_at if req.status == 'Resolved' and req.resolved_at else req.updated_at
+            changed_at = max(changed_at, req.created_at)
+            batch.append(StatusTransition(
+                service_request_id=req.pk, from_status='', to_status='Pending',
+                category=req.category, entered_at=req.created_at, left_at=changed_at,
+            ))
+            batch.append(StatusTransition(
+                service_request_id=req.pk, from_status='Pending', to_status=req.status,
+                category=req.category, entered_at=changed_at,
+                changed_by_id=req.resolved_by_id if req.status == 'Resolved' else None,
+            ))
+        if len(batch) >= 2000:
+            StatusTransition.objects.bulk_create(batch)
+            batch = []
+    StatusTransition.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0006_statustransition'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_transitions, migrations.RunPython.noop),
+    ]
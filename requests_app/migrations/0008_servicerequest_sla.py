@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:24
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_due_at(apps, schema_editor):
+    ServiceRequest = apps.get_model('requests_app', 'ServiceRequest')
+    now = timezone.now()
+    batch = []
+    for req in ServiceRequest.objects.only('pk', 'status', 'category', 'created_at').iterator(chunk_size=2000):
+        hours = settings.SLA_TARGET_HOURS.get(req.category, settings.SLA_DEFAULT_TARGET_HOURS)
+        req.due_at = req.created_at + timedelta(hours=hours)
+        # The existing backlog is already overdue; mark it escalated so the
+        # first scheduler run only mails requests that go overdue from now on
+        if req.status == 'Pending' and req.due_at <= now:
+            req.escalated_at = now
+        batch.append(req)
+        if len(batch) >= 2000:
+            ServiceRequest.objects.bulk_update(batch, ['due_at', 'escalated_at'])
+            batch = []
+    ServiceRequest.objects.bulk_update(batch, ['due_at', 'escalated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0007_backfill_status_transitions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicerequest',
+            name='due_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='escalated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='servicerequest',
+            index=models.Index(condition=models.Q(('escalated_at__isnull', True), ('status', 'Pending')), fields=['due_at'], name='sla_queue_idx'),
+        ),
+    ]
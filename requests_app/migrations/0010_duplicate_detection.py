@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_open_requests(apps, schema_editor):
+    """Build the duplicate index for the requests that are already open."""
+    from requests_app import duplicates
+
+    ServiceRequest = apps.get_model('requests_app', 'ServiceRequest')
+    DuplicateSignature = apps.get_model('requests_app', 'DuplicateSignature')
+    DuplicateBucket = apps.get_model('requests_app', 'DuplicateBucket')
+
+    signatures, buckets = [], []
+    open_requests = ServiceRequest.objects.exclude(status='Resolved').only('id', 'description').order_by('pk')
+    for req in open_requests.iterator(chunk_size=2000):
+        sig = duplicates.signature(req.description)
+        if sig is None:
+            continue
+        signatures.append(DuplicateSignature(service_request_id=req.pk, signature=duplicates.pack(sig)))
+        buckets.extend(DuplicateBucket(service_request_id=req.pk, key=key) for key in duplicates.band_keys(sig))
+        if len(signatures) >= 2000:
+            DuplicateSignature.objects.bulk_create(signatures)
+            DuplicateBucket.objects.bulk_create(buckets)
+            signatures, buckets = [], []
+    DuplicateSignature.objects.bulk_create(signatures)
+    DuplicateBucket.objects.bulk_create(buckets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0009_servicerequest_assignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateSignature',
+            fields=[
+                ('service_request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='duplicate_signature', serialize=False, to='requests_app.servicerequest')),
+                ('signature', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='servicerequest',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='requests_app.servicerequest'),
+        ),
+        migrations.CreateModel(
+            name='DuplicateBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('service_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='requests_app.servicerequest')),
+            ],
+        ),
+        migrations.RunPython(index_open_requests, migrations.RunPython.noop),
+    ]
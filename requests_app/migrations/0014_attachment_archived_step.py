@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requests_app', '0013_mail_ingest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='archived_step',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='attachments', to='requests_app.archivedresolutionstep'),
+        ),
+        migrations.AddField(
+            model_name='mailmessage',
+            name='archived_step',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='requests_app.archivedresolutionstep'),
+        ),
+    ]
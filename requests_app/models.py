@@ -1,9 +1,15 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from . import duplicates
+
 # Get the User model
 User = get_user_model()
 
@@ -17,6 +23,30 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} Profile"
 
+    @classmethod
+    def for_user(cls, user):
+        """Return the user's profile, creating it lazily if it is missing.
+
+        The result is cached on the user instance, so repeated calls during
+        a request cost at most one query.
+        """
+        try:
+            return user.profile
+        except cls.DoesNotExist:
+            profile, _ = cls.objects.get_or_create(user=user)
+            user.profile = profile
+            return profile
+
+    def update_fields_if_changed(self, **values):
+        """Set the given fields and save only those that actually changed."""
+        changed = [name for name, value in values.items() if getattr(self, name) != value]
+        if not changed:
+            return False
+        for name in changed:
+            setattr(self, name, values[name])
+        self.save(update_fields=changed + ['updated_at'])
+        return True
+
 class ServiceRequest(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
@@ -41,13 +71,220 @@ class ServiceRequest(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
     resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='resolved_requests')
+    # SLA deadline for leaving Pending, from the per-category SLA_TARGET_HOURS
+    due_at = models.DateTimeField(null=True, blank=True)
+    escalated_at = models.DateTimeField(null=True, blank=True)
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_requests')
+    assigned_at = models.DateTimeField(null=True, blank=True)
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates')
 
-    def mark_resolved(self, user=None):
-        self.status = 'Resolved'
-        self.resolved_at = timezone.now()
-        if user:
-            self.resolved_by = user
+    class Meta:
+        indexes = [
+            # Priority queue for the SLA scheduler: only requests that can
+            # still be escalated are in it, ordered by deadline
+            models.Index(
+                fields=['due_at'],
+                condition=Q(status='Pending', escalated_at__isnull=True),
+                name='sla_queue_idx',
+            ),
+            # Technician work queue: unassigned Pending requests, oldest first,
+            # optionally for one category
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=Q(status='Pending', assigned_to__isnull=True),
+                name='work_queue_idx',
+            ),
+            models.Index(
+                fields=['category', 'created_at', 'id'],
+                condition=Q(status='Pending', assigned_to__isnull=True),
+                name='work_queue_category_idx',
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so save() can tell whether the status or
+        # category changed (None when the field was deferred)
+        instance._saved_status = instance.__dict__.get('status')
+        instance._saved_category = instance.__dict__.get('category')
+        instance._saved_description = instance.__dict__.get('description')
+        return instance
+
+    def _changed_since_load(self, field, update_fields):
+        if update_fields is not None and field not in update_fields:
+            return False
+        saved = getattr(self, f'_saved_{field}', None)
+        return saved is not None and self.__dict__.get(field, saved) != saved
+
+    def save(self, *args, **kwargs):
+        """Save, appending a StatusTransition in the same transaction when the status changed"""
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        previous_status = '' if adding else getattr(self, '_saved_status', None)
+        status_changed = adding or self._changed_since_load('status', update_fields)
+        category_changed = not adding and self._changed_since_load('category', update_fields)
+        description_changed = not adding and self._changed_since_load('description', update_fields)
+        if not adding and status_changed and self.status == 'Pending':
+            # Reopened: a fresh SLA clock, and it can be escalated again
+            self.due_at = self.sla_due_at(start=timezone.now())
+            self.escalated_at = None
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'due_at', 'escalated_at'}
+        elif adding or category_changed:
+            self.due_at = self.sla_due_at(start=None if adding else self.pending_since())
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'due_at'}
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if status_changed:
+                StatusTransition.record(self, previous_status, self.status,
+                                        user=getattr(self, '_status_changed_by', None),
+                                        at=self.created_at if adding else None)
+            if category_changed:
+                # Keep the denormalized category on the history in step
+                self.status_transitions.update(category=self.category)
+            if adding or status_changed or description_changed:
+                duplicates.index_request(self)
+        self._saved_status = self.__dict__.get('status')
+        self._saved_category = self.__dict__.get('category')
+        self._saved_description = self.__dict__.get('description')
+        self._status_changed_by = None
+
+    @staticmethod
+    def sla_target(category):
+        """SLA target for leaving Pending, as a timedelta"""
+        hours = settings.SLA_TARGET_HOURS.get(category, settings.SLA_DEFAULT_TARGET_HOURS)
+        return timedelta(hours=hours)
+
+    def sla_due_at(self, start=None):
+        """SLA deadline of a request that entered Pending at ``start`` (default: when it was created)"""
+        return (start or self.created_at) + self.sla_target(self.category)
+
+    def pending_since(self):
+        """When the request last entered Pending: its latest reopening, or its creation"""
+        reopened = (
+            self.status_transitions.filter(to_status='Pending', from_status__gt='')
+            .order_by('-entered_at').values_list('entered_at', flat=True).first()
+        )
+        return reopened or self.created_at
+
+    @property
+    def is_overdue(self):
+        return self.status == 'Pending' and self.due_at is not None and self.due_at <= timezone.now()
+
+    @classmethod
+    def sla_queue(cls):
+        """Pending, not yet escalated requests - matches the sla_queue_idx condition"""
+        return cls.objects.filter(status='Pending', escalated_at__isnull=True, due_at__isnull=False)
+
+    @classmethod
+    def claim_next(cls, user, category=None):
+        """
+        Atomically assign the oldest unassigned Pending request (optionally
+        of ``category``) to ``user`` and move it to In Progress.
+
+        Selecting and claiming happen in one conditional UPDATE ... RETURNING,
+        so technicians pressing "next" at the same moment always get
+        different requests. Returns the claimed request, or None when the
+        queue is empty.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        category_clause = 'AND category = %s' if category else ''
+        # Where supported (PostgreSQL), skip rows another transaction is
+        # claiming instead of queueing behind its lock. SQLite serializes
+        # writers, so the single statement is already atomic there.
+        skip_locked = 'FOR UPDATE SKIP LOCKED' if connection.features.has_select_for_update_skip_locked else ''
+        sql = f"""
+            UPDATE {table}
+            SET assigned_to_id = %s, assigned_at = %s, updated_at = %s, status = 'In Progress'
+            WHERE id = (
+                SELECT id FROM {table}
+                WHERE status = 'Pending' AND assigned_to_id IS NULL {category_clause}
+                ORDER BY created_at, id
+                LIMIT 1 {skip_locked}
+            ) AND status = 'Pending' AND assigned_to_id IS NULL
+            RETURNING id
+        """
+        now = timezone.now()
+        db_now = connection.ops.adapt_datetimefield_value(now)
+        params = [user.pk, db_now, db_now] + ([category] if category else [])
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+            if row is None:
+                return None
+            req = cls.objects.get(pk=row[0])
+            StatusTransition.record(req, 'Pending', 'In Progress', user=user, at=now)
+        return req
+
+    def transition_to(self, status, user=None):
+        """Move the request to ``status``, recording who did it. Returns False if unchanged."""
+        if status == self.status:
+            return False
+        self.status = status
+        if status == 'Resolved':
+            self.resolved_at = timezone.now()
+            if user:
+                self.resolved_by = user
+        self._status_changed_by = user
         self.save()
+        return True
+
+    @classmethod
+    def bulk_transition(cls, requests, status, user=None):
+        """
+        Move many requests to ``status`` with one UPDATE and one bulk insert
+        of their transitions. Returns the number of requests changed.
+        """
+        requests = [req for req in requests if req.status != status]
+        if not requests:
+            return 0
+        now = timezone.now()
+        values = {'status': status, 'updated_at': now}
+        if status == 'Resolved':
+            values['resolved_at'] = now
+            if user:
+                values['resolved_by'] = user
+        update = dict(values)
+        if status == 'Pending':
+            # Reopened, as in save(): a fresh SLA clock per category
+            values['escalated_at'] = None
+            categories = {req.category for req in requests}
+            update.update(escalated_at=None, due_at=Case(
+                *[When(category=category, then=Value(now + cls.sla_target(category))) for category in categories],
+                default=Value(now + cls.sla_target(None)),
+            ))
+        reopened = [req for req in requests if req.status == 'Resolved']
+        with transaction.atomic():
+            cls.objects.filter(pk__in=[req.pk for req in requests]).update(**update)
+            StatusTransition.record_bulk(requests, status, user=user, at=now)
+            for req in requests:
+                for field, value in values.items():
+                    setattr(req, field, value)
+                if status == 'Pending':
+                    req.due_at = req.sla_due_at(start=now)
+                req._saved_status = status
+            if status == 'Resolved':
+                duplicates.remove_from_index(requests)
+            elif reopened:
+                # Open again, so back in the duplicate index, as save() does
+                duplicates.index_requests(reopened)
+        return len(requests)
+
+    def mark_resolved(self, user=None):
+        self.transition_to('Resolved', user=user)
+
+    def merge_into(self, target, user=None):
+        """Close this request as a duplicate of ``target``"""
+        if target.pk == self.pk:
+            raise ValueError("A request cannot be merged into itself")
+        self.duplicate_of = target
+        if not self.transition_to('Resolved', user=user):
+            self.save(update_fields=['duplicate_of', 'updated_at'])
 
     def __str__(self):
         return f"{self.requester_name} - {self.category} ({self.status})"
@@ -57,11 +294,9 @@ class ServiceRequest(models.Model):
         has_steps = self.resolution_steps.exists()
         
         if has_steps and self.status == 'Pending':
-            self.status = 'In Progress'
-            self.save()
+            self.transition_to('In Progress')
         elif not has_steps and self.status == 'In Progress':
-            self.status = 'Pending'
-            self.save()
+            self.transition_to('Pending')
 
 class ResolutionStep(models.Model):
     service_request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, related_name='resolution_steps')
@@ -76,15 +311,208 @@ class ResolutionStep(models.Model):
         unique_together = ['service_request', 'step_number']
 
     def __str__(self):
-        return f"Step {self.step_number} for Request #{self.service_request.id}"
+        return f"Step {self.step_number} for Request #{self.service_request_id}"
+
+class StatusTransition(models.Model):
+    """
+    History of the statuses a request has been in. A row is appended for
+    every status change; ``left_at`` is filled in once, when the next
+    transition for the same request is appended, so time-in-status can be
+    aggregated in SQL without replaying each request's history.
+    """
+    # No database constraint: archive_requests moves requests to the archive
+    # tables but leaves their history here for the time-in-status reports
+    service_request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, related_name='status_transitions', db_constraint=False)
+    from_status = models.CharField(max_length=20, choices=ServiceRequest.STATUS_CHOICES, blank=True)
+    to_status = models.CharField(max_length=20, choices=ServiceRequest.STATUS_CHOICES)
+    # Copied from the request so reports can group without a join
+    category = models.CharField(max_length=100, choices=ServiceRequest.CATEGORY_CHOICES)
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    entered_at = models.DateTimeField(default=timezone.now)
+    left_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['entered_at', 'id']
+        indexes = [
+            models.Index(fields=['service_request', 'entered_at'], name='transition_request_idx'),
+            models.Index(fields=['category', 'to_status', 'entered_at'], name='transition_report_idx'),
+            models.Index(fields=['entered_at', 'to_status'], name='transition_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"Request #{self.service_request_id}: {self.from_status or '-'} -> {self.to_status}"
+
+    @classmethod
+    def record(cls, service_request, from_status, to_status, user=None, at=None):
+        """Close the request's current transition and append the next one."""
+        at = at or timezone.now()
+        cls.objects.filter(service_request=service_request, left_at__isnull=True).update(left_at=at)
+        return cls.objects.create(
+            service_request=service_request,
+            from_status=from_status,
+            to_status=to_status,
+            category=service_request.category,
+            changed_by=user,
+            entered_at=at,
+        )
+
+    @classmethod
+    def record_bulk(cls, requests, to_status, user=None, at=None):
+        """``record`` for many requests at once: one UPDATE and one INSERT."""
+        at = at or timezone.now()
+        cls.objects.filter(service_request__in=requests, left_at__isnull=True).update(left_at=at)
+        return cls.objects.bulk_create([
+            cls(
+                service_request=req,
+                from_status=req.status,
+                to_status=to_status,
+                category=req.category,
+                changed_by=user,
+                entered_at=at,
+            )
+            for req in requests
+        ])
+
+class DuplicateSignature(models.Model):
+    """MinHash signature of an open request's description (see duplicates.py)"""
+    service_request = models.OneToOneField(ServiceRequest, on_delete=models.CASCADE, primary_key=True, related_name='duplicate_signature')
+    signature = models.BinaryField()
+
+    def __str__(self):
+        return f"Signature for Request #{self.service_request_id}"
+
+class DuplicateBucket(models.Model):
+    """One LSH band of a request's signature; requests sharing a key are duplicate candidates"""
+    service_request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, related_name='+')
+    key = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"Bucket {self.key} for Request #{self.service_request_id}"
 
-# Signal to create/update user profile automatically
+class ArchivedServiceRequest(models.Model):
+    """
+    A resolved request moved out of the hot table by ``archive_requests``.
+    It keeps its original id, so links and the status history still match.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    requester_name = models.CharField(max_length=150)
+    department = models.CharField(max_length=100)
+    category = models.CharField(max_length=100, choices=ServiceRequest.CATEGORY_CHOICES)
+    description = models.TextField()
+    status = models.CharField(max_length=20, choices=ServiceRequest.STATUS_CHOICES, default='Resolved')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    due_at = models.DateTimeField(null=True, blank=True)
+    escalated_at = models.DateTimeField(null=True, blank=True)
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    assigned_at = models.DateTimeField(null=True, blank=True)
+    # May point at a hot or an archived request
+    duplicate_of_id = models.BigIntegerField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    is_archived = True
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['requester_name', 'created_at'], name='archive_requester_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.requester_name} - {self.category} (archived)"
+
+    @property
+    def duplicate_of(self):
+        if self.duplicate_of_id is None:
+            return None
+        from .archive import find_request
+        return find_request(self.duplicate_of_id)
+
+class ArchivedResolutionStep(models.Model):
+    service_request = models.ForeignKey(ArchivedServiceRequest, on_delete=models.CASCADE, related_name='resolution_steps')
+    step_number = models.PositiveIntegerField()
+    description = models.TextField()
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['step_number']
+
+    def __str__(self):
+        return f"Step {self.step_number} for archived Request #{self.service_request_id}"
+
+class Blob(models.Model):
+    """Attachment content, stored once per SHA-256 digest (see attachments.py)"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+class Attachment(models.Model):
+    """A file attached to a request, and optionally to one of its resolution steps"""
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='attachments')
+    # No database constraint, so attachments stay with requests that
+    # archive_requests moves to the archive tables
+    service_request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, related_name='attachments', db_constraint=False)
+    resolution_step = models.ForeignKey(ResolutionStep, on_delete=models.SET_NULL, null=True, blank=True, related_name='attachments')
+    # The step's copy once archive_requests has moved it to the archive
+    archived_step = models.ForeignKey(ArchivedResolutionStep, on_delete=models.SET_NULL, null=True, blank=True, related_name='attachments')
+    filename = models.CharField(max_length=255)
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['uploaded_at', 'id']
+
+    def __str__(self):
+        return f"{self.filename} on Request #{self.service_request_id}"
+
+    @property
+    def is_image(self):
+        return self.blob.content_type.startswith('image/')
+
+    @property
+    def has_thumbnail(self):
+        from .attachments import thumbnail_path
+        return thumbnail_path(self.blob_id).exists()
+
+class MailMessage(models.Model):
+    """
+    An email imported by ``ingest_mail``, keyed by its Message-ID. Replies
+    are matched to tickets through these rows, and a message seen again is
+    skipped.
+    """
+    message_id = models.CharField(max_length=255, unique=True)
+    # No database constraint, like Attachment: the ticket may be archived later
+    service_request = models.ForeignKey(ServiceRequest, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    resolution_step = models.ForeignKey(ResolutionStep, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    archived_step = models.ForeignKey(ArchivedResolutionStep, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    sender = models.CharField(max_length=254, blank=True)
+    ingested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.message_id} -> Request #{self.service_request_id}"
+
+class MailCheckpoint(models.Model):
+    """How far ``ingest_mail`` got in a mailbox: a byte offset (mbox) or the last file name (Maildir)"""
+    source = models.CharField(max_length=500, unique=True)
+    position = models.CharField(max_length=255)
+    messages = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} at {self.position}"
+
+# Signal to create the user profile once, when the user is first saved.
+# Later saves (e.g. the last_login update Django performs on every login)
+# no longer touch the profile row at all.
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.create(user=instance)
-    else:
-        try:
-            instance.profile.save()
-        except UserProfile.DoesNotExist:
-            UserProfile.objects.create(user=instance)
\ No newline at end of file
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        instance.profile = UserProfile.objects.create(user=instance)
@@ -0,0 +1,238 @@
+"""
+Precomputed weekly and monthly management reports.
+
+``build_reports`` splits each reporting period into date chunks, computes
+``reports.request_summary`` (volumes, resolution times, time in status and
+daily throughput) for the chunks in a process pool, merges them
+and writes the report as HTML, CSV and JSON under REPORTS_DIR:
+
+    <REPORTS_DIR>/<period>/<label>/<version>/report.{html,csv,json}
+
+Every build is a new version directory; ``index.json`` lists the reports
+and their last REPORTS_KEEP_VERSIONS versions (older ones are deleted),
+and is what the staff report views read. The views only ever serve
+these files, so opening a report never runs the aggregates.
+"""
+import csv
+import io
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+PERIODS = ('week', 'month')
+# Column names for the daily throughput of each status
+STATUS_KEYS = {'Pending': 'pending', 'In Progress': 'in_progress', 'Resolved': 'resolved'}
+FORMATS = {
+    'html': 'text/html; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+
+
+def reports_dir():
+    return Path(getattr(settings, 'REPORTS_DIR', settings.BASE_DIR / 'var' / 'reports'))
+
+
+def period_bounds(period, moment):
+    """(start, end, label) of the ``period`` containing ``moment``, in local time."""
+    local = timezone.localtime(moment)
+    day = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+        year, week, _ = start.isocalendar()
+        return start, timezone.localtime(end), f'{year}-W{week:02d}'
+    if period == 'month':
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        return start, timezone.localtime(end), f'{start:%Y-%m}'
+    raise ValueError(f"Unknown report period {period!r}")
+
+
+def recent_periods(period, count, include_current=False, now=None):
+    """The last ``count`` complete periods (plus the current one if asked), oldest first."""
+    now = now or timezone.now()
+    start, end, label = period_bounds(period, now)
+    periods = [(start, end, label)] if include_current else []
+    for _ in range(count):
+        start, end, label = period_bounds(period, start - timedelta(seconds=1))
+        periods.append((start, end, label))
+    return sorted(periods)
+
+
+def chunks(start, end, days):
+    """Split [start, end) into consecutive ranges of at most ``days`` days."""
+    while start < end:
+        chunk_end = min(start + timedelta(days=days), end)
+        yield start, chunk_end
+        start = chunk_end
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _summarize_chunk(bounds):
+    from .reports import request_summary
+    return request_summary(*bounds)
+
+
+def summarize(ranges, workers=1):
+    """``request_summary`` for each range, in a process pool when workers > 1."""
+    if workers <= 1:
+        return [_summarize_chunk(bounds) for bounds in ranges]
+    # spawn, not fork: children must not share the parent's DB connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=_init_worker) as pool:
+        return list(pool.map(_summarize_chunk, ranges))
+
+
+def _hours(seconds):
+    return round(seconds / 3600, 1)
+
+
+def build_report(period, start, end, label, summary):
+    """
+    Turn merged partial aggregates, plus ``resolution_percentiles`` for the
+    whole period under 'resolution_percentiles', into the report dict
+    written to disk.
+    """
+    opened, resolved = summary['opened'], summary['resolved']
+
+    departments = {}
+    categories = {}
+    for (department, category), count in opened.items():
+        departments.setdefault(department, {'opened': 0, 'resolved': 0})['opened'] += count
+        categories.setdefault(category, {'opened': 0, 'resolved': 0})['opened'] += count
+    for (department, category), count in resolved.items():
+        departments.setdefault(department, {'opened': 0, 'resolved': 0})['resolved'] += count
+        categories.setdefault(category, {'opened': 0, 'resolved': 0})['resolved'] += count
+
+    total_opened = sum(opened.values())
+    category_rows = []
+    for category, counts in sorted(categories.items()):
+        resolved_count, total_seconds = summary['resolution_totals'].get(category, (0, 0))
+        percentiles = summary['resolution_percentiles'].get(category)
+        category_rows.append({
+            'category': category,
+            'opened': counts['opened'],
+            'share': round(counts['opened'] / total_opened * 100, 1) if total_opened else 0.0,
+            'resolved': counts['resolved'],
+            'avg_resolution_hours': _hours(total_seconds / resolved_count) if resolved_count else None,
+            'median_resolution_hours': _hours(percentiles['median']) if percentiles else None,
+            'p90_resolution_hours': _hours(percentiles['p90']) if percentiles else None,
+        })
+
+    status_rows = [
+        {'category': category, 'status': status, 'visits': visits,
+         'avg_hours': _hours(total / visits) if visits else None, 'max_hours': _hours(longest)}
+        for (category, status), (visits, total, longest) in sorted(summary['time_in_status'].items())
+    ]
+    days = {}
+    for (day, status), count in summary['throughput'].items():
+        days.setdefault(day, dict.fromkeys(STATUS_KEYS.values(), 0))[STATUS_KEYS[status]] += count
+
+    return {
+        'period': period,
+        'label': label,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'generated_at': timezone.now().isoformat(),
+        'totals': {'opened': total_opened, 'resolved': sum(resolved.values())},
+        'departments': [
+            {'department': department or 'Not specified', **counts}
+            for department, counts in sorted(departments.items(), key=lambda item: -item[1]['opened'])
+        ],
+        'categories': category_rows,
+        'time_in_status': status_rows,
+        'throughput': [{'day': day, **counts} for day, counts in sorted(days.items())],
+    }
+
+
+def render_csv(report):
+    """The report as CSV: one section per table, separated by a blank line."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['dimension', 'value', 'opened', 'share_percent', 'resolved',
+                     'avg_resolution_hours', 'median_resolution_hours', 'p90_resolution_hours'])
+    for row in report['departments']:
+        writer.writerow(['department', row['department'], row['opened'], '', row['resolved'], '', '', ''])
+    for row in report['categories']:
+        writer.writerow(['category', row['category'], row['opened'], row['share'], row['resolved'],
+                         row['avg_resolution_hours'], row['median_resolution_hours'], row['p90_resolution_hours']])
+    writer.writerow([])
+    writer.writerow(['category', 'status', 'visits', 'avg_hours', 'max_hours'])
+    for row in report['time_in_status']:
+        writer.writerow([row['category'], row['status'], row['visits'], row['avg_hours'], row['max_hours']])
+    writer.writerow([])
+    writer.writerow(['day', *STATUS_KEYS.values()])
+    for row in report['throughput']:
+        writer.writerow([row['day'], *(row[key] for key in STATUS_KEYS.values())])
+    return out.getvalue()
+
+
+def write_report(report):
+    """Write a new version of ``report`` in every format and update the index. Returns its directory."""
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    target = reports_dir() / report['period'] / report['label'] / version
+    staging = target.with_name(f'.{version}.tmp')
+    staging.mkdir(parents=True)
+    report = {**report, 'version': version}
+    (staging / 'report.json').write_text(json.dumps(report, indent=2), encoding='utf-8')
+    (staging / 'report.csv').write_text(render_csv(report), encoding='utf-8')
+    (staging / 'report.html').write_text(render_to_string('reports/report.html', {'report': report}),
+                                         encoding='utf-8')
+    os.replace(staging, target)
+    _update_index(report)
+    return target
+
+
+def _update_index(report):
+    index = load_index()
+    key = f"{report['period']}/{report['label']}"
+    entry = index.get(key, {'period': report['period'], 'label': report['label'],
+                            'start': report['start'], 'end': report['end'], 'versions': []})
+    entry['versions'].append(report['version'])
+    keep = max(getattr(settings, 'REPORTS_KEEP_VERSIONS', 5), 1)
+    expired, entry['versions'] = entry['versions'][:-keep], entry['versions'][-keep:]
+    entry['latest'] = report['version']
+    entry['generated_at'] = report['generated_at']
+    entry['totals'] = report['totals']
+    index[key] = entry
+    path = reports_dir() / 'index.json'
+    tmp = path.with_suffix('.json.tmp')
+    tmp.write_text(json.dumps(index, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(tmp, path)
+    # Only after the index stops listing them; a download already open
+    # keeps reading its file
+    for version in expired:
+        shutil.rmtree(reports_dir() / report['period'] / report['label'] / version, ignore_errors=True)
+
+
+def load_index():
+    """{'<period>/<label>': entry} for every built report, or {} before the first build."""
+    try:
+        return json.loads((reports_dir() / 'index.json').read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+
+
+def artifact_path(period, label, fmt, version=None):
+    """Path of a built artifact (the latest version by default), or None."""
+    entry = load_index().get(f'{period}/{label}')
+    if entry is None or fmt not in FORMATS:
+        return None
+    version = version or entry['latest']
+    if version not in entry['versions']:
+        return None
+    path = reports_dir() / period / label / version / f'report.{fmt}'
+    return path if path.exists() else None
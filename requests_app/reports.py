@@ -0,0 +1,167 @@
+"""
+Aggregate reports over the status history (StatusTransition) and the
+requests themselves (hot and archived).
+
+Each report is a single grouped query served by the transition indexes,
+so its cost does not depend on replaying individual requests in Python.
+``request_summary`` returns partial aggregates for one date range that
+``merge_summaries`` combines, so report_builder can compute long periods
+in parallel chunks; the prebuilt reports include the time-in-status and
+daily throughput figures below.
+"""
+from datetime import timedelta
+
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import ArchivedServiceRequest, ServiceRequest, StatusTransition
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+# Resolution time of a request, never negative
+RESOLUTION_TIME = Greatest(
+    ExpressionWrapper(F('resolved_at') - F('created_at'), output_field=DurationField()),
+    Value(timedelta(0)),
+    output_field=DurationField(),
+)
+
+
+def _transitions(start=None, end=None):
+    qs = StatusTransition.objects.order_by()
+    if start:
+        qs = qs.filter(entered_at__gte=start)
+    if end:
+        qs = qs.filter(entered_at__lt=end)
+    return qs
+
+
+def time_in_status(start=None, end=None, now=None):
+    """
+    Time spent in each status, per category, for transitions entered in
+    [start, end). Periods that are still open are counted up to ``now``.
+
+    Returns dicts with category, status, visits, avg_duration,
+    total_duration and max_duration (timedeltas).
+    """
+    now = now or timezone.now()
+    duration = ExpressionWrapper(
+        Coalesce(F('left_at'), Value(now)) - F('entered_at'),
+        output_field=DurationField(),
+    )
+    return list(
+        _transitions(start, end)
+        .values('category', status=F('to_status'))
+        .annotate(visits=Count('id'), avg_duration=Avg(duration), total_duration=Sum(duration),
+                  max_duration=Max(duration))
+        .order_by('category', 'status')
+    )
+
+
+def throughput(start=None, end=None, period='week'):
+    """
+    Number of requests entering each status per ``period`` ('day', 'week'
+    or 'month'), e.g. how many were opened and resolved each week.
+    """
+    trunc = PERIODS[period]
+    return list(
+        _transitions(start, end)
+        .annotate(period=trunc('entered_at'))
+        .values('period', status=F('to_status'))
+        .annotate(count=Count('id'))
+        .order_by('period', 'status')
+    )
+
+
+def request_summary(start, end):
+    """
+    Partial aggregates for requests opened or resolved in [start, end),
+    from both the hot and the archive table: opened/resolved counts per
+    department and category, resolution count and total seconds per category, and
+    from the status history the time spent in each status per category and
+    the number of requests entering each status per day.
+    """
+    summary = {'opened': {}, 'resolved': {}, 'resolution_totals': {}, 'time_in_status': {}, 'throughput': {}}
+    for row in time_in_status(start, end):
+        summary['time_in_status'][(row['category'], row['status'])] = (
+            row['visits'], row['total_duration'].total_seconds(), row['max_duration'].total_seconds(),
+        )
+    for row in throughput(start, end, period='day'):
+        day = timezone.localtime(row['period']).date().isoformat()
+        summary['throughput'][(day, row['status'])] = row['count']
+    for model in (ServiceRequest, ArchivedServiceRequest):
+        rows = model.objects.order_by()
+        for row in (
+            rows.filter(created_at__gte=start, created_at__lt=end)
+            .values('department', 'category').annotate(count=Count('pk'))
+        ):
+            key = (row['department'] or '', row['category'])
+            summary['opened'][key] = summary['opened'].get(key, 0) + row['count']
+        for row in (
+            rows.filter(resolved_at__gte=start, resolved_at__lt=end)
+            .values('department', 'category').annotate(count=Count('pk'), total=Sum(RESOLUTION_TIME))
+        ):
+            key = (row['department'] or '', row['category'])
+            summary['resolved'][key] = summary['resolved'].get(key, 0) + row['count']
+            count, total = summary['resolution_totals'].get(row['category'], (0, 0))
+            summary['resolution_totals'][row['category']] = (count + row['count'], total + row['total'].total_seconds())
+    return summary
+
+
+def merge_summaries(summaries):
+    """Combine ``request_summary`` results for adjacent ranges."""
+    merged = {'opened': {}, 'resolved': {}, 'resolution_totals': {}, 'time_in_status': {}, 'throughput': {}}
+    for summary in summaries:
+        for counter in ('opened', 'resolved', 'throughput'):
+            for key, count in summary[counter].items():
+                merged[counter][key] = merged[counter].get(key, 0) + count
+        for key, (visits, total, longest) in summary['time_in_status'].items():
+            seen_visits, seen_total, seen_longest = merged['time_in_status'].get(key, (0, 0, 0))
+            merged['time_in_status'][key] = (seen_visits + visits, seen_total + total, max(seen_longest, longest))
+        for category, (count, total) in summary['resolution_totals'].items():
+            seen_count, seen_total = merged['resolution_totals'].get(category, (0, 0))
+            merged['resolution_totals'][category] = (seen_count + count, seen_total + total)
+    return merged
+
+
+def resolution_percentiles(start, end):
+    """
+    Median and 90th percentile resolution time in seconds per category,
+    for requests resolved in [start, end) in the hot or the archive table.
+
+    Percentiles do not merge across chunks, so this runs once per report:
+    each value is read with ORDER BY ... LIMIT/OFFSET over both tables,
+    so SQLite only keeps the rows up to the offset, not every duration.
+    """
+    counts = {}
+    for model in (ServiceRequest, ArchivedServiceRequest):
+        for row in (
+            model.objects.order_by().filter(resolved_at__gte=start, resolved_at__lt=end)
+            .values('category').annotate(count=Count('pk'))
+        ):
+            counts[row['category']] = counts.get(row['category'], 0) + row['count']
+
+    percentiles = {}
+    for category, count in counts.items():
+        durations = [
+            model.objects.order_by()
+            .filter(resolved_at__gte=start, resolved_at__lt=end, category=category)
+            .annotate(seconds=RESOLUTION_TIME).values_list('seconds', flat=True)
+            for model in (ServiceRequest, ArchivedServiceRequest)
+        ]
+        ordered = durations[0].union(durations[1], all=True).order_by('seconds')
+
+        def nth(offset, limit=1):
+            return [value.total_seconds() for value in ordered[offset:offset + limit]]
+
+        middle = nth((count - 1) // 2, 2 - count % 2)
+        percentiles[category] = {
+            'median': sum(middle) / len(middle),
+            'p90': nth(int(0.9 * (count - 1)))[0],
+        }
+    return percentiles
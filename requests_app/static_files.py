@@ -0,0 +1,91 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# Names produced by ManifestStaticFilesStorage, e.g. css/app.1a2b3c4d5e6f.css
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Preferred first
+PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header; codings with q=0 are refused."""
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def choose_encoding(header, available):
+    """The best of ``available`` (in server preference order) the client accepts, or None."""
+    accepted = accepted_encodings(header)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def serve(request, path):
+    """
+    Serve a collected file from STATIC_ROOT.
+
+    Hashed file names never change content, so they get a far-future,
+    immutable Cache-Control header. When the client accepts it, the
+    precompressed variant written by collectstatic is sent instead of the
+    original file.
+    """
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    served_path, content_encoding = fullpath, None
+    variants = {encoding: fullpath + suffix for encoding, suffix in PRECOMPRESSED_ENCODINGS
+                if os.path.isfile(fullpath + suffix)}
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), variants)
+    if encoding:
+        served_path, content_encoding = variants[encoding], encoding
+
+    statobj = os.stat(served_path)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), statobj.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    response = FileResponse(
+        open(served_path, 'rb'),
+        content_type=content_type or 'application/octet-stream',
+        filename=os.path.basename(fullpath),
+    )
+    response.headers['Last-Modified'] = http_date(statobj.st_mtime)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if HASHED_NAME_RE.search(path):
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response
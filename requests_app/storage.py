@@ -0,0 +1,52 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always written
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also writes precompressed ``.gz`` (and,
+    when the ``brotli`` package is installed, ``.br``) copies of every hashed
+    text asset, so they can be served without compressing on each request.
+    """
+    compressible_extensions = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.xml', '.html')
+    min_compress_size = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            if hashed_name.endswith(self.compressible_extensions):
+                for compressed_name in self._write_compressed(hashed_name):
+                    yield hashed_name, compressed_name, True
+
+    def _write_compressed(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as fh:
+            content = fh.read()
+        if len(content) < self.min_compress_size:
+            return []
+
+        written = []
+        variants = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        for suffix, compress in variants:
+            compressed = compress(content)
+            # Only keep variants that are actually smaller
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as fh:
+                    fh.write(compressed)
+                written.append(name + suffix)
+        return written
@@ -0,0 +1,251 @@
+"""
+Category suggestions and similar-resolution lookup.
+
+``train_suggestions`` builds a TF-IDF model from resolved requests and
+writes it to SUGGESTIONS_MODEL_DIR as plain ``.npy`` arrays: the
+L2-normalized document matrix in CSR form, the IDF weights and one
+normalized centroid per category. Workers memory-map those arrays, so
+every process shares the same pages and loading is instant; a retrained
+model is picked up through the ``CURRENT`` pointer file.
+
+numpy and scipy are optional. Without them (or before the first training
+run) ``suggest_category`` returns None and ``similar_resolved`` returns
+an empty list.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # the feature is disabled without numpy/scipy
+    np = sparse = None
+
+FORMAT_VERSION = 1
+_TOKEN_RE = re.compile(r'[a-z0-9][a-z0-9_.-]*[a-z0-9]|[a-z0-9]')
+# How often a worker checks the CURRENT pointer for a retrained model
+RELOAD_CHECK_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_model = None
+_checked_at = None
+
+
+def is_available():
+    return np is not None
+
+
+def model_dir():
+    return Path(getattr(settings, 'SUGGESTIONS_MODEL_DIR', settings.BASE_DIR / 'var' / 'suggestions'))
+
+
+def tokens(text):
+    """Lowercased unigrams plus adjacent-word bigrams"""
+    words = _TOKEN_RE.findall(text.lower())
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+
+class TfidfModel:
+    """A trained model, backed by memory-mapped arrays where possible."""
+
+    def __init__(self, version, vocabulary, idf, matrix, request_ids, categories, centroids):
+        self.version = version
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.request_ids = request_ids
+        self.categories = categories
+        self.centroids = centroids
+
+    @classmethod
+    def fit(cls, documents, request_ids, labels, max_features=20000, min_df=2):
+        """Build a model from parallel lists of texts, request ids and categories."""
+        counts = [Counter(tokens(doc)) for doc in documents]
+        df = Counter()
+        for doc_counts in counts:
+            df.update(doc_counts.keys())
+        terms = [term for term, freq in df.most_common(max_features) if freq >= min_df]
+        vocabulary = {term: i for i, term in enumerate(sorted(terms))}
+
+        n_docs = len(documents)
+        idf = np.zeros(len(vocabulary), dtype=np.float32)
+        for term, i in vocabulary.items():
+            idf[i] = np.log((1 + n_docs) / (1 + df[term])) + 1.0
+
+        matrix = _vectorize(counts, vocabulary, idf)
+        categories = sorted(set(labels))
+        label_index = np.array([categories.index(label) for label in labels])
+        centroids = np.zeros((len(categories), len(vocabulary)), dtype=np.float32)
+        for c in range(len(categories)):
+            rows = matrix[np.flatnonzero(label_index == c)]
+            centroids[c] = np.asarray(rows.sum(axis=0)).ravel()
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms == 0, 1, norms)
+
+        version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        return cls(version, vocabulary, idf, matrix, np.asarray(request_ids, dtype=np.int64), categories, centroids)
+
+    def vectorize(self, texts):
+        return _vectorize([Counter(tokens(text)) for text in texts], self.vocabulary, self.idf)
+
+    def predict(self, texts):
+        """Category scores for each text: a (len(texts), n_categories) array"""
+        return np.asarray(self.vectorize(texts) @ self.centroids.T)
+
+    def nearest(self, texts, k):
+        """For each text, up to ``k`` (request id, cosine similarity) pairs"""
+        scores = (self.vectorize(texts) @ self.matrix.T).toarray()
+        results = []
+        for row in scores:
+            k_row = min(k, row.size)
+            top = np.argpartition(-row, k_row - 1)[:k_row] if k_row else []
+            top = sorted(top, key=lambda i: -row[i])
+            results.append([(int(self.request_ids[i]), float(row[i])) for i in top if row[i] > 0])
+        return results
+
+    def save(self, directory):
+        """Write the model to ``directory/<version>`` and point CURRENT at it."""
+        directory = Path(directory)
+        target = directory / self.version
+        staging = directory / f'.{self.version}.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for name, array in (
+            ('idf', self.idf), ('data', self.matrix.data), ('indices', self.matrix.indices),
+            ('indptr', self.matrix.indptr), ('request_ids', self.request_ids), ('centroids', self.centroids),
+        ):
+            np.save(staging / f'{name}.npy', array)
+        with open(staging / 'meta.json', 'w') as fh:
+            json.dump({
+                'format': FORMAT_VERSION,
+                'version': self.version,
+                'shape': list(self.matrix.shape),
+                'categories': self.categories,
+                'vocabulary': self.vocabulary,
+            }, fh)
+        os.replace(staging, target)
+
+        pointer = directory / 'CURRENT.tmp'
+        pointer.write_text(self.version)
+        os.replace(pointer, directory / 'CURRENT')
+        return target
+
+    @classmethod
+    def load(cls, path):
+        with open(path / 'meta.json') as fh:
+            meta = json.load(fh)
+        if meta['format'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported suggestion model format {meta['format']}")
+
+        def mapped(name):
+            return np.load(path / f'{name}.npy', mmap_mode='r')
+
+        matrix = sparse.csr_matrix(
+            (mapped('data'), mapped('indices'), mapped('indptr')), shape=tuple(meta['shape']), copy=False,
+        )
+        return cls(meta['version'], meta['vocabulary'], mapped('idf'), matrix,
+                   mapped('request_ids'), meta['categories'], mapped('centroids'))
+
+
+def _vectorize(counts, vocabulary, idf):
+    """L2-normalized TF-IDF rows (CSR) for a list of token Counters"""
+    data, indices, indptr = [], [], [0]
+    for doc_counts in counts:
+        row = sorted((vocabulary[term], count) for term, count in doc_counts.items() if term in vocabulary)
+        indices.extend(i for i, _ in row)
+        data.extend((1 + np.log(count)) * idf[i] for i, count in row)
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(counts), len(vocabulary)),
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return sparse.diags(1 / np.where(norms == 0, 1, norms)).astype(np.float32) @ matrix
+
+
+def get_model():
+    """The current model, reloaded when a new one is trained, or None."""
+    global _model, _checked_at
+    if np is None:
+        return None
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+        return _model
+    with _lock:
+        _checked_at = now
+        try:
+            version = (model_dir() / 'CURRENT').read_text().strip()
+        except FileNotFoundError:
+            _model = None
+            return None
+        if _model is None or _model.version != version:
+            try:
+                _model = TfidfModel.load(model_dir() / version)
+            except (OSError, ValueError):
+                # A half-written or corrupt version: keep serving the one
+                # already loaded and try again after RELOAD_CHECK_SECONDS
+                logger.exception("Could not load suggestion model %s", version)
+        return _model
+
+
+def preload():
+    """Map the model into this worker at startup instead of on the first request."""
+    get_model()
+
+
+def _cache_key(prefix, model, text):
+    digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    return f'suggestions:{prefix}:{model.version}:{digest}'
+
+
+def suggest_category(text):
+    """
+    Best-matching category for ``text`` as {'category', 'score', 'scores'},
+    or None when there is no model or no confident match.
+    """
+    model = get_model()
+    if model is None or not text.strip():
+        return None
+    key = _cache_key('category', model, text)
+    suggestion = cache.get(key)
+    if suggestion is None:
+        scores = model.predict([text])[0]
+        best = int(scores.argmax())
+        suggestion = {
+            'category': model.categories[best],
+            'score': round(float(scores[best]), 3),
+            'scores': {category: round(float(score), 3) for category, score in zip(model.categories, scores)},
+        }
+        cache.set(key, suggestion, getattr(settings, 'SUGGESTIONS_CACHE_TIMEOUT', 3600))
+    if suggestion['score'] < getattr(settings, 'SUGGESTIONS_MIN_CATEGORY_SCORE', 0.1):
+        return None
+    return suggestion
+
+
+def similar_resolved(req, k=5):
+    """Up to ``k`` (request id, similarity) pairs of resolved requests similar to ``req``."""
+    model = get_model()
+    if model is None or not req.description.strip():
+        return []
+    key = _cache_key(f'similar:{k}', model, req.description)
+    matches = cache.get(key)
+    if matches is None:
+        # One extra so the request itself can be dropped if it was trained on
+        matches = model.nearest([req.description], k + 1)[0]
+        cache.set(key, matches, getattr(settings, 'SUGGESTIONS_CACHE_TIMEOUT', 3600))
+    min_score = getattr(settings, 'SUGGESTIONS_MIN_SIMILARITY', 0.2)
+    return [(pk, score) for pk, score in matches if pk != req.pk and score >= min_score][:k]
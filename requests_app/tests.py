@@ -1,3 +1,896 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import ConnectionHandler, connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    archive, attachments, checks, duplicates, mail_ingest, maintenance, metrics, report_builder, reports,
+    suggestions, throttling,
+)
+from .backends import ProfileModelBackend
+from .models import (
+    ArchivedServiceRequest, Attachment, Blob, MailMessage, ResolutionStep, ServiceRequest, StatusTransition,
+    UserProfile,
+)
+from .throttling import TokenBucket, concurrency_limit, rate_limit
+
+
+def make_request(description='Outlook keeps asking for my password', **fields):
+    return ServiceRequest.objects.create(**{
+        'requester_name': 'Alice',
+        'department': 'Finance',
+        'category': 'Other',
+        'description': description,
+        **fields,
+    })
+
+
+class LoginWritesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def test_login_does_not_write_the_profile(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(self.client.login(username='alice', password='pw'))
+        writes = [query['sql'] for query in ctx.captured_queries
+                  if query['sql'].lstrip().split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertFalse([sql for sql in writes if 'userprofile' in sql], writes)
+        self.assertEqual(len([sql for sql in writes if 'auth_user' in sql]), 1)
+
+    def test_missing_profile_is_created_on_first_use(self):
+        UserProfile.objects.filter(user=self.user).delete()
+        user = User.objects.get(pk=self.user.pk)
+        profile = UserProfile.for_user(user)
+        self.assertEqual(profile.user_id, user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(UserProfile.for_user(user), profile)
+        with self.assertNumQueries(0):
+            self.assertFalse(profile.update_fields_if_changed(department=profile.department))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_logins', logins=3, stdout=out)
+        self.assertIn('Writes per login:', out.getvalue())
+        self.assertFalse(User.objects.filter(username='__benchmark_login__').exists())
+
+
+class ProvisionUsersTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('alice', password='pw')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'users.jsonl'
+        rows = [
+            {'username': 'alice'},
+            {'username': 'bob', 'password': 'secret', 'department': 'Finance'},
+            {'username': ' carol ', 'email': 'carol@example.com'},
+            {'username': '', 'email': 'nobody@example.com'},
+            {'username': 5},
+            {'username': 'bob'},
+        ]
+        self.path.write_text(''.join(json.dumps(row) + '\n' for row in rows), encoding='utf-8')
+
+    def provision(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('provision_users', str(self.path), workers=1, batch_size=2, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_creates_users_and_profiles(self):
+        out, err = self.provision()
+        self.assertIn('Created 2 users, skipped 2 existing usernames and 2 invalid rows', out)
+        self.assertIn('row 4', err)
+        self.assertIn('has no username', err)
+        bob = User.objects.get(username='bob')
+        self.assertTrue(bob.check_password('secret'))
+        self.assertEqual(bob.profile.department, 'Finance')
+        carol = User.objects.get(username='carol')
+        self.assertFalse(carol.has_usable_password())
+        self.assertTrue(UserProfile.objects.filter(user=carol).exists())
+
+    def test_dry_run_writes_nothing(self):
+        out, _ = self.provision(dry_run=True)
+        self.assertIn('Would create 2 users, skipped', out)
+        self.assertNotIn('Created', out)
+        self.assertEqual(User.objects.count(), 1)
+
+
+class AuthenticationBackendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def test_get_user_loads_the_profile_in_the_same_query(self):
+        with self.assertNumQueries(1):
+            user = ProfileModelBackend().get_user(self.user.pk)
+            self.assertIsNotNone(user.profile)
+
+    def test_sessions_naming_model_backend_stay_logged_in(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.post(reverse('requests_app:suggest_category'), {'description': 'VPN'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], 'requests_app.backends.ProfileModelBackend')
+
+
+def _templates(**options):
+    return [{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'DIRS': [], 'APP_DIRS': False,
+             'OPTIONS': options}]
+
+
+class PerformanceCheckTests(TestCase):
+    slow = {
+        'DEBUG': True,
+        'TEMPLATES': _templates(loaders=['django.template.loaders.app_directories.Loader']),
+        'CONN_MAX_AGE': 0,
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'LOGGING': {'version': 1, 'loggers': {'django.db.backends': {'level': 'DEBUG'}}},
+    }
+    fast = {
+        'DEBUG': False,
+        'TEMPLATES': _templates(loaders=[('django.template.loaders.cached.Loader', [
+            'django.template.loaders.app_directories.Loader',
+        ])]),
+        'CONN_MAX_AGE': 600,
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'LOGGING': {'version': 1, 'loggers': {'django.db.backends': {'level': 'WARNING'}}},
+    }
+
+    def check_ids(self, CONN_MAX_AGE, **overrides):
+        # DATABASES itself cannot be overridden in a test
+        with override_settings(**overrides), \
+                mock.patch.dict(settings.DATABASES['default'], {'CONN_MAX_AGE': CONN_MAX_AGE}):
+            return [warning.id for warning in checks.check_performance_settings(None)]
+
+    def test_each_slow_setting_warns(self):
+        self.assertEqual(self.check_ids(**self.slow), [f'requests_app.W00{n}' for n in range(1, 6)])
+
+    def test_production_settings_pass(self):
+        self.assertEqual(self.check_ids(**self.fast), [])
+
+    def test_default_loaders_are_cached(self):
+        self.assertEqual(self.check_ids(**{**self.fast, 'TEMPLATES': _templates()}), [])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.url = reverse('requests_app:metrics')
+
+    def test_histogram_is_cumulative(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(1, 2), (5, 3), (float('inf'), 4)])
+        self.assertEqual((histogram.count, histogram.sum), (4, 14.5))
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_staff_or_token_only(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get(self.url, headers={'Authorization': 'Bearer s3cret'}).status_code, 200)
+        self.client.force_login(User.objects.create_user('alice', password='pw'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create_user('tech', password='pw', is_staff=True))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.force_login(User.objects.create_user('tech', password='pw', is_staff=True))
+        self.client.post(reverse('requests_app:suggest_category'), {'description': 'VPN'})
+        body = self.client.get(self.url).content.decode()
+        self.assertIn('itservicetracker_responses_total{view="requests_app:suggest_category",status="200"} 1', body)
+        self.assertIn('itservicetracker_db_queries_count{view="requests_app:suggest_category"} 1', body)
+        self.assertIn('# TYPE itservicetracker_request_duration_seconds histogram', body)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0, METRICS_SLOW_SAMPLE_RATE=1)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        self.client.force_login(User.objects.create_user('tech', password='pw', is_staff=True))
+        with self.assertLogs('requests_app.metrics', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn('Slow request GET /', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.client.post(reverse('requests_app:suggest_category'), {'description': 'VPN'})
+        self.assertNotIn('suggest_category', metrics.registry.render())
+
+
+class StatusHistoryTests(TestCase):
+    def setUp(self):
+        self.start = timezone.now() - timedelta(days=1)
+        self.req = make_request(category='Network Problem')
+        history = list(self.req.status_transitions.all())
+        self.assertEqual([(t.from_status, t.to_status) for t in history], [('', 'Pending')])
+        # Backdate the history: two hours pending, one in progress, then resolved
+        self.opened = timezone.now() - timedelta(hours=3)
+        StatusTransition.objects.filter(pk=history[0].pk).update(entered_at=self.opened)
+        self.req.transition_to('In Progress')
+        self.req.transition_to('Resolved')
+        pending, in_progress, resolved = self.req.status_transitions.all()
+        StatusTransition.objects.filter(pk=pending.pk).update(left_at=self.opened + timedelta(hours=2))
+        StatusTransition.objects.filter(pk=in_progress.pk).update(
+            entered_at=self.opened + timedelta(hours=2), left_at=self.opened + timedelta(hours=3),
+        )
+
+    def test_transitions_are_recorded_and_closed(self):
+        history = list(self.req.status_transitions.all())
+        self.assertEqual([t.to_status for t in history], ['Pending', 'In Progress', 'Resolved'])
+        self.assertEqual([t.left_at is None for t in history], [False, False, True])
+        self.assertEqual({t.category for t in history}, {'Network Problem'})
+
+    def test_time_in_status(self):
+        rows = {row['status']: row for row in reports.time_in_status(self.start)}
+        self.assertEqual(rows['Pending']['visits'], 1)
+        self.assertEqual(rows['Pending']['avg_duration'], timedelta(hours=2))
+        self.assertEqual(rows['In Progress']['max_duration'], timedelta(hours=1))
+
+    def test_throughput(self):
+        counts = {row['status']: row['count'] for row in reports.throughput(self.start, period='day')}
+        self.assertEqual(counts, {'Pending': 1, 'In Progress': 1, 'Resolved': 1})
+
+    def test_report_includes_status_history(self):
+        end = timezone.now() + timedelta(hours=1)
+        summary = reports.merge_summaries([reports.request_summary(self.start, end)])
+        summary['resolution_percentiles'] = reports.resolution_percentiles(self.start, end)
+        report = report_builder.build_report('week', self.start, end, 'test', summary)
+        rows = {row['status']: row for row in report['time_in_status']}
+        self.assertEqual((rows['Pending']['avg_hours'], rows['In Progress']['max_hours']), (2.0, 1.0))
+        self.assertEqual(sum(day['resolved'] for day in report['throughput']), 1)
+        csv_text = report_builder.render_csv(report)
+        self.assertIn('Network Problem,Pending,1,2.0,2.0', csv_text)
+        html = render_to_string('reports/report.html', {'report': report})
+        self.assertIn('Time in Status', html)
+
+
+class BuildReportsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.reports_dir = Path(directory.name)
+        self.now = timezone.now()
+        self.start, self.end = self.now - timedelta(days=1), self.now + timedelta(hours=1)
+        for hours in (1, 2, 3, 4, 10):
+            req = make_request(department='Zürich Office', category='Printer Issue')
+            ServiceRequest.objects.filter(pk=req.pk).update(
+                status='Resolved', created_at=self.now - timedelta(hours=hours), resolved_at=self.now,
+            )
+
+    def test_percentiles_are_computed_in_sql(self):
+        percentiles = reports.resolution_percentiles(self.start, self.end)
+        self.assertEqual(percentiles['Printer Issue'], {'median': 3 * 3600, 'p90': 4 * 3600})
+        make_request(category='Printer Issue')
+        ServiceRequest.objects.filter(resolved_at__isnull=True).update(
+            status='Resolved', created_at=self.now - timedelta(hours=5), resolved_at=self.now,
+        )
+        self.assertEqual(reports.resolution_percentiles(self.start, self.end)['Printer Issue']['median'], 3.5 * 3600)
+
+    def test_chunks_merge_to_the_whole_period(self):
+        middle = self.now - timedelta(hours=2)
+        whole = reports.request_summary(self.start, self.end)
+        merged = reports.merge_summaries([
+            reports.request_summary(self.start, middle), reports.request_summary(middle, self.end),
+        ])
+        for key in ('opened', 'resolved', 'resolution_totals', 'throughput'):
+            self.assertEqual(merged[key], whole[key])
+        self.assertEqual(whole['resolution_totals']['Printer Issue'], (5, 20 * 3600))
+
+    def test_command_writes_every_format(self):
+        out = StringIO()
+        with override_settings(REPORTS_DIR=self.reports_dir):
+            call_command('build_reports', period=['week'], count=0, include_current=True, workers=1, stdout=out)
+            index = report_builder.load_index()
+        self.assertEqual(len(index), 1)
+        entry = next(iter(index.values()))
+        self.assertEqual(entry['totals']['resolved'], 5)
+        version_dir = self.reports_dir / 'week' / entry['label'] / entry['latest']
+        report = json.loads((version_dir / 'report.json').read_text(encoding='utf-8'))
+        self.assertEqual(report['categories'][0]['median_resolution_hours'], 3.0)
+        self.assertEqual(report['categories'][0]['avg_resolution_hours'], 4.0)
+        self.assertIn('Zürich Office', (version_dir / 'report.html').read_text(encoding='utf-8'))
+        self.assertIn('Zürich Office', (version_dir / 'report.csv').read_text(encoding='utf-8'))
+
+
+class SlaEscalationTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.old = make_request(category='Network Problem', created_at=self.now - timedelta(days=30))
+        self.new = make_request(category='Network Problem')
+
+    def escalate(self):
+        with mock.patch('requests_app.management.commands.sla_scheduler.send_sla_escalation_email') as send:
+            call_command('sla_scheduler', once=True, stdout=StringIO())
+        return [[req.pk for req in call.args[0]] for call in send.call_args_list]
+
+    def test_overdue_requests_are_escalated_once(self):
+        self.assertEqual(self.escalate(), [[self.old.pk]])
+        self.assertEqual(self.escalate(), [])
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertIsNotNone(self.old.escalated_at)
+        self.assertIsNone(self.new.escalated_at)
+
+    def test_reopening_restarts_the_clock(self):
+        self.escalate()
+        self.old.refresh_from_db()
+        self.old.transition_to('Resolved')
+        self.old.transition_to('Pending')
+        self.old.refresh_from_db()
+        self.assertIsNone(self.old.escalated_at)
+        self.assertGreater(self.old.due_at, timezone.now())
+        self.assertEqual(self.escalate(), [])
+
+    def test_category_change_counts_from_the_reopening(self):
+        self.old.transition_to('Resolved')
+        self.old.transition_to('Pending')
+        reopened = self.old.status_transitions.last().entered_at
+        self.old.category = 'Other'
+        self.old.save()
+        self.assertEqual(self.old.due_at, reopened + ServiceRequest.sla_target('Other'))
+        self.new.category = 'Other'
+        self.new.save()
+        self.assertEqual(self.new.due_at, self.new.created_at + ServiceRequest.sla_target('Other'))
+
+    def test_backfill_does_not_escalate_the_existing_backlog(self):
+        ServiceRequest.objects.update(due_at=None, escalated_at=None)
+        migration = importlib.import_module('requests_app.migrations.0008_servicerequest_sla')
+        migration.backfill_due_at(django_apps, None)
+        self.old.refresh_from_db()
+        self.new.refresh_from_db()
+        self.assertEqual(self.old.due_at, self.old.created_at + ServiceRequest.sla_target('Network Problem'))
+        self.assertIsNotNone(self.old.escalated_at)
+        self.assertIsNone(self.new.escalated_at)
+        self.assertEqual(self.escalate(), [])
+
+
+class SuggestionTests(TestCase):
+    def setUp(self):
+        if not suggestions.is_available():
+            self.skipTest("numpy and scipy are not installed")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_dir = Path(directory.name)
+        settings_override = override_settings(SUGGESTIONS_MODEL_DIR=self.model_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for attr in ('_model', '_checked_at'):
+            patcher = mock.patch.object(suggestions, attr, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        texts = {
+            'Printer Issue': ['printer jams on the third floor', 'printer out of toner again', 'printer offline'],
+            'Network Problem': ['wifi drops every hour', 'vpn cannot connect from home', 'wifi very slow'],
+        }
+        for category, descriptions in texts.items():
+            for description in descriptions:
+                make_request(description, category=category, status='Resolved')
+
+    def train(self, **options):
+        call_command('train_suggestions', min_df=1, stdout=StringIO(), **options)
+        suggestions._checked_at = None
+
+    def test_suggests_the_category_and_similar_requests(self):
+        self.assertIsNone(suggestions.suggest_category('printer jams'))
+        self.train()
+        self.assertEqual(suggestions.suggest_category('the printer jams')['category'], 'Printer Issue')
+        self.assertEqual(suggestions.suggest_category('wifi keeps dropping')['category'], 'Network Problem')
+        self.assertIsNone(suggestions.suggest_category('   '))
+        req = make_request('vpn cannot connect from the office')
+        similar = suggestions.similar_resolved(req)
+        self.assertEqual(ServiceRequest.objects.get(pk=similar[0][0]).description, 'vpn cannot connect from home')
+
+    def test_keep_prunes_old_versions(self):
+        for _ in range(3):
+            self.train(keep=2)
+        versions = [p for p in self.model_dir.iterdir() if p.is_dir()]
+        self.assertEqual(len(versions), 2)
+        self.assertIn(self.model_dir / (self.model_dir / 'CURRENT').read_text(), versions)
+        with self.assertRaises(CommandError):
+            self.train(keep=0)
+
+
+class ClaimNextTests(TestCase):
+    def setUp(self):
+        self.tech = User.objects.create_user('tech', password='pw', is_staff=True)
+        now = timezone.now()
+        self.oldest = make_request(category='Network Problem', created_at=now - timedelta(hours=3))
+        self.middle = make_request(category='Other', created_at=now - timedelta(hours=2))
+        self.newest = make_request(category='Network Problem', created_at=now - timedelta(hours=1))
+
+    def test_claims_oldest_first_and_never_the_same_request(self):
+        claimed = [ServiceRequest.claim_next(self.tech) for _ in range(3)]
+        self.assertEqual([req.pk for req in claimed], [self.oldest.pk, self.middle.pk, self.newest.pk])
+        self.assertIsNone(ServiceRequest.claim_next(self.tech))
+
+    def test_claim_assigns_and_records_the_transition(self):
+        req = ServiceRequest.claim_next(self.tech)
+        self.assertEqual(req.status, 'In Progress')
+        self.assertEqual(req.assigned_to, self.tech)
+        self.assertTrue(StatusTransition.objects.filter(
+            service_request=req, from_status='Pending', to_status='In Progress', changed_by=self.tech,
+        ).exists())
+
+    def test_category_filter(self):
+        self.assertEqual(ServiceRequest.claim_next(self.tech, category='Other').pk, self.middle.pk)
+        self.assertIsNone(ServiceRequest.claim_next(self.tech, category='Other'))
+        self.assertEqual(ServiceRequest.claim_next(self.tech, category='Network Problem').pk, self.oldest.pk)
+
+    def test_assigned_requests_are_skipped(self):
+        ServiceRequest.objects.filter(pk=self.oldest.pk).update(assigned_to=self.tech)
+        self.assertEqual(ServiceRequest.claim_next(self.tech).pk, self.middle.pk)
+
+
+class DuplicateDetectionTests(TestCase):
+    text = 'The printer on the third floor jams every morning when printing double sided'
+
+    def test_signature_is_stable_and_banded(self):
+        sig = duplicates.signature(self.text)
+        self.assertEqual(len(sig), duplicates.NUM_PERMUTATIONS)
+        self.assertEqual(sig, duplicates.signature(self.text.upper()))
+        self.assertEqual(duplicates.unpack(duplicates.pack(sig)), sig)
+        self.assertEqual(len(duplicates.band_keys(sig)), duplicates.BANDS)
+        self.assertIsNone(duplicates.signature('  '))
+
+    def test_pure_python_signature_matches_numpy(self):
+        if duplicates.np is None:
+            self.skipTest("numpy is not installed")
+        texts = [self.text, 'VPN', 'Grüße aus München, der Drucker druckt nicht', self.text * 40]
+        vectorized = [duplicates.signature(text) for text in texts]
+        with mock.patch.object(duplicates, 'np', None):
+            self.assertEqual([duplicates.signature(text) for text in texts], vectorized)
+
+    def test_similar_texts_share_a_band(self):
+        near = duplicates.signature(self.text + ' again')
+        far = duplicates.signature('Need Adobe Acrobat installed on the new laptop for contracts')
+        sig = duplicates.signature(self.text)
+        self.assertTrue(set(duplicates.band_keys(sig)) & set(duplicates.band_keys(near)))
+        self.assertGreater(duplicates.similarity(sig, near), duplicates.similarity(sig, far))
+
+    def test_find_duplicates_only_returns_open_requests(self):
+        req = make_request(self.text)
+        make_request('Need Adobe Acrobat installed on the new laptop for contracts')
+        matches = duplicates.find_duplicates(self.text + ' again')
+        self.assertEqual([match.pk for match, _ in matches], [req.pk])
+        self.assertEqual(duplicates.find_duplicates(self.text, exclude_pk=req.pk), [])
+        other = make_request(self.text + ' again')
+        self.assertEqual([match.pk for match, _ in duplicates.find_duplicates_of(other)], [req.pk])
+        other.delete()
+
+        req.transition_to('Resolved')
+        self.assertEqual(duplicates.find_duplicates(self.text), [])
+        ServiceRequest.bulk_transition([req], 'Pending')
+        self.assertEqual(len(duplicates.find_duplicates(self.text)), 1)
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_capacity_then_refill(self):
+        bucket = TokenBucket('test', capacity=2, period=10)
+        self.assertEqual(bucket.consume(now=0), 0)
+        self.assertEqual(bucket.consume(now=0), 0)
+        self.assertAlmostEqual(bucket.consume(now=0), 5)
+        self.assertAlmostEqual(bucket.consume(now=3), 2)
+        self.assertEqual(bucket.consume(now=5), 0)
+
+    def test_wait_does_not_take_tokens(self):
+        bucket = TokenBucket('test', capacity=1, period=10)
+        self.assertEqual(bucket.wait(now=0), 0)
+        self.assertEqual(bucket.wait(now=0), 0)
+        self.assertEqual(bucket.consume(now=0), 0)
+        self.assertAlmostEqual(bucket.wait(now=0), 10)
+
+    @override_settings(RATE_LIMITS={'test': {'user': (5, 60), 'global': (1, 60)}})
+    def test_refused_requests_cost_nothing(self):
+        view = rate_limit('test')(lambda request: HttpResponse('ok'))
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_user('alice', password='pw')
+        self.assertEqual(view(request).status_code, 200)
+        self.assertEqual(view(request).status_code, 429)
+        # Only the accepted request was charged to the user's bucket
+        self.assertAlmostEqual(TokenBucket(f'test:user:{request.user.pk}', 5, 60).wait(tokens=5), 12, delta=1)
+
+    @override_settings(RATE_LIMITS={'test': {'user': (1, 60)}})
+    def test_charge_if(self):
+        status = [400]
+        view = rate_limit('test', charge_if=lambda response: response.status_code == 302)(
+            lambda request: HttpResponse(status=status[0])
+        )
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_user('alice', password='pw')
+        self.assertEqual(view(request).status_code, 400)
+        status[0] = 302
+        self.assertEqual(view(request).status_code, 302)
+        self.assertEqual(view(request).status_code, 429)
+
+    @override_settings(RATE_LIMITS={'test': {'user': (1, 60)}})
+    def test_charge_if_reserves_the_token_while_the_view_runs(self):
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_user('alice', password='pw')
+        bucket = TokenBucket(f'test:user:{request.user.pk}', 1, 60)
+        seen = []
+
+        def view(request):
+            # A concurrent request arriving now finds the bucket empty
+            seen.append(bucket.wait())
+            return HttpResponse(status=400)
+
+        limited = rate_limit('test', charge_if=lambda response: response.status_code == 302)(view)
+        self.assertEqual(limited(request).status_code, 400)
+        self.assertGreater(seen[0], 0)
+        self.assertEqual(bucket.wait(), 0)
+
+
+class ConcurrencyLimitTests(TestCase):
+    def setUp(self):
+        throttling._semaphores.clear()
+        self.addCleanup(throttling._semaphores.clear)
+
+    @override_settings(CONCURRENCY_LIMITS={'test': 1}, CONCURRENCY_QUEUE_TIMEOUT=0.01)
+    def test_streaming_response_holds_its_slot_until_closed(self):
+        view = concurrency_limit('test')(lambda request: StreamingHttpResponse(iter([b'a', b'b'])))
+        request = RequestFactory().get('/')
+        response = view(request)
+        with self.assertLogs('requests_app.throttling', 'WARNING'):
+            self.assertEqual(view(request).status_code, 503)
+        self.assertEqual(b''.join(response.streaming_content), b'ab')
+        response.close()
+        response.close()
+        second = view(request)
+        self.assertEqual(second.status_code, 200)
+        second.close()
+
+    @override_settings(CONCURRENCY_LIMITS={'test': 1}, CONCURRENCY_QUEUE_TIMEOUT=0.01)
+    def test_plain_response_releases_at_once(self):
+        view = concurrency_limit('test')(lambda request: HttpResponse('ok'))
+        request = RequestFactory().get('/')
+        self.assertEqual([view(request).status_code for _ in range(2)], [200, 200])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tech', password='pw', is_staff=True)
+        self.cutoff = timezone.now() - timedelta(days=30)
+
+    def resolved(self, days_ago, **fields):
+        req = make_request(**fields)
+        ServiceRequest.objects.filter(pk=req.pk).update(
+            status='Resolved', resolved_at=timezone.now() - timedelta(days=days_ago),
+        )
+        return req
+
+    def test_archives_old_resolved_requests_with_their_steps(self):
+        old = self.resolved(60)
+        recent = self.resolved(5)
+        open_req = make_request()
+        step = ResolutionStep.objects.create(service_request=old, step_number=1, description='Reset', created_by=self.user)
+        blob = Blob.objects.create(sha256='0' * 64, size=1, content_type='text/plain')
+        attachment = Attachment.objects.create(blob=blob, service_request=old, resolution_step=step, filename='log.txt')
+
+        self.assertEqual(sum(archive.archive_resolved(self.cutoff)), 1)
+
+        self.assertFalse(ServiceRequest.objects.filter(pk=old.pk).exists())
+        archived = archive.find_request(old.pk)
+        self.assertIsInstance(archived, ArchivedServiceRequest)
+        self.assertEqual([s.description for s in archived.resolution_steps.all()], ['Reset'])
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.archived_step.service_request_id, old.pk)
+        # The status history stays behind for the reports
+        self.assertTrue(StatusTransition.objects.filter(service_request_id=old.pk).exists())
+        self.assertEqual(set(archive.requests_by_id([old.pk, recent.pk, open_req.pk])), {old.pk, recent.pk, open_req.pk})
+
+    def test_duplicates_that_stay_keep_their_target(self):
+        target = self.resolved(60)
+        self.resolved(60, duplicate_of=target)
+        staying = make_request(duplicate_of=target)
+
+        self.assertEqual(sum(archive.archive_resolved(self.cutoff)), 1)
+        self.assertTrue(ServiceRequest.objects.filter(pk=target.pk).exists())
+        staying.refresh_from_db()
+        self.assertEqual(staying.duplicate_of_id, target.pk)
+
+    def test_command_dry_run(self):
+        old = self.resolved(60)
+        call_command('archive_requests', older_than=30, dry_run=True, stdout=StringIO())
+        self.assertTrue(ServiceRequest.objects.filter(pk=old.pk).exists())
+        call_command('archive_requests', older_than=30, stdout=StringIO())
+        self.assertFalse(ServiceRequest.objects.filter(pk=old.pk).exists())
+
+
+class AttachmentStoreTests(TestCase):
+    png = b'\x89PNG\r\n\x1a\n' + b'\0' * 32
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(ATTACHMENTS_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(attachments, 'schedule_thumbnail')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('alice', password='pw')
+        self.req = make_request()
+
+    def upload(self, data, name, content_type='text/html'):
+        tmp_dir = attachments.root() / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fh = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        fh.write(data)
+        fh.flush()
+        fh.seek(0)
+        self.addCleanup(lambda: os.path.exists(fh.name) and os.unlink(fh.name))
+        return attachments.HashedUploadedFile(fh, name, content_type, len(data), None,
+                                              hashlib.sha256(data).hexdigest(), truncated=False)
+
+    def store(self, data, name, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return attachments.store(self.upload(data, name, **kwargs), self.user, self.req)
+
+    def test_content_type_is_detected_not_trusted(self):
+        self.assertEqual(self.store(self.png, 'screenshot.txt').blob.content_type, 'image/png')
+        self.assertEqual(self.store(b'<script>x</script>', 'photo.png', content_type='image/png').blob.content_type,
+                         'application/octet-stream')
+        self.assertEqual(self.store(b'<p>hi</p>', 'page.html', content_type='text/plain').blob.content_type,
+                         'text/html')
+        self.assertEqual(self.store(b'error log', 'log.txt').blob.content_type, 'text/plain')
+        self.assertEqual(self.store(b'\0\1', 'dump').blob.content_type, 'application/octet-stream')
+
+    def test_identical_uploads_share_a_blob(self):
+        first = self.store(self.png, 'a.png')
+        second = self.store(self.png, 'b.png')
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(attachments.blob_path(first.blob_id).read_bytes(), self.png)
+
+    def test_prune_keeps_referenced_blobs(self):
+        kept = self.store(b'kept', 'kept.txt')
+        dropped = self.store(b'dropped', 'dropped.txt')
+        dropped.delete()
+        self.assertTrue(attachments.lock_blob(dropped.blob_id))
+        call_command('maintain_attachments', stdout=StringIO())
+        self.assertEqual(list(Blob.objects.values_list('sha256', flat=True)), [kept.blob_id])
+        self.assertFalse(attachments.blob_path(dropped.blob_id).exists())
+        self.assertTrue(attachments.blob_path(kept.blob_id).exists())
+        self.assertFalse(attachments.lock_blob(dropped.blob_id))
+
+
+class RangeRequestTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp.write(b'0123456789')
+        tmp.close()
+        self.path = Path(tmp.name)
+        self.addCleanup(os.unlink, tmp.name)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get('/', headers=headers)
+        response = attachments.file_response(request, self.path, 'text/plain', 'abc')
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertEqual(self.body(response), b'0123456789')
+
+    def test_ranges(self):
+        response = self.get(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(self.body(response), b'2345')
+        self.assertEqual(self.body(self.get(Range='bytes=-3')), b'789')
+        self.assertEqual(self.body(self.get(Range='bytes=7-')), b'789')
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.get(Range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        self.assertEqual(self.get(Range='bytes=0-1,4-5').status_code, 200)
+        self.assertEqual(self.get(Range='bytes=2-5', **{'If-Range': '"stale"'}).status_code, 200)
+
+    def test_not_modified(self):
+        self.assertEqual(self.get(**{'If-None-Match': '"abc"'}).status_code, 304)
+
+
+class MailIngestTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(suffix='.mbox', delete=False)
+        for n in range(3):
+            tmp.write(
+                f'From sender@example.com Mon Jan  1 00:00:00 2024\n'
+                f'Message-ID: <msg-{n}@example.com>\nSubject: Message {n}\n\n'
+                f'Body {n}\n>From the top\n\n'.encode()
+            )
+        tmp.close()
+        self.path = tmp.name
+        self.addCleanup(os.unlink, tmp.name)
+
+    def test_resume_from_offset(self):
+        messages = list(mail_ingest.iter_mbox(self.path))
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(messages[-1][0], os.path.getsize(self.path))
+        self.assertIn(b'\nFrom the top', messages[0][1])
+
+        offset = messages[0][0]
+        resumed = list(mail_ingest.iter_mbox(self.path, offset=offset))
+        self.assertEqual(resumed, messages[1:])
+        self.assertEqual(list(mail_ingest.iter_mbox(self.path, offset=messages[-1][0])), [])
+
+    def test_rotated_mailbox_starts_over(self):
+        messages = list(mail_ingest.iter_mbox(self.path, offset=10 ** 6))
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(mail_ingest.parse(messages[1][1])['message_id'], 'msg-1@example.com')
+
+    def test_maildir_picks_up_late_deliveries_with_lower_keys(self):
+        User.objects.create_user('mailbot', is_staff=True)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        maildir = Path(directory.name)
+        for sub in ('cur', 'new', 'tmp'):
+            (maildir / sub).mkdir()
+
+        def deliver(key, n, sub='new', extra=''):
+            (maildir / sub / key).write_bytes(
+                f'From: Bob <bob@example.com>\nMessage-ID: <maildir-{n}@example.com>\n{extra}'
+                f'Subject: Laptop {n}\n\nMy laptop will not boot ({n})\n'.encode()
+            )
+
+        def ingest():
+            call_command('ingest_mail', str(maildir), user='mailbot', stdout=StringIO())
+
+        deliver('1700000002.M2P1.mx2', 2)
+        deliver('1700000003.M3P1.mx2', 3, sub='cur')
+        ingest()
+        self.assertEqual(ServiceRequest.objects.count(), 2)
+        # Delivered later by a host whose clock is behind
+        deliver('1700000001.M1P1.mx1', 1)
+        deliver('1700000004.M4P1.mx1', 4, extra='In-Reply-To: <maildir-2@example.com>\n')
+        with mock.patch.object(mail_ingest.MailIngestor, '_import', autospec=True,
+                               side_effect=mail_ingest.MailIngestor._import) as imported:
+            ingest()
+        self.assertEqual(ServiceRequest.objects.count(), 3)
+        self.assertEqual([len(call.args[1]) for call in imported.call_args_list], [2])
+        self.assertTrue(ServiceRequest.objects.filter(description__contains='(1)').exists())
+        self.assertEqual(MailMessage.objects.count(), 4)
+        ingest()
+        self.assertEqual(MailMessage.objects.count(), 4)
+
+    def test_header_message_id(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'message'
+        path.write_bytes(b'Subject: x\r\nMessage-ID: <a@b>\r\n\r\nMessage-ID: <body@b>\r\n')
+        self.assertEqual(mail_ingest._header_message_id(path), 'a@b')
+        path.write_bytes(b'Subject: no id\n\nbody\n')
+        self.assertIsNone(mail_ingest._header_message_id(path))
+
+
+class DashboardWidgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw', first_name='Alice')
+        self.tech = User.objects.create_user('tech', password='pw', is_staff=True)
+        make_request(category='Network Problem')
+        make_request(requester_name='Bob')
+        archived = make_request(category='Network Problem')
+        ServiceRequest.objects.filter(pk=archived.pk).update(
+            status='Resolved', resolved_at=timezone.now() - timedelta(days=400),
+        )
+        archive.archive_resolved(timezone.now() - timedelta(days=30))
+
+    def widget(self, name):
+        response = self.client.get(reverse('requests_app:dashboard_widget', args=[name]))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_staff_see_every_request_including_archived(self):
+        self.client.force_login(self.tech)
+        status = self.widget('status')
+        self.assertEqual((status['total'], status['pending'], status['resolved']), (3, 2, 1))
+        categories = {row['category']: row['count'] for row in self.widget('categories')['categories']}
+        self.assertEqual(categories, {'Network Problem': 2, 'Other': 1})
+        self.assertEqual(sum(month['count'] for month in self.widget('trend')['months']), 3)
+        self.assertEqual(len(self.widget('recent')['requests']), 3)
+
+    def test_users_see_their_own_requests(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.widget('status')['total'], 2)
+        names = {row['requester_name'] for row in self.widget('recent')['requests']}
+        self.assertEqual(names, {'Alice'})
+
+    def test_widgets_are_cached_per_scope(self):
+        self.client.force_login(self.tech)
+        first = self.widget('status')
+        make_request()
+        self.assertEqual(self.widget('status'), first)
+        self.client.force_login(self.alice)
+        self.assertEqual(self.widget('status')['total'], 3)
+
+    def test_unknown_widget_and_anonymous_users(self):
+        url = reverse('requests_app:dashboard_widget', args=['status'])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.tech)
+        self.assertEqual(self.client.get(reverse('requests_app:dashboard_widget', args=['nope'])).status_code, 404)
+
+
+class DatabaseMaintenanceTests(TestCase):
+    """Runs against a scratch SQLite file: the test database lives in memory."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        handler = ConnectionHandler({'default': {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(self.directory / 'app.sqlite3'),
+        }})
+        self.connection = handler['default']
+        self.addCleanup(self.connection.close)
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE ticket (id INTEGER PRIMARY KEY, title TEXT)')
+            cursor.execute('CREATE INDEX ticket_title ON ticket (title)')
+            cursor.executemany('INSERT INTO ticket (title) VALUES (%s)', [(f'ticket {n}',) for n in range(500)])
+
+    def test_checks_run_on_a_snapshot(self):
+        staging = maintenance.snapshot(self.connection, self.directory / 'backups', pause=0)
+        self.assertTrue(staging.name.startswith('.'))
+        self.assertEqual(maintenance.integrity_check(staging), [])
+        maintenance.analyze(self.connection)
+        indexes = {index['name']: index for index in maintenance.index_stats(staging)}
+        self.assertIn('ticket_title', indexes)
+        self.assertGreater(indexes['ticket_title']['pages'], 0)
+
+    def test_backups_are_unique_and_pruned(self):
+        backups = self.directory / 'backups'
+        paths = [
+            maintenance.keep_backup(maintenance.snapshot(self.connection, backups, pause=0), keep=2)
+            for _ in range(3)
+        ]
+        self.assertEqual(len(set(paths)), 3)
+        self.assertEqual(sorted(backups.iterdir()), paths[1:])
+
+    def test_stats_reads_only_the_header(self):
+        stats = maintenance.stats(self.connection)
+        self.assertEqual(stats['journal_mode'], 'delete')
+        self.assertGreater(stats['page_count'], 1)
+        self.assertNotIn('indexes', stats)
+
+    def test_command(self):
+        out = StringIO()
+        with mock.patch('requests_app.management.commands.db_maintenance.connection', self.connection):
+            call_command('db_maintenance', backup=True, backup_dir=str(self.directory / 'backups'),
+                         step_pause=0, indexes=5, stdout=out)
+            with self.assertRaises(CommandError):
+                call_command('db_maintenance', keep=0, stdout=out)
+        output = out.getvalue()
+        self.assertIn('integrity_check ok', output)
+        self.assertIn('ticket_title on ticket', output)
+        self.assertEqual(len(list((self.directory / 'backups').glob('db-*.sqlite3'))), 1)
+        self.assertEqual(list((self.directory / 'backups').glob('.*')), [])
@@ -0,0 +1,196 @@
+"""
+Admission control for expensive views.
+
+``rate_limit`` applies token buckets kept in Django's cache, one per user
+and one shared by everybody, and answers 429 with ``Retry-After`` once a
+bucket is empty. ``concurrency_limit`` caps how many requests a worker
+process handles in a view at the same time and answers 503 beyond that,
+so a burst against dashboards cannot tie up every thread.
+
+Limits are configured in RATE_LIMITS and CONCURRENCY_LIMITS. With the
+default LocMemCache every worker process keeps its own buckets; point
+CACHE_BACKEND at a shared cache to enforce them across processes.
+"""
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to ``capacity`` tokens, refilled at
+    ``capacity / period`` tokens per second.
+
+    The state is a single cache value, the time at which the bucket will be
+    full again (the GCRA form of a token bucket), so a check is one cache
+    read and at most one write. Concurrent checks may race and let a
+    request or two past the limit, which is fine for admission control.
+    """
+
+    def __init__(self, key, capacity, period):
+        self.key = f'ratelimit:{key}'
+        self.capacity = capacity
+        self.interval = period / capacity  # seconds per token
+
+    def wait(self, tokens=1, now=None):
+        """Seconds until ``tokens`` are available (0 if they are now), without taking them."""
+        now = time.time() if now is None else now
+        full_at = max(cache.get(self.key, now), now)
+        return max(full_at + tokens * self.interval - now - self.capacity * self.interval, 0)
+
+    def refund(self, tokens=1, now=None):
+        """Give back ``tokens`` taken by ``consume`` (never beyond a full bucket)."""
+        now = time.time() if now is None else now
+        full_at = cache.get(self.key)
+        if full_at is None or full_at <= now:
+            return
+        new_full_at = max(full_at - tokens * self.interval, now)
+        cache.set(self.key, new_full_at, timeout=math.ceil(new_full_at - now) + 1)
+
+    def consume(self, tokens=1, now=None):
+        """Take ``tokens``; returns 0 on success, else seconds until they are available."""
+        now = time.time() if now is None else now
+        full_at = max(cache.get(self.key, now), now)
+        new_full_at = full_at + tokens * self.interval
+        wait = new_full_at - now - self.capacity * self.interval
+        if wait > 0:
+            return wait
+        cache.set(self.key, new_full_at, timeout=math.ceil(new_full_at - now) + 1)
+        return 0
+
+
+def _client_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse("Too many requests, please try again later.", status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _buckets(scope, request):
+    limits = getattr(settings, 'RATE_LIMITS', {}).get(scope) or {}
+    buckets = []
+    if 'user' in limits:
+        buckets.append(TokenBucket(f'{scope}:{_client_key(request)}', *limits['user']))
+    if 'global' in limits:
+        buckets.append(TokenBucket(f'{scope}:global', *limits['global']))
+    return buckets
+
+
+def rate_limit(scope, methods=('POST',), charge_if=None):
+    """
+    Decorator limiting ``methods`` requests to a view by the RATE_LIMITS
+    entry for ``scope``: ``{'user': (requests, seconds), 'global': (...)}``.
+
+    Every bucket is checked before any is charged, so a request refused by
+    one bucket costs nothing in the others. With ``charge_if`` the tokens
+    taken before the view runs are refunded unless ``charge_if(response)``
+    is true (e.g. the request was created).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            buckets = _buckets(scope, request) if request.method in methods else []
+            for bucket in buckets:
+                wait = bucket.wait()
+                if wait:
+                    logger.info("Rate limited %s for %s (%s)", scope, _client_key(request), bucket.key)
+                    return too_many_requests(wait)
+            # Reserve the tokens before the view runs, so a burst of
+            # concurrent requests cannot all pass before any is charged
+            charged = []
+            for bucket in buckets:
+                wait = bucket.consume()
+                if wait:
+                    for taken in charged:
+                        taken.refund()
+                    return too_many_requests(wait)
+                charged.append(bucket)
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                if charge_if is not None:
+                    for bucket in charged:
+                        bucket.refund()
+                raise
+            if charge_if is not None and not charge_if(response):
+                for bucket in charged:
+                    bucket.refund()
+            return response
+        return wrapper
+    return decorator
+
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def _semaphore(name, limit):
+    with _semaphores_lock:
+        semaphore = _semaphores.get(name)
+        if semaphore is None:
+            semaphore = _semaphores[name] = threading.BoundedSemaphore(limit)
+        return semaphore
+
+
+def _release_on_close(response, semaphore):
+    """Release ``semaphore`` once, when the server closes ``response``."""
+    close = response.close
+    released = []
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released:
+                released.append(True)
+                semaphore.release()
+
+    response.close = close_and_release
+
+
+def concurrency_limit(name):
+    """
+    Decorator allowing at most CONCURRENCY_LIMITS[name] concurrent requests
+    to a view per worker process. Extra requests wait up to
+    CONCURRENCY_QUEUE_TIMEOUT seconds for a slot, then get a 503. A
+    streaming response keeps its slot until it is closed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limit = getattr(settings, 'CONCURRENCY_LIMITS', {}).get(name)
+            if not limit:
+                return view(request, *args, **kwargs)
+            semaphore = _semaphore(name, limit)
+            if not semaphore.acquire(timeout=getattr(settings, 'CONCURRENCY_QUEUE_TIMEOUT', 0.5)):
+                logger.warning("Shed request to %s: %d already in progress", name, limit)
+                response = HttpResponse("The server is busy, please try again shortly.", status=503)
+                response['Retry-After'] = str(getattr(settings, 'CONCURRENCY_RETRY_AFTER', 5))
+                return response
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                semaphore.release()
+                raise
+            if response.streaming:
+                # Hold the slot until the body has been sent: the server
+                # closes the response after the last chunk
+                _release_on_close(response, semaphore)
+            else:
+                semaphore.release()
+            return response
+        return wrapper
+    return decorator
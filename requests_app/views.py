@@ -1,14 +1,22 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.contrib.auth import login
-from django.http import HttpResponse
-from django.db.models import Count, Q
-from .models import ServiceRequest
-from .forms import ServiceRequestForm, UserRegistrationForm, ResolutionStepForm
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.db import transaction
+from django.db.models import Q
+from .models import ServiceRequest, ResolutionStep, ArchivedServiceRequest, Attachment
+from .forms import ServiceRequestForm, UserRegistrationForm, ResolutionStepForm, AttachmentForm
+from .middleware import display_name
+from .duplicates import find_duplicates_of
+from . import archive, attachments, dashboard, report_builder, suggestions
+from .throttling import concurrency_limit, rate_limit
+from . import metrics as request_metrics
 from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
 from django.contrib import messages
 import requests  # used for simple SendGrid or mock API call
-from datetime import datetime, timedelta
 
 # Add these imports for user management
 from django.contrib.auth.models import User
@@ -32,98 +40,24 @@ def ui_submit(request):
 
 @login_required
 def ui_dashboard(request):
-    # Different data based on user role
-    if request.user.is_staff:
-        # ADMIN/STAFF DASHBOARD - Full statistics
-        total_requests = ServiceRequest.objects.count()
-        pending_count = ServiceRequest.objects.filter(status='Pending').count()
-        in_progress_count = ServiceRequest.objects.filter(status='In Progress').count()
-        resolved_count = ServiceRequest.objects.filter(status='Resolved').count()
-        
-        # Recent activity (last 7 days) - all requests
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        recent_requests = ServiceRequest.objects.filter(created_at__gte=seven_days_ago).count()
-        
-        # Requests by category - all requests
-        category_stats = ServiceRequest.objects.values('category').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Monthly trend (last 6 months) - all requests
-        six_months_ago = datetime.now() - timedelta(days=180)
-        monthly_trend = ServiceRequest.objects.filter(
-            created_at__gte=six_months_ago
-        ).extra({
-            'month': "strftime('%%Y-%%m', created_at)"
-        }).values('month').annotate(count=Count('id')).order_by('month')
-        
-        # High priority requests (pending + in progress) - all requests
-        high_priority_count = ServiceRequest.objects.filter(
-            Q(status='Pending') | Q(status='In Progress')
-        ).count()
-        
-        # Average resolution time (for resolved requests) - all requests
-        avg_resolution_time = None
-        # Note: You'll need to fix the resolved_at issue mentioned earlier
-        
-        dashboard_type = 'admin'
-        
-    else:
-        # REGULAR USER DASHBOARD - Only user's own statistics
-        user_name = request.user.get_full_name() or request.user.username
-        
-        # User's own requests
-        user_requests = ServiceRequest.objects.filter(requester_name=user_name)
-        total_requests = user_requests.count()
-        pending_count = user_requests.filter(status='Pending').count()
-        in_progress_count = user_requests.filter(status='In Progress').count()
-        resolved_count = user_requests.filter(status='Resolved').count()
-        
-        # Recent activity (last 7 days) - user's requests only
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        recent_requests = user_requests.filter(created_at__gte=seven_days_ago).count()
-        
-        # Requests by category - user's requests only
-        category_stats = user_requests.values('category').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Monthly trend (last 6 months) - user's requests only
-        six_months_ago = datetime.now() - timedelta(days=180)
-        monthly_trend = user_requests.filter(
-            created_at__gte=six_months_ago
-        ).extra({
-            'month': "strftime('%%Y-%%m', created_at)"
-        }).values('month').annotate(count=Count('id')).order_by('month')
-        
-        # High priority requests (pending + in progress) - user's requests only
-        high_priority_count = user_requests.filter(
-            Q(status='Pending') | Q(status='In Progress')
-        ).count()
-        
-        # Average resolution time for user's resolved requests
-        resolved_user_requests = user_requests.filter(status='Resolved')
-        avg_resolution_time = None
-        # Note: You'll need to fix the resolved_at issue mentioned earlier
-        
-        dashboard_type = 'user'
-    
+    # Only the shell: each widget loads its data from dashboard_widget
     context = {
-        'total_requests': total_requests,
-        'pending_count': pending_count,
-        'in_progress_count': in_progress_count,
-        'resolved_count': resolved_count,
-        'recent_requests': recent_requests,
-        'category_stats': category_stats,
-        'monthly_trend': list(monthly_trend),
-        'high_priority_count': high_priority_count,
-        'avg_resolution_time': avg_resolution_time,
-        'dashboard_type': dashboard_type,  # This will help in template
+        'dashboard_type': 'admin' if request.user.is_staff else 'user',  # This will help in template
+        'widgets': {name: dashboard.timeout(name) for name in dashboard.WIDGETS},
         'user': request.user,
     }
-    
     return render(request, 'dashboard.html', context)
 
+@login_required
+@concurrency_limit('dashboard')
+def dashboard_widget(request, name):
+    """JSON data of one dashboard widget, scoped like the dashboard itself."""
+    if name not in dashboard.WIDGETS:
+        raise Http404("Unknown widget")
+    response = JsonResponse(dashboard.widget_data(name, request))
+    patch_cache_control(response, private=True, max_age=dashboard.timeout(name))
+    return response
+
 @login_required
 def ui_requests_list(request):
     if not request.user.is_staff:
@@ -159,32 +93,54 @@ def signup_success(request):
     return render(request, 'signup_success.html')
 
 @login_required
+# Only a filed request is charged: the duplicate warning and invalid forms are free
+@rate_limit('submit_request', charge_if=lambda response: response.status_code == 302)
 def submit_request(request):
     if request.method == 'POST':
-        form = ServiceRequestForm(request.POST, user=request.user)
-        if form.is_valid():
+        form = ServiceRequestForm(request.POST, department=request.user_context.department)
+        attachment_form = AttachmentForm(request.POST, request.FILES)
+        if form.is_valid() and attachment_form.is_valid():
+            # Point out likely duplicates once; resubmitting with
+            # confirm_submit files the request anyway
+            if 'confirm_submit' not in request.POST:
+                possible_duplicates = form.possible_duplicates()
+                if possible_duplicates:
+                    return render(request, 'submit.html', {
+                        'form': form,
+                        'attachment_form': attachment_form,
+                        'user': request.user,
+                        'possible_duplicates': possible_duplicates,
+                    })
             req = form.save(commit=False)
             # Auto-populate requester_name from logged-in user
-            req.requester_name = request.user.get_full_name() or request.user.username
+            req.requester_name = request.user_context.display_name
             # Auto-populate department from user profile if not provided
-            try:
-                if not req.department and hasattr(request.user, 'profile') and request.user.profile.department:
-                    req.department = request.user.profile.department
-            except AttributeError:
-                # User doesn't have a profile yet - that's okay, department remains empty
-                pass
-            req.save()  # default status = Pending
+            if not req.department and request.user_context.department:
+                req.department = request.user_context.department
+            with transaction.atomic():
+                req.save()  # default status = Pending
+                for upload in attachment_form.cleaned_data['attachments']:
+                    attachments.store(upload, request.user, req)
             # Send notification (simple example using SendGrid HTTP API)
             send_new_request_email(req)
             # Redirect to success page with message
             return redirect('requests_app:submit_success')
     else:
-        form = ServiceRequestForm(user=request.user)
-    return render(request, 'submit.html', {'form': form, 'user': request.user})
+        form = ServiceRequestForm(department=request.user_context.department)
+        attachment_form = AttachmentForm()
+    return render(request, 'submit.html', {'form': form, 'attachment_form': attachment_form, 'user': request.user})
+
+@login_required
+@require_POST
+@rate_limit('suggest_category')
+def suggest_category(request):
+    """JSON category suggestion for the description typed on the submit form"""
+    description = request.POST.get('description', '')[:5000]
+    return JsonResponse({'suggestion': suggestions.suggest_category(description)})
 
 def submit_success(request):
     # Show success message on the submit page
-    return render(request, 'submit.html', {'success': True, 'form': ServiceRequestForm(user=request.user if request.user.is_authenticated else None), 'user': request.user if request.user.is_authenticated else None})
+    return render(request, 'submit.html', {'success': True, 'form': ServiceRequestForm(department=request.user_context.department), 'user': request.user if request.user.is_authenticated else None})
 
 # Admin view — require staff status
 @login_required
@@ -201,16 +157,18 @@ def list_requests(request):
 
 @login_required
 def detail_request(request, pk):
-    req = get_object_or_404(ServiceRequest, pk=pk)
+    req = ServiceRequest.objects.select_related('resolved_by', 'assigned_to', 'duplicate_of').filter(pk=pk).first()
+    if req is None:
+        return detail_archived_request(request, pk)
     
     # Non-staff users can only view their own requests
     if not request.user.is_staff:
-        user_name = request.user.get_full_name() or request.user.username
-        if req.requester_name != user_name:
+        if req.requester_name != request.user_context.display_name:
             return HttpResponse("Forbidden", status=403)
     
-    resolution_steps = req.resolution_steps.all()
+    resolution_steps = req.resolution_steps.select_related('created_by').prefetch_related('attachments__blob')
     step_form = ResolutionStepForm()
+    attachment_form = AttachmentForm()
     
     # Handle status updates and resolution steps for staff users
     if request.method == 'POST' and request.user.is_staff:
@@ -219,22 +177,33 @@ def detail_request(request, pk):
             req.mark_resolved(user=request.user)
             messages.success(request, f'Request #{req.id} has been marked as resolved!')
         elif 'mark_in_progress' in request.POST:
-            req.status = 'In Progress'
-            req.save()
+            req.transition_to('In Progress', user=request.user)
             messages.success(request, f'Request #{req.id} is now in progress!')
         elif 'mark_pending' in request.POST:
-            req.status = 'Pending'
-            req.save()
+            req.transition_to('Pending', user=request.user)
             messages.success(request, f'Request #{req.id} has been reopened!')
+        elif 'merge_into' in request.POST:
+            target_id = request.POST.get('target_id', '')
+            target = ServiceRequest.objects.filter(pk=target_id).first() if target_id.isdigit() else None
+            if target is None or target.pk == req.pk:
+                messages.error(request, 'Choose another existing request to merge into.')
+            else:
+                req.merge_into(target, user=request.user)
+                messages.success(request, f'Request #{req.id} was merged into #{target.id}.')
+                return redirect('requests_app:detail_request', pk=target.pk)
         
         # Handle adding resolution steps - NO automatic status change
         elif 'add_resolution_step' in request.POST:
             step_form = ResolutionStepForm(request.POST)
-            if step_form.is_valid():
+            attachment_form = AttachmentForm(request.POST, request.FILES)
+            if step_form.is_valid() and attachment_form.is_valid():
                 resolution_step = step_form.save(commit=False)
                 resolution_step.service_request = req
                 resolution_step.created_by = request.user
-                resolution_step.save()
+                with transaction.atomic():
+                    resolution_step.save()
+                    for upload in attachment_form.cleaned_data['attachments']:
+                        attachments.store(upload, request.user, req, resolution_step)
                 messages.success(request, 'Resolution step added successfully!')
                 return redirect('requests_app:detail_request', pk=pk)
         
@@ -250,29 +219,116 @@ def detail_request(request, pk):
         
         return redirect('requests_app:detail_request', pk=pk)
     
+    possible_duplicates = []
+    similar_resolved = []
+    if request.user.is_staff and req.status != 'Resolved':
+        possible_duplicates = find_duplicates_of(req)
+    if request.user.is_staff:
+        # Past resolutions of similar problems, most similar first
+        matches = dict(suggestions.similar_resolved(req))
+        similar = archive.requests_by_id(list(matches), prefetch=['resolution_steps']).values()
+        similar_resolved = sorted(similar, key=lambda other: -matches[other.pk])
+        for other in similar_resolved:
+            other.similarity = matches[other.pk]
+
     context = {
         'req': req,
         'user': request.user,
         'resolution_steps': resolution_steps,
         'step_form': step_form,
+        'attachment_form': attachment_form,
+        'request_attachments': req.attachments.filter(resolution_step__isnull=True).select_related('blob'),
+        'possible_duplicates': possible_duplicates,
+        'similar_resolved': similar_resolved,
     }
     
     return render(request, 'request_detail.html', context)
 
+def detail_archived_request(request, pk):
+    """Read-only detail page for a request moved to the archive"""
+    req = get_object_or_404(ArchivedServiceRequest.objects.select_related('resolved_by', 'assigned_to'), pk=pk)
+    if not request.user.is_staff and req.requester_name != request.user_context.display_name:
+        return HttpResponse("Forbidden", status=403)
+    return render(request, 'request_detail.html', {
+        'req': req,
+        'user': request.user,
+        'resolution_steps': req.resolution_steps.select_related('created_by').prefetch_related('attachments__blob'),
+        'request_attachments': Attachment.objects.filter(
+            service_request_id=req.pk, resolution_step__isnull=True, archived_step__isnull=True,
+        ).select_related('blob'),
+    })
+
+def _attachment_for(request, pk):
+    """The attachment ``pk`` if the user may see its request, else None"""
+    attachment = Attachment.objects.select_related('blob').filter(pk=pk).first()
+    if attachment is None:
+        return None
+    if not request.user.is_staff:
+        req = archive.find_request(attachment.service_request_id)
+        if req is None or req.requester_name != request.user_context.display_name:
+            return None
+    return attachment
+
+@login_required
+def download_attachment(request, pk):
+    attachment = _attachment_for(request, pk)
+    if attachment is None:
+        raise Http404("Attachment not found")
+    blob = attachment.blob
+    # Only images and plain text are shown inline; anything else (HTML,
+    # SVG, ...) is downloaded so uploads cannot run script on this site
+    inline = blob.content_type in attachments.THUMBNAIL_TYPES or blob.content_type == 'text/plain'
+    return attachments.file_response(
+        request, attachments.blob_path(blob.sha256),
+        content_type=blob.content_type if inline else 'application/octet-stream',
+        etag=blob.sha256, filename=attachment.filename, as_attachment=not inline,
+    )
+
+@login_required
+def attachment_thumbnail(request, pk):
+    attachment = _attachment_for(request, pk)
+    if attachment is None or not attachment.has_thumbnail:
+        raise Http404("Thumbnail not found")
+    return attachments.file_response(
+        request, attachments.thumbnail_path(attachment.blob_id), content_type='image/png',
+        etag=f'{attachment.blob_id}-thumb',
+    )
+
+@login_required
+@require_POST
+def claim_next_request(request):
+    """Assign the oldest unassigned pending request to the current technician"""
+    if not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+
+    category = request.POST.get('category') or None
+    if category and category not in dict(ServiceRequest.CATEGORY_CHOICES):
+        return HttpResponse("Unknown category", status=400)
+
+    req = ServiceRequest.claim_next(request.user, category=category)
+    if req is None:
+        messages.info(request, 'There are no unassigned pending requests in the queue.')
+        return redirect('requests_app:list_requests')
+    messages.success(request, f'Request #{req.id} is now assigned to you.')
+    return redirect('requests_app:detail_request', pk=req.pk)
+
 @login_required
 def my_requests(request):
     # Only show user's own requests (non-staff users)
-    user_name = request.user.get_full_name() or request.user.get_username()
+    user_name = request.user_context.display_name
     qs = ServiceRequest.objects.filter(requester_name=user_name).order_by('-created_at')
+    archived = ArchivedServiceRequest.objects.filter(requester_name=user_name).order_by('-created_at')
+    archived_count = archived.count()
     
     # Calculate counts for the template
-    total_count = qs.count()
+    total_count = qs.count() + archived_count
     pending_count = qs.filter(status='Pending').count()
     in_progress_count = qs.filter(status='In Progress').count()
-    resolved_count = qs.filter(status='Resolved').count()
+    resolved_count = qs.filter(status='Resolved').count() + archived_count
     
     return render(request, 'requests_list.html', {
         'requests': qs, 
+        'archived_requests': archived[:getattr(settings, 'ARCHIVE_SEARCH_LIMIT', 50)],
         'user': request.user, 
         'is_my_requests': True,
         'total_count': total_count,
@@ -282,6 +338,7 @@ def my_requests(request):
     })
 
 @login_required
+@concurrency_limit('request_list')
 def list_requests(request):
     if not request.user.is_staff:
         # Redirect non-staff to their own requests
@@ -298,17 +355,62 @@ def list_requests(request):
     status = request.GET.get('status')
     if status:
         qs = qs.filter(status=status)
+    if request.GET.get('assigned') == 'me':
+        qs = qs.filter(assigned_to=request.user)
+    # Server-side search also covers archived requests
+    search_query = request.GET.get('q', '').strip()
+    archived_requests = []
+    if search_query:
+        qs = qs.filter(archive.search_condition(search_query))
+        archived_requests = archive.search_archive(search_query)
     
     return render(request, 'requests_list.html', {
         'requests': qs, 
+        'archived_requests': archived_requests,
+        'search_query': search_query,
         'user': request.user, 
         'is_my_requests': False,
+        'category_choices': ServiceRequest.CATEGORY_CHOICES,
         'total_count': total_count,
         'pending_count': pending_count,
         'in_progress_count': in_progress_count,
         'resolved_count': resolved_count,
     })
 
+
+def metrics(request):
+    """
+    Request metrics in the Prometheus text format - staff only, or a scraper
+    presenting METRICS_TOKEN as a bearer token
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    has_token = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not has_token and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse("Forbidden", status=403)
+    return HttpResponse(request_metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@login_required
+def reports_index(request):
+    """Staff list of the reports built by build_reports"""
+    if not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+    reports = sorted(report_builder.load_index().values(), key=lambda entry: (entry['start'], entry['period']), reverse=True)
+    return render(request, 'reports/index.html', {'reports': reports, 'user': request.user})
+
+@login_required
+@concurrency_limit('export')
+def report_artifact(request, period, label, fmt):
+    """Serve a prebuilt report file; ?version= picks an older build"""
+    if not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+    path = report_builder.artifact_path(period, label, fmt, request.GET.get('version'))
+    if path is None:
+        raise Http404("Report not found")
+    response = FileResponse(open(path, 'rb'), content_type=report_builder.FORMATS[fmt])
+    if fmt != 'html':
+        response['Content-Disposition'] = f'attachment; filename="report-{period}-{label}.{fmt}"'
+    return response
+
     
 # --- Simple SendGrid example function (HTTP POST) ---
 def send_new_request_email(req):
@@ -346,6 +448,39 @@ def send_resolution_email(req):
     # Similar implementation: notify IT/admin or requester if you stored email (not in spec)
     pass
 
+def send_sla_escalation_email(overdue):
+    """Send one notification listing a batch of requests that breached their SLA"""
+    sg_api_key = getattr(settings, 'SENDGRID_API_KEY', None)
+    if not sg_api_key or not overdue:
+        return
+    lines = [
+        f"#{req.id} {req.category} - {req.requester_name} ({req.department}), due {req.due_at:%Y-%m-%d %H:%M}"
+        for req in overdue
+    ]
+    payload = {
+      "personalizations": [
+        {
+          "to": [{"email": settings.SLA_ESCALATION_EMAIL}],
+          "subject": f"SLA breached: {len(overdue)} request(s) still pending"
+        }
+      ],
+      "from": {"email": settings.DEFAULT_FROM_EMAIL},
+      "content": [
+        {
+          "type": "text/plain",
+          "value": "The following requests are past their SLA deadline:\n" + "\n".join(lines)
+        }
+      ]
+    }
+    headers = {
+      "Authorization": f"Bearer {sg_api_key}",
+      "Content-Type": "application/json"
+    }
+    try:
+        requests.post("https://api.sendgrid.com/v3/mail/send", json=payload, headers=headers, timeout=5)
+    except Exception as e:
+        print("Email send failed:", e)
+
 @login_required
 def user_list(request):
     """
@@ -454,14 +589,19 @@ def user_detail(request, pk):
     user = get_object_or_404(User, pk=pk)
     
     # Get user's service request statistics
-    user_requests = ServiceRequest.objects.filter(requester_name=user.get_full_name() or user.username)
-    total_requests = user_requests.count()
+    user_requests = ServiceRequest.objects.filter(requester_name=display_name(user))
+    archived_requests = ArchivedServiceRequest.objects.filter(requester_name=display_name(user))
+    archived_count = archived_requests.count()
+    total_requests = user_requests.count() + archived_count
     pending_requests = user_requests.filter(status='Pending').count()
     in_progress_requests = user_requests.filter(status='In Progress').count()
-    resolved_requests = user_requests.filter(status='Resolved').count()
+    resolved_requests = user_requests.filter(status='Resolved').count() + archived_count
     
-    # Recent requests
-    recent_requests = user_requests.order_by('-created_at')[:5]
+    # Recent requests, from both tables
+    recent_requests = sorted(
+        [*user_requests.order_by('-created_at')[:5], *archived_requests.order_by('-created_at')[:5]],
+        key=lambda req: req.created_at, reverse=True,
+    )[:5]
     
     context = {
         'user_obj': user,